@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# - coding: utf-8 -
+"""Runs scenes headlessly for a number of frames and reports how the sprite
+engine copes. Results can be saved as JSON and compared against an earlier
+run to catch performance regressions.
+
+    python benchmark.py -o before.json
+    ... hack hack hack ...
+    python benchmark.py -o after.json -c before.json
+
+Every scenario runs in its own process so that peak memory is per scenario.
+"""
+
+import sys
+import math
+import json
+import random
+import resource
+import platform
+import subprocess
+import multiprocessing
+import datetime as dt
+from optparse import OptionParser
+from timeit import default_timer as timer
+
+from lib import graphics
+
+
+def _render_circle(sprite):
+    sprite.graphics.circle(5, 5, 5)
+    sprite.graphics.fill("#333")
+
+def scenario_sprites(scene, count = 1000, depth = 1, cache_as_bitmap = False, light = False):
+    """moving circles. with depth > 1 the sprites are nested in chains.
+    light uses graphics.LightSprite instead of graphics.Sprite"""
+    sprite_class = graphics.LightSprite if light else graphics.Sprite
+    sprites = []
+    for i in range(count):
+        sprite = sprite_class(cache_as_bitmap = cache_as_bitmap,
+                              x = random.randint(0, scene.width),
+                              y = random.randint(0, scene.height))
+        sprite.connect("on-render", _render_circle)
+        if depth > 1 and sprites and i % depth:
+            sprites[-1].add_child(sprite)
+            sprite.x, sprite.y = random.randint(-10, 10), random.randint(-10, 10)
+        else:
+            scene.add_child(sprite)
+        sprites.append(sprite)
+
+    def step(frame):
+        for i, sprite in enumerate(sprites):
+            sprite.rotation = (frame + i) * 0.05
+            sprite.x += math.sin(frame * 0.1 + i)
+    return step
+
+
+def scenario_attribute_writes(scene, count = 10000, light = False):
+    """attribute writes on sprites that are not in the scene, so that only
+    the writes themselves are timed. reports memory taken by the sprites
+    and the writes per second"""
+    sprite_class = graphics.LightSprite if light else graphics.Sprite
+    memory_before = _get_peak_memory_kb()
+    sprites = [sprite_class(x = i, y = i) for i in range(count)]
+    memory = _get_peak_memory_kb() - memory_before
+
+    def step(frame):
+        for sprite in sprites:
+            sprite.x = frame
+            sprite.opacity = (frame % 10) / 10.0
+
+    step.metrics = {"sprite_memory_kb": memory,
+                    "bytes_per_sprite": memory * 1024.0 / count}
+    step.writes_per_frame = count * 2
+    return step
+
+
+def scenario_sprite_batch(scene, count = 100000):
+    """moving circles drawn as instances of a sprite batch"""
+    batch = graphics.SpriteBatch(fill = "#333")
+    batch.template.circle(0, 0, 5)
+    batch.add_instances((random.randint(0, scene.width), random.randint(0, scene.height))
+                        for i in range(count))
+    scene.add_child(batch)
+
+    def step(frame):
+        xs = batch.instance_x
+        for i in range(len(xs)):
+            xs[i] += math.sin(frame * 0.1 + i)
+        batch.update_instances()
+    return step
+
+
+def scenario_labels(scene, count = 500):
+    """labels changing their text"""
+    labels = []
+    for i in range(count):
+        label = graphics.Label("Label %d" % i, 10, "#333",
+                               x = random.randint(0, scene.width),
+                               y = random.randint(0, scene.height))
+        scene.add_child(label)
+        labels.append(label)
+
+    def step(frame):
+        for i, label in enumerate(labels[frame % 10::10]):
+            label.text = "Label %d, frame %d" % (i, frame)
+    return step
+
+
+def scenario_listview(scene, rows = 100000):
+    """scrolling through a long list"""
+    import ui
+    list_item = ui.ListItem(["Row number %d" % i for i in range(rows)])
+    scene.add_child(list_item)
+
+    def step(frame):
+        list_item.scrollbox.scroll_y(-frame * 30)
+    return step
+
+
+def scenario_hit_test(scene, count = 2000):
+    """mouse sweeping over interactive sprites"""
+    for i in range(count):
+        scene.add_child(graphics.Rectangle(10, 10, fill = "#333", interactive = True,
+                                           x = random.randint(0, scene.width),
+                                           y = random.randint(0, scene.height)))
+
+    def step(frame):
+        x = frame * 7 % scene.width
+        scene.mouse_move(x, (x * 3) % scene.height)
+    return step
+
+
+scenarios = dict((name[len("scenario_"):], func) for name, func in globals().items()
+                 if name.startswith("scenario_"))
+
+suite = [
+    ("sprites", {"count": 1000}),
+    ("sprites", {"count": 5000}),
+    ("sprites", {"count": 1000, "depth": 5}),
+    ("sprites", {"count": 1000, "cache_as_bitmap": True}),
+    ("sprites", {"count": 1000, "light": True}),
+    ("attribute_writes", {"count": 10000}),
+    ("attribute_writes", {"count": 10000, "light": True}),
+    ("sprite_batch", {"count": 100000}),
+    ("labels", {"count": 500}),
+    ("listview", {"rows": 100000}),
+    ("hit_test", {"count": 2000}),
+]
+
+
+def _get_peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(name, params, frames = 100, width = 800, height = 600):
+    """run the scenario for given number of frames and return the results"""
+    random.seed(0)
+    scene = graphics.OffscreenScene(width, height, background_color = "#fff")
+
+    setup_start = timer()
+    step = scenarios[name](scene, **params)
+    scene.render()
+    setup_time = timer() - setup_start
+
+    scene.profiler = graphics.FrameProfiler(history = frames)
+    start = timer()
+    for frame in range(frames):
+        step(frame)
+        if not scene.advance():
+            scene.render() # nothing has asked for a redraw, but we want the frame anyway
+    duration = timer() - start
+
+    result = {
+        "scenario": name,
+        "params": params,
+        "frames": frames,
+        "setup_time": setup_time,
+        "duration": duration,
+        "fps": frames / duration if duration else None,
+        "phases": scene.profiler.get_stats(),
+        "peak_memory_kb": _get_peak_memory_kb(),
+    }
+    result.update(getattr(step, "metrics", {}))
+    writes = getattr(step, "writes_per_frame", None)
+    if writes and duration:
+        result["writes_per_second"] = writes * frames / duration
+    return result
+
+
+def _run_isolated(args):
+    return run(*args)
+
+
+def get_label(result):
+    params = ", ".join("%s=%s" % (key, val) for key, val in sorted(result["params"].items()))
+    return "%s(%s)" % (result["scenario"], params)
+
+
+def print_results(results, baseline = None):
+    baseline = dict((get_label(result), result) for result in (baseline or {}).get("results", []))
+
+    print "%-40s %8s %10s %10s %10s" % ("", "fps", "draw p95", "frame p95", "peak KB")
+    for result in results:
+        label = get_label(result)
+        phases = result["phases"]
+        print "%-40s %8.1f %8.2fms %8.2fms %10d" % (label[:40], result["fps"],
+                                                    phases["draw"]["95"] * 1000,
+                                                    phases["frame"]["95"] * 1000,
+                                                    result["peak_memory_kb"])
+        if "writes_per_second" in result:
+            print "%-40s %8.0f writes/s %8.0f bytes/sprite" % ("", result["writes_per_second"],
+                                                             result["bytes_per_sprite"])
+
+        previous = baseline.get(label)
+        if previous:
+            print "%-40s %+7.1f%% %+9.1f%% %+9.1f%% %+9.1f%%" % ("  vs baseline",
+                _change(previous["fps"], result["fps"]),
+                _change(previous["phases"]["draw"]["95"], phases["draw"]["95"]),
+                _change(previous["phases"]["frame"]["95"], phases["frame"]["95"]),
+                _change(previous["peak_memory_kb"], result["peak_memory_kb"]))
+
+
+def _change(before, after):
+    if not before:
+        return 0
+    return (after - before) * 100.0 / before
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage = "usage: %prog [options]")
+    parser.add_option("-f", "--frames", type = "int", default = 100,
+                      help = "number of frames to render per scenario")
+    parser.add_option("-s", "--scenario", action = "append", dest = "scenarios",
+                      help = "run only the given scenario. can be repeated. one of: %s" % ", ".join(sorted(scenarios)))
+    parser.add_option("-o", "--output", help = "save results to the given JSON file")
+    parser.add_option("-c", "--compare", help = "compare against results in the given JSON file")
+    parser.add_option("--size", default = "800x600", help = "scene size. default 800x600")
+    options, args = parser.parse_args()
+
+    width, height = [int(val) for val in options.size.split("x")]
+    runs = [(name, params, options.frames, width, height) for name, params in suite
+            if not options.scenarios or name in options.scenarios]
+
+    # a fresh process per scenario so that the memory peaks don't add up
+    pool = multiprocessing.Pool(1, maxtasksperchild = 1)
+    results = pool.map(_run_isolated, runs, chunksize = 1)
+    pool.close()
+
+    # json turns the percentile keys into strings, do the same here
+    results = json.loads(json.dumps(results))
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({"commit": get_commit(),
+                       "date": dt.datetime.now().isoformat(),
+                       "python": sys.version,
+                       "platform": platform.platform(),
+                       "cairo": graphics.cairo.version,
+                       "results": results}, f, indent = 2)
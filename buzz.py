@@ -9,7 +9,7 @@ import random
 from gi.repository import Gtk as gtk
 from lib import graphics
 from lib import layout
-from lib.pytweener import Easing
+from lib.pytweener import Easing, Timeline
 
 class Rattle(graphics.Sprite):
     def __init__(self, **kwargs):
@@ -25,21 +25,18 @@ class Rattle(graphics.Sprite):
         self.fill = "#ddd"
 
 
-    def buzz(self, sprite=None):
-        graphics.chain([
-            [self, {"_intensity": self.shake_range,
-                    "duration": self.duration,
-                    "easing": self.easing.ease_in,
-                    "on_update": self._update_buzz}],
-            [self, {"_intensity": 0,
-                    "duration": self.duration,
-                    "easing": self.easing.ease_out,
-                    "on_update": self._update_buzz,
-                    "on_complete": self.buzz}]
-        ])
+    def buzz(self):
+        timeline = Timeline(repeat=-1, on_update=self._update_buzz)
+        timeline.add(self, _intensity=self.shake_range,
+                     duration=self.duration,
+                     easing=self.easing.ease_in)
+        timeline.add(self, _intensity=0,
+                     duration=self.duration,
+                     easing=self.easing.ease_out)
+        self.get_scene().play_timeline(timeline)
 
 
-    def _update_buzz(self, sprite):
+    def _update_buzz(self, timeline):
         self.update_buzz()
 
     def rattle(self):
@@ -5,14 +5,21 @@
 # Dual licensed under the MIT or GPL Version 2 licenses.
 # See http://github.com/tbaugis/hamster_experiments/blob/master/README.textile
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import math
+import array
+import itertools
+import heapq
+import json
+import weakref
 import datetime as dt
+from timeit import default_timer as _timer
 
 
 from gi.repository import Gtk as gtk
 from gi.repository import Gdk as gdk
 from gi.repository import GObject as gobject
+from gi.repository import GLib as glib
 from gi.repository import Pango as pango
 from gi.repository import PangoCairo as pangocairo
 
@@ -30,8 +37,11 @@ import colorsys
 from collections import deque
 
 # lemme know if you know a better way how to get default font
-_test_label = gtk.Label("Hello")
-_font_desc = _test_label.get_style().font_desc.to_string()
+try:
+    _test_label = gtk.Label("Hello")
+    _font_desc = _test_label.get_style().font_desc.to_string()
+except: # no display - the offscreen scene can do without the theme
+    _font_desc = "Sans 10"
 
 
 class ColorUtils(object):
@@ -127,6 +137,16 @@ def get_gdk_rectangle(x, y, w, h):
     rect.x, rect.y, rect.width, rect.height = x or 0, y or 0, w or 0, h or 0
     return rect
 
+def _intersect_extents(extents1, extents2):
+    """intersection of two (x, y, width, height) tuples. width and height
+    are zero if the rectangles do not intersect"""
+    x, y = max(extents1[0], extents2[0]), max(extents1[1], extents2[1])
+    x2 = min(extents1[0] + extents1[2], extents2[0] + extents2[2])
+    y2 = min(extents1[1] + extents1[3], extents2[1] + extents2[3])
+    if x2 <= x or y2 <= y:
+        return (x, y, 0, 0)
+    return (x, y, x2 - x, y2 - y)
+
 
 
 
@@ -140,22 +160,27 @@ def chain(*steps):
             object, {params}
     Assumes that all callees accept on_complete named param.
     The last item in the list can omit that.
+    For sequences of plain animations see pytweener.Timeline, that can also
+    be paused, seeked and reversed.
     XXX - figure out where to place these guys as they are quite useful
     """
-    if not steps:
-        return
+    position = [0]
 
-    def on_done(sprite=None):
-        chain(*steps[2:])
+    def next_step(sprite=None):
+        i = position[0]
+        if i >= len(steps):
+            return
+        position[0] = i + 2
 
-    obj, params = steps[:2]
+        obj, params = steps[i], steps[i + 1]
+        if i + 2 < len(steps):
+            params['on_complete'] = next_step
+        if callable(obj):
+            obj(**params)
+        else:
+            obj.animate(**params)
 
-    if len(steps) > 2:
-        params['on_complete'] = on_done
-    if callable(obj):
-        obj(**params)
-    else:
-        obj.animate(**params)
+    next_step()
 
 def full_pixels(space, data, gap_pixels=1):
     """returns the given data distributed in the space ensuring it's full pixels
@@ -192,7 +217,7 @@ class Graphics(object):
     """
     __slots__ = ('context', 'colors', 'extents', 'paths', '_last_matrix',
                  '__new_instructions', '__instruction_cache', 'cache_surface',
-                 '_cache_layout')
+                 '_generation', '_cache_generation', '_compiled')
     colors = Colors # pointer to the color utilities instance
 
     def __init__(self, context = None):
@@ -203,13 +228,17 @@ class Graphics(object):
         self.__new_instructions = [] # instruction set until it is converted into path-based instructions
         self.__instruction_cache = []
         self.cache_surface = None
-        self._cache_layout = None
+        self._generation = 0 # bumped whenever the instruction set changes
+        self._cache_generation = None # generation that the cache surface has been painted from
+        self._compiled = None # (opacity, steps) of the compiled instruction cache
 
     def clear(self):
         """clear all instructions"""
         self.__new_instructions = []
         self.__instruction_cache = []
         self.paths = []
+        self._generation += 1
+        self._compiled = None
 
     def stroke(self, color=None, alpha=1):
         if color or alpha < 1:
@@ -445,18 +474,13 @@ class Graphics(object):
             raise "Can not create layout without existing context!"
 
         layout = pangocairo.create_layout(self.context)
-        font_desc = pango.FontDescription(_font_desc)
-        if size: font_desc.set_absolute_size(size * pango.SCALE)
-
-        layout.set_font_description(font_desc)
+        layout.set_font_description(get_font(None, size).desc)
         return layout
 
     def show_label(self, text, size = None, color = None, font_desc = None):
         """display text. unless font_desc is provided, will use system's default font"""
-        font_desc = pango.FontDescription(font_desc or _font_desc)
         if color: self.set_color(color)
-        if size: font_desc.set_absolute_size(size * pango.SCALE)
-        self.show_layout(text, font_desc)
+        self.show_layout(text, get_font(font_desc, size).desc)
 
     def show_text(self, text):
         self._add_instruction("show_text", text)
@@ -465,22 +489,10 @@ class Graphics(object):
         """this function is most likely to change"""
         self._add_instruction("text_path", text)
 
-    def _show_layout(self, context, layout, text, font_desc, alignment, width, wrap,
+    def _show_layout(self, context, text, font_desc, alignment, width, wrap,
                      ellipsize, single_paragraph_mode):
-        layout.set_font_description(font_desc)
-        layout.set_markup(text)
-        layout.set_width(int(width or -1))
-        layout.set_single_paragraph_mode(single_paragraph_mode)
-        if alignment is not None:
-            layout.set_alignment(alignment)
-
-        if width > 0:
-            if wrap is not None:
-                layout.set_wrap(wrap)
-            else:
-                layout.set_ellipsize(ellipsize or pango.EllipsizeMode.END)
-
-        pangocairo.show_layout(context, layout)
+        text_render_cache.show_layout(context, text, font_desc, alignment, width,
+                                      wrap, ellipsize, single_paragraph_mode)
 
 
     def show_layout(self, text, font_desc, alignment = pango.Alignment.LEFT,
@@ -488,12 +500,17 @@ class Graphics(object):
                     single_paragraph_mode = False):
         """display text. font_desc is string of pango font description
            often handier than calling this function directly, is to create
-           a class:Label object
+           a class:Label object. the shaped text is kept in the
+           :data:`text_render_cache`
         """
-        layout = self._cache_layout = self._cache_layout or pangocairo.create_layout(cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0)))
-        self._add_instruction("show_layout", layout, text, font_desc,
+        self._add_instruction("show_layout", text, font_desc,
                               alignment, width, wrap, ellipsize, single_paragraph_mode)
 
+    def show_pango_layout(self, layout):
+        """display a ready made pango layout at the current point. the layout
+        should not be changed afterwards, as the instruction keeps it"""
+        self._add_instruction("show_pango_layout", layout)
+
 
     def _add_instruction(self, function, *params):
         if self.context:
@@ -501,57 +518,142 @@ class Graphics(object):
                 self._set_color(self.context, *params)
             elif function == "show_layout":
                 self._show_layout(self.context, *params)
+            elif function == "show_pango_layout":
+                pangocairo.show_layout(self.context, *params)
             else:
                 getattr(self.context, function)(*params)
         else:
             self.paths = None
+            self._generation += 1
             self.__new_instructions.append((function, params))
 
 
     def _draw(self, context, opacity):
         """draw accumulated instructions in context"""
-
-        # if we have been moved around, we should update bounds
-        fresh_draw = len(self.__new_instructions or []) > 0
-        if fresh_draw: #new stuff!
-            self.paths = []
+        if self.__new_instructions: #new stuff!
             self.__instruction_cache = self.__new_instructions
             self.__new_instructions = []
-        else:
-            if not self.__instruction_cache:
-                return
+            self._compiled = None
+            self.__draw_capturing_paths(context, opacity)
+            return
+
+        if not self.__instruction_cache:
+            return
+
+        compiled = self._compiled
+        if compiled is None or compiled[0] != opacity:
+            compiled = self._compiled = (opacity, self.__compile(opacity))
+
+        for function, args in compiled[1]:
+            function(context, *args)
+
 
+    def __draw_capturing_paths(self, context, opacity):
+        """first playback of fresh instructions. along the way stores the
+        paths for extents and mouse hit checks"""
+        self.paths = []
         for instruction, args in self.__instruction_cache:
-            if fresh_draw:
-                if instruction in ("new_path", "stroke", "fill", "clip"):
-                    self.paths.append((instruction, "path", context.copy_path()))
+            if instruction in ("new_path", "stroke", "fill", "clip"):
+                self.paths.append((instruction, "path", context.copy_path()))
 
-                elif instruction in ("save", "restore", "translate", "scale", "rotate"):
-                    self.paths.append((instruction, "transform", args))
+            elif instruction in ("save", "restore", "translate", "scale", "rotate"):
+                self.paths.append((instruction, "transform", args))
 
             if instruction == "set_color":
                 self._set_color(context, args[0], args[1], args[2], args[3] * opacity)
-            elif instruction == "show_layout":
-                self._show_layout(context, *args)
             elif opacity < 1 and instruction == "paint":
                 context.paint_with_alpha(opacity)
             else:
-                getattr(context, instruction)(*args)
+                self.__get_function(instruction)(context, *args)
+
+
+    def _get_max_line_width(self):
+        """returns the widest line width the instructions set, in user space.
+        defaults to the line width cairo starts with"""
+        widths = [args[0] for instruction, args in self.__instruction_cache or self.__new_instructions
+                  if instruction == "set_line_width"]
+        return max(widths + [2])
+
+
+    def __get_function(self, instruction):
+        """returns function that performs the instruction when called with the
+        context and instruction arguments"""
+        if instruction == "show_layout":
+            return self._show_layout
+        elif instruction == "show_pango_layout":
+            return pangocairo.show_layout
+        elif instruction == "set_source_pixbuf":
+            return gdk.cairo_set_source_pixbuf
+        return getattr(cairo.Context, instruction)
+
+
+    def __compile(self, opacity):
+        """turns instruction cache into a flat list of (function, args) steps
+        for the given opacity. color and line style changes that would have
+        no effect are left out"""
+        steps = [] # (instruction, function, args)
+        state = {} # what we know about the context source and line style
+
+        for instruction, args in self.__instruction_cache:
+            if instruction == "set_color":
+                r, g, b, a = args[0], args[1], args[2], args[3] * opacity
+                if a < 1:
+                    function, args = cairo.Context.set_source_rgba, (r, g, b, a)
+                else:
+                    function, args = cairo.Context.set_source_rgb, (r, g, b)
+                key = "source"
+            elif instruction in ("set_line_width", "set_dash"):
+                function, key = self.__get_function(instruction), instruction
+            else:
+                if instruction == "paint" and opacity < 1:
+                    function, args = cairo.Context.paint_with_alpha, (opacity, )
+                else:
+                    function = self.__get_function(instruction)
+
+                if instruction == "restore":
+                    state = {}
+                elif instruction in ("set_source", "set_source_surface", "set_source_pixbuf"):
+                    state.pop("source", None)
+
+                steps.append((instruction, function, args))
+                continue
+
+            if state.get(key) == args:
+                continue # setting the same thing again
+
+            if steps and steps[-1][0] == instruction and state.get(key) is not None:
+                steps.pop() # overridden before anything got drawn
+
+            state[key] = args
+            steps.append((instruction, function, args))
 
+        return [(function, args) for instruction, function, args in steps]
 
 
-    def _draw_as_bitmap(self, context, opacity):
+
+    def _draw_as_bitmap(self, context, opacity, reuse_raster = False):
         """
             instead of caching paths, this function caches the whole drawn thing
-            use cache_as_bitmap on sprite to enable this mode
+            use cache_as_bitmap on sprite to enable this mode.
+            with reuse_raster the cached bitmap is transformed to the new place
+            instead of rendering it again when just the matrix has changed
         """
         matrix = context.get_matrix()
         matrix_changed = matrix != self._last_matrix
-        new_instructions = self.__new_instructions is not None and len(self.__new_instructions) > 0
 
-        if not new_instructions and not matrix_changed:
+        # the instructions might have been already played back by a measuring
+        # sprite.get_extents, so look at the generation as well
+        new_instructions = self._cache_generation != self._generation
+
+        reuse_raster = reuse_raster and self.cache_surface is not None and self._last_matrix is not None
+        if not new_instructions and (not matrix_changed or reuse_raster):
             context.save()
             context.identity_matrix()
+            if matrix_changed:
+                # from where the bitmap was rendered to where we are now
+                delta = cairo.Matrix() * self._last_matrix
+                delta.invert()
+                context.transform(delta * matrix)
             context.translate(self.extents.x, self.extents.y)
             context.set_source_surface(self.cache_surface)
             if opacity < 1:
@@ -562,9 +664,11 @@ class Graphics(object):
             return
 
 
-        if new_instructions:
+        if self.__new_instructions:
             self.__instruction_cache = list(self.__new_instructions)
             self.__new_instructions = deque()
+            self._compiled = None
+        self._cache_generation = self._generation
 
         self.paths = []
         self.extents = None
@@ -607,6 +711,8 @@ class Graphics(object):
                 self._set_color(context, args[0], args[1], args[2], args[3] * opacity)
             elif instruction == "show_layout":
                 self._show_layout(context, *args)
+            elif instruction == "show_pango_layout":
+                pangocairo.show_layout(context, *args)
             else:
                 getattr(context, instruction)(*args)
 
@@ -630,19 +736,67 @@ class Graphics(object):
             ctx.translate(-extents.x, -extents.y)
 
             ctx.transform(matrix)
-            for instruction, args in self.__instruction_cache:
-                if instruction == "set_color":
-                    self._set_color(ctx, args[0], args[1], args[2], args[3])
-                elif instruction == "show_layout":
-                    self._show_layout(ctx, *args)
-                else:
-                    getattr(ctx, instruction)(*args)
+            for function, args in self.__compile(1):
+                function(ctx, *args)
 
         self._last_matrix = matrix
 
 
+class SpriteGrid(object):
+    """Uniform grid of sprite extents in scene coordinates. Allows to find the
+    sprites under a point without going through all of them. Used by the
+    scene for hit-testing."""
+    def __init__(self, cell_size = 64):
+        #: width and height of a grid cell in pixels
+        self.cell_size = cell_size
+        self._cells = defaultdict(set)
+        self._sprites = {} # sprite -> (extents, cell keys)
+
+    def update(self, sprite, extents):
+        """place the sprite in the grid by given extents. if extents are None
+        the sprite is removed"""
+        self.remove(sprite)
+        if not extents:
+            return
+
+        size = self.cell_size
+        keys = [(cell_x, cell_y)
+                    for cell_x in range(extents.x // size, (extents.x + extents.width) // size + 1)
+                    for cell_y in range(extents.y // size, (extents.y + extents.height) // size + 1)]
+        for key in keys:
+            self._cells[key].add(sprite)
+        self._sprites[sprite] = (extents, keys)
+
+    def remove(self, sprite):
+        """remove sprite from the grid"""
+        extents, keys = self._sprites.pop(sprite, (None, ()))
+        for key in keys:
+            cell = self._cells[key]
+            cell.discard(sprite)
+            if not cell:
+                del self._cells[key]
+
+    def get_extents(self, sprite):
+        """returns extents the sprite has been placed in the grid with"""
+        return self._sprites.get(sprite, (None, None))[0]
+
+    def get_sprites_at(self, x, y):
+        """returns sprites of the grid cell the point falls in. the sprites
+        might as well not be under the point itself"""
+        return self._cells.get((int(x // self.cell_size), int(y // self.cell_size)), ())
+
+    def __len__(self):
+        return len(self._sprites)
+
+
 class Parent(object):
     """shared functions across scene and sprite"""
+    __slots__ = ()
+
+    def _set_quietly(self, name, val):
+        """set the attribute around __setattr__, for caches and such that
+        do not need any invalidation"""
+        self.__dict__[name] = val
 
     def find(self, id):
         """breadth-first sprite search by ID"""
@@ -697,10 +851,16 @@ class Parent(object):
             self.sprites.append(sprite)
         sprite.parent = self
 
+        scene = self.get_scene()
+        if scene:
+            scene._damage_sprite(sprite)
+
 
     def _sort(self):
         """sort sprites by z_order"""
-        self.__dict__['_z_ordered_sprites'] = sorted(self.sprites, key=lambda sprite:sprite.z_order)
+        self._set_quietly('_z_ordered_sprites', sorted(self.sprites, key=lambda sprite:sprite.z_order))
+        for i, sprite in enumerate(self._z_ordered_sprites):
+            sprite._set_quietly('_z_index', i) # position in drawing order
 
     def add_child(self, *sprites):
         """Add child sprite. Child will be nested within parent"""
@@ -723,6 +883,9 @@ class Parent(object):
 
         for sprite in sprites:
             if sprite in self.sprites:
+                if scene:
+                    # the area the sprite occupied has to be repainted
+                    scene._damage_sprite(sprite)
                 self.sprites.remove(sprite)
                 sprite._scene = None
                 sprite.parent = None
@@ -794,32 +957,48 @@ class Parent(object):
         return "<%s %s>" % (self.__class__.__name__, getattr(self, "id", None) or str(id(self)))
 
 
-class Sprite(Parent, gobject.GObject):
-    """The Sprite class is a basic display list building block: a display list
-       node that can display graphics and can also contain children.
-       Once you have created the sprite, use Scene's add_child to add it to
-       scene
-    """
+_threshold_attrs = frozenset(("x", "y", "pivot_x", "pivot_y", "opacity"))
 
-    __gsignals__ = {
-        "on-mouse-over": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
-        "on-mouse-move": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-mouse-out": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
-        "on-mouse-down": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-double-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-triple-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-mouse-up": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-mouse-scroll": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-drag-start": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-drag": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-drag-finish": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-focus": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
-        "on-blur": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
-        "on-key-press": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-key-release": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-        "on-render": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
-    }
+_tweening = False # set by the scene while the tweener updates the sprites
+
+def _skip_tweened_change(sprite, name, prev, val):
+    """True if a change made by the tweener won't show on screen. the new
+    value is compared to the one on screen, which is prev unless earlier
+    changes have been skipped already"""
+    if not _tweening or name not in _threshold_attrs:
+        return False
+
+    shown = getattr(sprite, '_shown_values', None)
+    if shown is None:
+        shown = {}
+        sprite._set_quietly('_shown_values', shown)
+
+    shown_val = shown.get(name, prev)
+    if _below_visual_threshold(sprite, name, shown_val, val):
+        shown[name] = shown_val
+        return True
+    return False
+
+def _below_visual_threshold(sprite, name, prev, val):
+    """True if the change of the attribute won't show on screen - a pixel
+    snapped sprite moving within the same pixel, or opacity changing by less
+    than a step of the 8 bit alpha"""
+    if not isinstance(prev, (int, float)) or not isinstance(val, (int, float)):
+        return False
+
+    if name in ("x", "y", "pivot_x", "pivot_y"):
+        return sprite.snap_to_pixel and int(prev) == int(val)
+    elif name == "opacity":
+        return round(prev * 255) == round(val * 255)
+    return False
+
+
+class _SpriteBase(Parent):
+    """behaviour shared by :class:`Sprite` and :class:`LightSprite`. the
+    attributes that the methods keep around __setattr__ are set with
+    _set_quietly, which works with both, the instance dictionary and the
+    slots"""
+    __slots__ = ()
 
     transformation_attrs = set(('x', 'y', 'rotation', 'scale_x', 'scale_y', 'pivot_x', 'pivot_y'))
 
@@ -829,313 +1008,204 @@ class Sprite(Parent, gobject.GObject):
 
     graphics_unrelated_attrs = set(('drag_x', 'drag_y', 'sprites', 'mouse_cursor', '_sprite_dirty', 'id'))
 
-    #: mouse-over cursor of the sprite. Can be either a gdk cursor
-    #: constants, or a pixbuf or a pixmap. If set to False, will be using
-    #: scene's cursor. in order to have the cursor displayed, the sprite has
-    #: to be interactive
-    mouse_cursor = None
-
-    #: whether the widget can gain focus
-    can_focus = None
 
-    def __init__(self, x = 0, y = 0, opacity = 1, visible = True, rotation = 0,
-                 pivot_x = 0, pivot_y = 0, scale_x = 1, scale_y = 1,
-                 interactive = False, draggable = False, z_order = 0,
-                 mouse_cursor = None, cache_as_bitmap = False,
-                 snap_to_pixel = True, debug = False, id = None,
-                 can_focus = False):
-        gobject.GObject.__init__(self)
+    def _get_mouse_cursor(self):
+        """Determine mouse cursor.
+        By default look for self.mouse_cursor is defined and take that.
+        Otherwise use gdk.CursorType.FLEUR for draggable sprites and gdk.CursorType.HAND2 for
+        interactive sprites. Defaults to scenes cursor.
+        """
+        if self.mouse_cursor is not None:
+            return self.mouse_cursor
+        elif self.interactive and self.draggable:
+            return gdk.CursorType.FLEUR
+        elif self.interactive:
+            return gdk.CursorType.HAND2
 
-        # a place where to store child handlers
-        self.__dict__['_child_handlers'] = defaultdict(list)
+    def bring_to_front(self):
+        """adjusts sprite's z-order so that the sprite is on top of it's
+        siblings"""
+        if not self.parent:
+            return
+        self.z_order = self.parent._z_ordered_sprites[-1].z_order + 1
 
-        self._scene = None
+    def send_to_back(self):
+        """adjusts sprite's z-order so that the sprite is behind it's
+        siblings"""
+        if not self.parent:
+            return
+        self.z_order = self.parent._z_ordered_sprites[0].z_order - 1
 
-        self.debug = debug
+    def has_focus(self):
+        """True if the sprite has the global input focus, False otherwise."""
+        scene = self.get_scene()
+        return scene and scene._focus_sprite == self
 
-        self.id = id
+    def grab_focus(self):
+        """grab window's focus. Keyboard and scroll events will be forwarded
+        to the sprite who has the focus. Check the 'focused' property of sprite
+        in the on-render event to decide how to render it (say, add an outline
+        when focused=true)"""
+        scene = self.get_scene()
+        if scene and scene._focus_sprite != self:
+            scene._focus_sprite = self
 
-        #: list of children sprites. Use :func:`add_child` to add sprites
-        self.sprites = []
+    def blur(self):
+        """removes focus from the current element if it has it"""
+        scene = self.get_scene()
+        if scene and scene._focus_sprite == self:
+            scene._focus_sprite = None
 
-        self._z_ordered_sprites = []
+    def get_parents(self):
+        """returns all the parent sprites up until scene"""
+        res = []
+        parent = self.parent
+        while parent and isinstance(parent, Scene) == False:
+            res.insert(0, parent)
+            parent = parent.parent
 
-        #: instance of :ref:`graphics` for this sprite
-        self.graphics = Graphics()
+        return res
 
-        #: boolean denoting whether the sprite responds to mouse events
-        self.interactive = interactive
 
-        #: boolean marking if sprite can be automatically dragged
-        self.draggable = draggable
+    def get_extents(self):
+        """measure the extents of the sprite's graphics. The extents are cached
+        until the sprite's graphics or transformations change, so do not modify
+        the returned rectangle."""
+        if self._sprite_dirty:
+            # redrawing merely because we need fresh extents of the sprite
+            self._render()
 
-        #: relative x coordinate of the sprites' rotation point
-        self.pivot_x = pivot_x
+        bounds = self.__get_local_bounds()
+        if not bounds:
+            self._set_quietly('_cached_extents', None)
+            self._set_quietly('_cached_extents_key', None)
+            return None
 
-        #: relative y coordinates of the sprites' rotation point
-        self.pivot_y = pivot_y
+        # the extents follow from the transformations and graphics of the
+        # sprite and its parents. those are cheap to compare, unlike the
+        # matrices and clips that they make up
+        key, sprite = [], self
+        while sprite and isinstance(sprite, Scene) == False:
+            key.append((sprite.get_local_matrix(), sprite.graphics._generation,
+                        sprite.graphics.paths is not None))
+            sprite = sprite.parent
+        key = tuple(key)
+        if key == self._cached_extents_key:
+            return self._cached_extents
 
-        #: sprite opacity
-        self.opacity = opacity
+        # bit of a hack around the problem - looking for clip instructions in parent
+        # so extents would not get out of it
+        clip_extents = None
+        for parent in self.get_parents():
+            parent_clip = parent.__get_clip_extents()
+            if parent_clip:
+                clip_extents = _intersect_extents(clip_extents or parent_clip, parent_clip)
 
-        #: boolean visibility flag
-        self.visible = visible
+        matrix = self.get_matrix()
 
-        #: pointer to parent :class:`Sprite` or :class:`Scene`
-        self.parent = None
+        # only the transformations have changed - map the local bounds
+        # through the matrix instead of replaying the paths
+        x1, y1, x2, y2 = bounds
+        points = [matrix.transform_point(x, y) for x, y in ((x1, y1), (x2, y1), (x1, y2), (x2, y2))]
+        min_x, min_y = min(x for x, y in points), min(y for x, y in points)
+        max_x, max_y = max(x for x, y in points), max(y for x, y in points)
 
-        #: sprite coordinates
-        self.x, self.y = x, y
+        ext = (int(min_x), int(min_y), int(max_x - min_x), int(max_y - min_y))
+        if clip_extents:
+            ext = _intersect_extents(clip_extents, ext)
 
-        #: rotation of the sprite in radians (use :func:`math.degrees` to convert to degrees if necessary)
-        self.rotation = rotation
+        if not ext[2] and not ext[3]:
+            ext = None
+        else:
+            ext = get_gdk_rectangle(*ext)
 
-        #: scale X
-        self.scale_x = scale_x
+        self._set_quietly('_cached_extents', ext)
+        self._set_quietly('_cached_extents_key', key)
+        return ext
 
-        #: scale Y
-        self.scale_y = scale_y
 
-        #: drawing order between siblings. The one with the highest z_order will be on top.
-        self.z_order = z_order
+    def __get_local_bounds(self):
+        """returns (x1, y1, x2, y2) bounds of the sprite's paths in its own
+        coordinates. the paths get replayed only when the graphics change"""
+        graphics = self.graphics
+        if self._local_bounds_generation != graphics._generation:
+            if not graphics.paths:
+                graphics._draw(cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0)), 1)
 
-        #: x position of the cursor within mouse upon drag. change this value
-        #: in on-drag-start to adjust drag point
-        self.drag_x = 0
+            context, bounds = None, None
+            if graphics.paths:
+                context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
+                for instruction, type, path in graphics.paths:
+                    if type == "path":
+                        context.append_path(path)
+                    else:
+                        getattr(context, instruction)(*path)
+                context.identity_matrix()
+                bounds = context.path_extents()
 
-        #: y position of the cursor within mouse upon drag. change this value
-        #: in on-drag-start to adjust drag point
-        self.drag_y = 0
+            # the stroke context is in sprite's coordinates, see check_hit
+            self._set_quietly('_stroke_context', context)
+            self._set_quietly('_local_bounds', bounds)
+            self._set_quietly('_local_bounds_generation', graphics._generation)
 
-        #: Whether the sprite should be cached as a bitmap. Default: true
-        #: Generally good when you have many static sprites
-        self.cache_as_bitmap = cache_as_bitmap
+        return self._local_bounds
 
-        #: Should the sprite coordinates always rounded to full pixel. Default: true
-        #: Mostly this is good for performance but in some cases that can lead
-        #: to rounding errors in positioning.
-        self.snap_to_pixel = snap_to_pixel
 
-        #: focus state
-        self.focused = False
+    def __get_clip_extents(self):
+        """returns scene-space (x, y, width, height) of the clip that sprite's
+        graphics leave on for its children, or None if there is no clip"""
+        matrix = self.get_matrix()
+        key = (matrix, self.graphics._generation, self.graphics.paths is not None)
+        if key == self._clip_extents_key:
+            return self._clip_extents
 
+        clip_extents = None
+        if self.graphics.paths:
+            context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
+            context.transform(matrix)
 
-        if mouse_cursor is not None:
-            self.mouse_cursor = mouse_cursor
+            clip_regions = []
+            for instruction, type, path in self.graphics.paths:
+                if instruction == "clip":
+                    context.append_path(path)
+                    context.save()
+                    context.identity_matrix()
 
-        if can_focus is not None:
-            self.can_focus = can_focus
+                    clip_regions.append(context.fill_extents())
+                    context.restore()
+                    context.new_path()
+                elif instruction == "restore" and clip_regions:
+                    clip_regions.pop()
 
+            for ext in clip_regions:
+                ext = (int(ext[0]), int(ext[1]), int(ext[2] - ext[0]), int(ext[3] - ext[1]))
+                clip_extents = _intersect_extents(clip_extents or ext, ext)
 
+        self._set_quietly('_clip_extents', clip_extents)
+        self._set_quietly('_clip_extents_key', key)
+        return clip_extents
 
-        self.__dict__["_sprite_dirty"] = True # flag that indicates that the graphics object of the sprite should be rendered
 
-        self._matrix = None
-        self._prev_parent_matrix = None
+    def check_hit(self, x, y):
+        """check if the given coordinates are inside the sprite's fill or stroke path"""
+        extents = self.get_extents()
 
-        self._stroke_context = None
+        if not extents:
+            return False
 
-        self.connect("on-click", self.__on_click)
+        if extents.x <= x <= extents.x + extents.width and extents.y <= y <= extents.y + extents.height:
+            if self._stroke_context is None:
+                return True
 
-
-
-    def __setattr__(self, name, val):
-        if isinstance(getattr(type(self), name, None), property) and \
-           getattr(type(self), name).fset is not None:
-            getattr(type(self), name).fset(self, val)
-            return
-
-        prev = self.__dict__.get(name, "hamster_graphics_no_value_really")
-        if type(prev) == type(val) and prev == val:
-            return
-        self.__dict__[name] = val
-
-        # prev parent matrix walks downwards
-        if name == '_prev_parent_matrix' and self.visible:
-            # downwards recursive invalidation of parent matrix
-            for sprite in self.sprites:
-                sprite._prev_parent_matrix = None
-
-
-        if name in self.cache_attrs or name in self.graphics_unrelated_attrs:
-            return
-
-        """all the other changes influence cache vars"""
-
-        if name == 'visible' and self.visible == False:
-            # when transforms happen while sprite is invisible
-            for sprite in self.sprites:
-                sprite._prev_parent_matrix = None
-
-
-        # on moves invalidate our matrix, child extent cache (as that depends on our transforms)
-        # as well as our parent's child extents as we moved
-        # then go into children and invalidate the parent matrix down the tree
-        if name in self.transformation_attrs:
-            self._matrix = None
-            for sprite in self.sprites:
-                sprite._prev_parent_matrix = None
-        elif name not in self.visibility_attrs:
-            # if attribute is not in transformation nor visibility, we conclude
-            # that it must be causing the sprite needs re-rendering
-            self.__dict__["_sprite_dirty"] = True
-
-        # on parent change invalidate the matrix
-        if name == 'parent':
-            self._prev_parent_matrix = None
-            return
-
-        if name == 'opacity' and getattr(self, "cache_as_bitmap", None) and hasattr(self, "graphics"):
-            # invalidating cache for the bitmap version as that paints opacity in the image
-            self.graphics._last_matrix = None
-
-        if name == 'z_order' and getattr(self, "parent", None):
-            self.parent._sort()
-
-
-        self.redraw()
-
-
-    def _get_mouse_cursor(self):
-        """Determine mouse cursor.
-        By default look for self.mouse_cursor is defined and take that.
-        Otherwise use gdk.CursorType.FLEUR for draggable sprites and gdk.CursorType.HAND2 for
-        interactive sprites. Defaults to scenes cursor.
-        """
-        if self.mouse_cursor is not None:
-            return self.mouse_cursor
-        elif self.interactive and self.draggable:
-            return gdk.CursorType.FLEUR
-        elif self.interactive:
-            return gdk.CursorType.HAND2
-
-    def bring_to_front(self):
-        """adjusts sprite's z-order so that the sprite is on top of it's
-        siblings"""
-        if not self.parent:
-            return
-        self.z_order = self.parent._z_ordered_sprites[-1].z_order + 1
-
-    def send_to_back(self):
-        """adjusts sprite's z-order so that the sprite is behind it's
-        siblings"""
-        if not self.parent:
-            return
-        self.z_order = self.parent._z_ordered_sprites[0].z_order - 1
-
-    def has_focus(self):
-        """True if the sprite has the global input focus, False otherwise."""
-        scene = self.get_scene()
-        return scene and scene._focus_sprite == self
-
-    def grab_focus(self):
-        """grab window's focus. Keyboard and scroll events will be forwarded
-        to the sprite who has the focus. Check the 'focused' property of sprite
-        in the on-render event to decide how to render it (say, add an outline
-        when focused=true)"""
-        scene = self.get_scene()
-        if scene and scene._focus_sprite != self:
-            scene._focus_sprite = self
-
-    def blur(self):
-        """removes focus from the current element if it has it"""
-        scene = self.get_scene()
-        if scene and scene._focus_sprite == self:
-            scene._focus_sprite = None
-
-    def __on_click(self, sprite, event):
-        if self.interactive and self.can_focus:
-            self.grab_focus()
-
-    def get_parents(self):
-        """returns all the parent sprites up until scene"""
-        res = []
-        parent = self.parent
-        while parent and isinstance(parent, Scene) == False:
-            res.insert(0, parent)
-            parent = parent.parent
-
-        return res
-
-
-    def get_extents(self):
-        """measure the extents of the sprite's graphics."""
-        if self._sprite_dirty:
-            # redrawing merely because we need fresh extents of the sprite
-            context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
-            context.transform(self.get_matrix())
-            self.emit("on-render")
-            self.__dict__["_sprite_dirty"] = False
-            self.graphics._draw(context, 1)
-
-
-        if not self.graphics.paths:
-            self.graphics._draw(cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0)), 1)
-
-        if not self.graphics.paths:
-            return None
-
-        context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
-
-        # bit of a hack around the problem - looking for clip instructions in parent
-        # so extents would not get out of it
-        clip_extents = None
-        for parent in self.get_parents():
-            context.transform(parent.get_local_matrix())
-            if parent.graphics.paths:
-                clip_regions = []
-                for instruction, type, path in parent.graphics.paths:
-                    if instruction == "clip":
-                        context.append_path(path)
-                        context.save()
-                        context.identity_matrix()
-
-                        clip_regions.append(context.fill_extents())
-                        context.restore()
-                        context.new_path()
-                    elif instruction == "restore" and clip_regions:
-                        clip_regions.pop()
-
-                for ext in clip_regions:
-                    ext = get_gdk_rectangle(int(ext[0]), int(ext[1]), int(ext[2] - ext[0]), int(ext[3] - ext[1]))
-                    intersect, clip_extents = gdk.rectangle_intersect((clip_extents or ext), ext)
-
-        context.transform(self.get_local_matrix())
-
-        for instruction, type, path in self.graphics.paths:
-            if type == "path":
-                context.append_path(path)
-            else:
-                getattr(context, instruction)(*path)
-
-        context.identity_matrix()
-
-
-        ext = context.path_extents()
-        ext = get_gdk_rectangle(int(ext[0]), int(ext[1]),
-                                int(ext[2] - ext[0]), int(ext[3] - ext[1]))
-        if clip_extents:
-            intersect, ext = gdk.rectangle_intersect(clip_extents, ext)
-
-        if not ext.width and not ext.height:
-            ext = None
-
-        self.__dict__['_stroke_context'] = context
-
-        return ext
-
-
-    def check_hit(self, x, y):
-        """check if the given coordinates are inside the sprite's fill or stroke path"""
-        extents = self.get_extents()
-
-        if not extents:
-            return False
-
-        if extents.x <= x <= extents.x + extents.width and extents.y <= y <= extents.y + extents.height:
-            return self._stroke_context is None or self._stroke_context.in_fill(x, y)
-        else:
-            return False
+            # the stroke context holds the paths in sprite's own coordinates
+            matrix = self.get_matrix()
+            try:
+                matrix.invert()
+            except cairo.Error: # scaled down to nothing
+                return False
+            return self._stroke_context.in_fill(*matrix.transform_point(x, y))
+        else:
+            return False
 
     def get_scene(self):
         """returns class:`Scene` the sprite belongs to"""
@@ -1150,10 +1220,38 @@ class Sprite(Parent, gobject.GObject):
            whenever a sprite attribute changes. sprite changes that happen
            during scene redraw are ignored in order to avoid echoes.
            Call scene.redraw() explicitly if you need to redraw in these cases.
+           When the scene has :attr:`Scene.partial_redraw` enabled, only the
+           area of the sprite and its children is repainted.
         """
+        self._invalidate_layers()
+
         scene = self.get_scene()
         if scene:
-            scene.redraw()
+            scene._damage_sprite(self)
+
+    def _render(self):
+        """emit on-render so that the sprite would redo its graphics"""
+        scene = self.get_scene()
+        profiler = scene.profiler if scene else None
+        if profiler:
+            start = _timer()
+            profiler.start_phase("render")
+
+        self.emit("on-render")
+        self._set_quietly("_sprite_dirty", False)
+
+        if profiler:
+            profiler.end_phase("render")
+            profiler.sprite_rendered(self, _timer() - start)
+
+    def _invalidate_layers(self):
+        """drop the offscreen layers of the sprite and its parents as the
+        sprite's contents have changed"""
+        sprite = self
+        while isinstance(sprite, _SpriteBase):
+            if sprite._layer:
+                sprite._set_quietly('_layer', None)
+            sprite = getattr(sprite, "parent", None)
 
     def animate(self, duration = None, easing = None, on_complete = None,
                 on_update = None, round = False, **kwargs):
@@ -1232,8 +1330,7 @@ class Sprite(Parent, gobject.GObject):
             return
 
         if (self._sprite_dirty): # send signal to redo the drawing when sprite is dirty
-            self.emit("on-render")
-            self.__dict__["_sprite_dirty"] = False
+            self._render()
 
 
         no_matrix = parent_matrix is None
@@ -1247,15 +1344,43 @@ class Sprite(Parent, gobject.GObject):
         context.save()
         context.transform(matrix)
 
-
-        if self.cache_as_bitmap:
-            self.graphics._draw_as_bitmap(context, self.opacity * opacity)
+        if self.cache_subtree:
+            self.__draw_layer(context, self.opacity * opacity, matrix * parent_matrix)
         else:
-            self.graphics._draw(context, self.opacity * opacity)
+            self.__draw_subtree(context, self.opacity * opacity, matrix * parent_matrix)
+
+        context.restore()
+
+        # having parent and not being given parent matrix means that somebody
+        # is calling draw directly - avoid caching matrix for such a case
+        # because when we will get called properly it won't be respecting
+        # the parent's transformations otherwise
+        if isinstance(self.parent, (Sprite, LightSprite)) and no_matrix:
+            self._prev_parent_matrix = None
+
+    def __draw_subtree(self, context, opacity, matrix):
+        """draws sprite's graphics and its children. the context is expected
+        to be in sprite's coordinates and matrix to be the sprite's matrix"""
+        # when repainting just the damaged areas, skip the sprites that
+        # are out of the clip. children have their own extents so we still go
+        # into them
+        in_clip = True
+        scene = self.get_scene()
+        degraded = scene.degraded if scene else False
+        if scene and scene._draw_clip:
+            extents = self.get_extents()
+            if extents:
+                in_clip, intersection = gdk.rectangle_intersect(scene._draw_clip, extents)
+
+        if in_clip:
+            if self.cache_as_bitmap:
+                self.graphics._draw_as_bitmap(context, opacity, degraded)
+            else:
+                self.graphics._draw(context, opacity)
 
         context.new_path() #forget about us
 
-        if self.debug:
+        if self.debug and not degraded:
             exts = self.get_extents()
             if exts:
                 debug_colors = ["#c17d11", "#73d216", "#3465a4",
@@ -1279,17 +1404,134 @@ class Sprite(Parent, gobject.GObject):
                 context.restore()
 
         for sprite in self._z_ordered_sprites:
-            sprite._draw(context, self.opacity * opacity, matrix * parent_matrix)
-
+            sprite._draw(context, opacity, matrix)
+
+
+    def __draw_layer(self, context, opacity, matrix):
+        """draws the sprite and its children through an offscreen surface that
+        is reused for as long as only the position of the sprite changes"""
+        device_matrix = context.get_matrix()
+
+        layer, dx, dy = self._layer, 0, 0
+        if layer:
+            surface, x, y, layer_matrix, clamped, generation, scene_size = layer
+            dx, dy = device_matrix[4] - layer_matrix[4], device_matrix[5] - layer_matrix[5]
+
+            # rotation and scale would need resampling and so would moves
+            # by partial pixels. parts of a clamped layer might come into
+            # view on any move or scene resize. graphics of the subtree
+            # could have been changed directly, without a redraw
+            if any(device_matrix[i] != layer_matrix[i] for i in range(4)) \
+               or dx != int(dx) or dy != int(dy) or (clamped and (dx or dy)) \
+               or (clamped and scene_size != self.__get_scene_size()) \
+               or generation != self.__get_subtree_generation():
+                layer, dx, dy = None, 0, 0
+
+        if not layer:
+            layer = self.__render_layer(context, device_matrix, matrix)
+            self._set_quietly('_layer', layer)
+
+        surface, x, y = layer[:3]
+        if surface is None:
+            return
 
+        context.save()
+        context.identity_matrix()
+        context.set_source_surface(surface, x + dx, y + dy)
+        if opacity < 1:
+            context.paint_with_alpha(opacity)
+        else:
+            context.paint()
         context.restore()
 
-        # having parent and not being given parent matrix means that somebody
-        # is calling draw directly - avoid caching matrix for such a case
-        # because when we will get called properly it won't be respecting
-        # the parent's transformations otherwise
-        if isinstance(self.parent, Sprite) and no_matrix:
-            self._prev_parent_matrix = None
+
+    def __render_layer(self, context, device_matrix, matrix):
+        """renders the subtree into a surface similar to the target.
+        returns layer tuple as stored in _layer"""
+        empty_layer = (None, 0, 0, device_matrix, False,
+                       self.__get_subtree_generation(), self.__get_scene_size())
+
+        # union of the scene-space extents of the visible subtree. extents
+        # follow the paths, so pad them by half of the widest stroke and a
+        # couple of pixels for the antialiasing
+        bounds, sprites = None, [self]
+        while sprites:
+            sprite = sprites.pop()
+            extents = sprite.get_extents()
+            if extents:
+                pad = sprite._get_stroke_padding()
+                ext = (extents.x - pad, extents.y - pad,
+                       extents.x + extents.width + pad, extents.y + extents.height + pad)
+                if bounds:
+                    ext = (min(bounds[0], ext[0]), min(bounds[1], ext[1]),
+                           max(bounds[2], ext[2]), max(bounds[3], ext[3]))
+                bounds = ext
+            sprites.extend(child for child in sprite.sprites if child.visible)
+
+        scene = self.get_scene()
+        if not bounds or not scene:
+            return empty_layer
+
+        # do not go further than the scene
+        clamped = False
+        if scene.width and scene.height:
+            clipped = (max(bounds[0], 0), max(bounds[1], 0),
+                       min(bounds[2], scene.width), min(bounds[3], scene.height))
+            clamped = clipped != bounds
+            bounds = clipped
+            if bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+                return empty_layer
+
+        # map the bounds from scene space onto the device
+        scene_to_device = cairo.Matrix() * matrix
+        try:
+            scene_to_device.invert()
+        except cairo.Error: # scaled down to nothing
+            return empty_layer
+        scene_to_device = scene_to_device * device_matrix
+
+        x1, y1, x2, y2 = bounds
+        points = [scene_to_device.transform_point(x, y) for x, y in ((x1, y1), (x2, y1), (x1, y2), (x2, y2))]
+        x, y = int(math.floor(min(x for x, y in points))), int(math.floor(min(y for x, y in points)))
+        width = int(math.ceil(max(x for x, y in points))) - x
+        height = int(math.ceil(max(y for x, y in points))) - y
+
+        surface = context.get_target().create_similar(cairo.CONTENT_COLOR_ALPHA, width, height)
+        layer_context = cairo.Context(surface)
+        layer_context.set_matrix(device_matrix * cairo.Matrix(x0 = -x, y0 = -y))
+
+        # the layer has to be complete even when just a part of the scene
+        # is being repainted
+        draw_clip, scene._draw_clip = scene._draw_clip, None
+        self.__draw_subtree(layer_context, 1, matrix)
+        scene._draw_clip = draw_clip
+
+        # the generation is taken after drawing, as that renders the dirty sprites
+        return (surface, x, y, device_matrix, clamped,
+                self.__get_subtree_generation(), self.__get_scene_size())
+
+    def _get_stroke_padding(self):
+        """returns how far in scene space the strokes and antialiasing of the
+        sprite's graphics can reach out of its extents - half of the widest
+        line plus a couple of pixels"""
+        matrix = self.get_matrix()
+        scale = max(math.hypot(matrix[0], matrix[1]), math.hypot(matrix[2], matrix[3]))
+        return self.graphics._get_max_line_width() * scale / 2.0 + 2
+
+    def __get_subtree_generation(self):
+        """sum of the graphics generations of the sprite and its children.
+        as generations only go up, it changes with any change of the graphics"""
+        generation, sprites = 0, [self]
+        while sprites:
+            sprite = sprites.pop()
+            generation += sprite.graphics._generation
+            sprites.extend(sprite.sprites)
+        return generation
+
+    def __get_scene_size(self):
+        scene = self.get_scene()
+        return (scene.width, scene.height) if scene else None
+
 
     # using _do functions so that subclassees can override these
     def _do_mouse_down(self, event): self.emit("on-mouse-down", event)
@@ -1311,38 +1553,510 @@ class Sprite(Parent, gobject.GObject):
         return False
 
 
-class BitmapSprite(Sprite):
-    """Caches given image data in a surface similar to targets, which ensures
-       that drawing it will be quick and low on CPU.
-       Image data can be either :class:`cairo.ImageSurface` or :class:`GdkPixbuf.Pixbuf`
+class Sprite(_SpriteBase, gobject.GObject):
+    """The Sprite class is a basic display list building block: a display list
+       node that can display graphics and can also contain children.
+       Once you have created the sprite, use Scene's add_child to add it to
+       scene
     """
-    def __init__(self, image_data = None, cache_mode = None, **kwargs):
-        Sprite.__init__(self, **kwargs)
 
-        self.width, self.height = 0, 0
-        self.cache_mode = cache_mode or cairo.CONTENT_COLOR_ALPHA
-        #: image data
-        self.image_data = image_data
+    __gsignals__ = {
+        "on-mouse-over": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+        "on-mouse-move": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-mouse-out": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+        "on-mouse-down": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-double-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-triple-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-mouse-up": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-mouse-scroll": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-drag-start": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-drag": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-drag-finish": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-focus": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+        "on-blur": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+        "on-key-press": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-key-release": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "on-render": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+    }
 
-        self._surface = None
+    #: mouse-over cursor of the sprite. Can be either a gdk cursor
+    #: constants, or a pixbuf or a pixmap. If set to False, will be using
+    #: scene's cursor. in order to have the cursor displayed, the sprite has
+    #: to be interactive
+    mouse_cursor = None
 
-        self.connect("on-render", self.on_render)
+    #: whether the widget can gain focus
+    can_focus = None
 
+    #: Whether the sprite together with all its children should be rendered
+    #: into an offscreen layer. The layer is reused while the sprite is only
+    #: moved around and is rendered anew when anything within it changes.
+    #: Good for mostly static subtrees like toolbars and panels
+    cache_subtree = False
 
-    def on_render(self, sprite):
-        if not self._surface:
-            self.graphics.rectangle(0, 0, self.width, self.height)
-            self.graphics.new_path()
+    # offscreen layer of the subtree when cache_subtree is on.
+    # (surface, x, y, device matrix, clamped, graphics generation of the
+    # subtree, scene size), see __draw_layer
+    _layer = None
 
-    def update_surface_cache(self):
-        """for efficiency the image data is cached on a surface similar to the
-        target one. so if you do custom drawing after setting the image data,
-        it won't be reflected as the sprite has no idea about what is going on
-        there. call this function to trigger cache refresh."""
-        self._surface = None
+    def __init__(self, x = 0, y = 0, opacity = 1, visible = True, rotation = 0,
+                 pivot_x = 0, pivot_y = 0, scale_x = 1, scale_y = 1,
+                 interactive = False, draggable = False, z_order = 0,
+                 mouse_cursor = None, cache_as_bitmap = False,
+                 snap_to_pixel = True, debug = False, id = None,
+                 can_focus = False, cache_subtree = False):
+        gobject.GObject.__init__(self)
 
+        # a place where to store child handlers
+        self.__dict__['_child_handlers'] = defaultdict(list)
 
-    def __setattr__(self, name, val):
+        self._scene = None
+
+        self.debug = debug
+
+        self.id = id
+
+        #: list of children sprites. Use :func:`add_child` to add sprites
+        self.sprites = []
+
+        self._z_ordered_sprites = []
+
+        #: instance of :ref:`graphics` for this sprite
+        self.graphics = Graphics()
+
+        #: boolean denoting whether the sprite responds to mouse events
+        self.interactive = interactive
+
+        #: boolean marking if sprite can be automatically dragged
+        self.draggable = draggable
+
+        #: relative x coordinate of the sprites' rotation point
+        self.pivot_x = pivot_x
+
+        #: relative y coordinates of the sprites' rotation point
+        self.pivot_y = pivot_y
+
+        #: sprite opacity
+        self.opacity = opacity
+
+        #: boolean visibility flag
+        self.visible = visible
+
+        #: pointer to parent :class:`Sprite` or :class:`Scene`
+        self.parent = None
+
+        #: sprite coordinates
+        self.x, self.y = x, y
+
+        #: rotation of the sprite in radians (use :func:`math.degrees` to convert to degrees if necessary)
+        self.rotation = rotation
+
+        #: scale X
+        self.scale_x = scale_x
+
+        #: scale Y
+        self.scale_y = scale_y
+
+        #: drawing order between siblings. The one with the highest z_order will be on top.
+        self.z_order = z_order
+
+        #: x position of the cursor within mouse upon drag. change this value
+        #: in on-drag-start to adjust drag point
+        self.drag_x = 0
+
+        #: y position of the cursor within mouse upon drag. change this value
+        #: in on-drag-start to adjust drag point
+        self.drag_y = 0
+
+        #: Whether the sprite should be cached as a bitmap. Default: true
+        #: Generally good when you have many static sprites
+        self.cache_as_bitmap = cache_as_bitmap
+
+        #: Should the sprite coordinates always rounded to full pixel. Default: true
+        #: Mostly this is good for performance but in some cases that can lead
+        #: to rounding errors in positioning.
+        self.snap_to_pixel = snap_to_pixel
+
+        if cache_subtree:
+            self.cache_subtree = cache_subtree
+
+        #: focus state
+        self.focused = False
+
+
+        if mouse_cursor is not None:
+            self.mouse_cursor = mouse_cursor
+
+        if can_focus is not None:
+            self.can_focus = can_focus
+
+
+
+        self.__dict__["_sprite_dirty"] = True # flag that indicates that the graphics object of the sprite should be rendered
+
+        self._matrix = None
+        self._prev_parent_matrix = None
+
+        self._stroke_context = None
+
+        # extents caches. scene-space extents of the sprite as last measured
+        # and the (matrix, graphics generation, parent clip) key they were
+        # measured with. also used by the scene for damage tracking and the
+        # hit-test index
+        self.__dict__['_cached_extents'] = None
+        self.__dict__['_cached_extents_key'] = None
+
+        # {attribute: value on screen} of the tweened attributes whose
+        # changes have been too small to show
+        self.__dict__['_shown_values'] = None
+
+        # bounds of the paths in sprite's coordinates
+        self.__dict__['_local_bounds'] = None
+        self.__dict__['_local_bounds_generation'] = None
+
+        # scene-space clip that the sprite imposes on its children
+        self.__dict__['_clip_extents'] = None
+        self.__dict__['_clip_extents_key'] = None
+
+        self.connect("on-click", self.__on_click)
+
+
+
+    def __setattr__(self, name, val):
+        if isinstance(getattr(type(self), name, None), property) and \
+           getattr(type(self), name).fset is not None:
+            getattr(type(self), name).fset(self, val)
+            return
+
+        prev = self.__dict__.get(name, "hamster_graphics_no_value_really")
+        if type(prev) == type(val) and prev == val:
+            return
+        self.__dict__[name] = val
+
+        if _skip_tweened_change(self, name, prev, val):
+            return
+
+        # prev parent matrix walks downwards
+        if name == '_prev_parent_matrix' and self.visible:
+            # downwards recursive invalidation of parent matrix
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+
+
+        if name in self.cache_attrs or name in self.graphics_unrelated_attrs:
+            return
+
+        """all the other changes influence cache vars"""
+
+        shown = self.__dict__.get('_shown_values')
+        if shown:
+            # the sprite gets drawn again with the current values
+            shown.clear()
+
+        if name == 'visible' and self.visible == False:
+            # when transforms happen while sprite is invisible
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+
+
+        # on moves invalidate our matrix, child extent cache (as that depends on our transforms)
+        # as well as our parent's child extents as we moved
+        # then go into children and invalidate the parent matrix down the tree
+        if name in self.transformation_attrs:
+            self._matrix = None
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+        elif name not in self.visibility_attrs:
+            # if attribute is not in transformation nor visibility, we conclude
+            # that it must be causing the sprite needs re-rendering
+            self.__dict__["_sprite_dirty"] = True
+
+        # on parent change invalidate the matrix
+        if name == 'parent':
+            self._prev_parent_matrix = None
+            return
+
+        if name == 'opacity' and getattr(self, "cache_as_bitmap", None) and hasattr(self, "graphics"):
+            # invalidating cache for the bitmap version as that paints opacity in the image
+            self.graphics._last_matrix = None
+
+        if name == 'z_order' and getattr(self, "parent", None):
+            self.parent._sort()
+
+
+        if self._layer and (name in self.transformation_attrs or name in self.visibility_attrs):
+            # moving the layer around does not change what is in it
+            layer = self._layer
+            self.redraw()
+            self.__dict__['_layer'] = layer
+        else:
+            self.redraw()
+
+
+    def __on_click(self, sprite, event):
+        if self.interactive and self.can_focus:
+            self.grab_focus()
+
+
+_handler_ids = itertools.count(1)
+
+def _get_settable_properties(cls):
+    """names of the properties with setters of the class, collected once per
+    class instead of looking them up on every attribute write"""
+    properties = cls.__dict__.get('_settable_properties')
+    if properties is None:
+        properties = frozenset(key for klass in cls.__mro__
+                                   for key, val in vars(klass).items()
+                                   if isinstance(val, property) and val.fset)
+        cls._settable_properties = properties
+    return properties
+
+class LightSprite(_SpriteBase):
+    """A lighter alternative to :class:`Sprite` for when there are lots of
+    them. It is not a GObject - the attributes are kept in slots and the
+    signals are dispatched in plain python, so it takes several times less
+    memory and attribute writes are quicker. Apart from that it behaves the
+    same as Sprite, can be mixed with sprites in the tree and supports the
+    same signals via connect, connect_after, disconnect and emit.
+
+    Subclasses that do not declare __slots__ of their own get a regular
+    instance dictionary for their extra attributes.
+    Not meant for widgets - those rely on gobject properties and signals.
+    """
+    __slots__ = ('_scene', 'debug', 'id', 'sprites', '_z_ordered_sprites',
+                 'graphics', 'interactive', 'draggable', 'pivot_x', 'pivot_y',
+                 'opacity', 'visible', 'parent', 'x', 'y', 'rotation',
+                 'scale_x', 'scale_y', 'z_order', 'drag_x', 'drag_y',
+                 'cache_as_bitmap', 'cache_subtree', 'snap_to_pixel', 'focused',
+                 'mouse_cursor', 'can_focus', '_sprite_dirty', '_matrix',
+                 '_prev_parent_matrix', '_stroke_context', '_cached_extents',
+                 '_cached_extents_key', '_local_bounds', '_local_bounds_generation',
+                 '_clip_extents', '_clip_extents_key', '_z_index', '_layer', '_shown_values',
+                 '_signal_handlers', '_child_handlers_store', '__weakref__')
+
+    #: names of the signals that can be connected to. Extend in subclasses
+    #: to add signals of your own
+    signals = frozenset(Sprite.__gsignals__)
+
+    def __init__(self, x = 0, y = 0, opacity = 1, visible = True, rotation = 0,
+                 pivot_x = 0, pivot_y = 0, scale_x = 1, scale_y = 1,
+                 interactive = False, draggable = False, z_order = 0,
+                 mouse_cursor = None, cache_as_bitmap = False,
+                 snap_to_pixel = True, debug = False, id = None,
+                 can_focus = False, cache_subtree = False):
+        # see Sprite for the meaning of the attributes. they are set around
+        # __setattr__ as there is nothing to invalidate yet
+        init = object.__setattr__
+        init(self, '_scene', None)
+        init(self, 'debug', debug)
+        init(self, 'id', id)
+        init(self, 'sprites', ()) # becomes a list with the first child
+        init(self, '_z_ordered_sprites', ())
+        init(self, 'graphics', Graphics())
+        init(self, 'interactive', interactive)
+        init(self, 'draggable', draggable)
+        init(self, 'pivot_x', pivot_x)
+        init(self, 'pivot_y', pivot_y)
+        init(self, 'opacity', opacity)
+        init(self, 'visible', visible)
+        init(self, 'parent', None)
+        init(self, 'x', x)
+        init(self, 'y', y)
+        init(self, 'rotation', rotation)
+        init(self, 'scale_x', scale_x)
+        init(self, 'scale_y', scale_y)
+        init(self, 'z_order', z_order)
+        init(self, 'drag_x', 0)
+        init(self, 'drag_y', 0)
+        init(self, 'cache_as_bitmap', cache_as_bitmap)
+        init(self, 'cache_subtree', cache_subtree)
+        init(self, 'snap_to_pixel', snap_to_pixel)
+        init(self, 'focused', False)
+        init(self, 'mouse_cursor', mouse_cursor)
+        init(self, 'can_focus', can_focus)
+        init(self, '_sprite_dirty', True)
+        init(self, '_matrix', None)
+        init(self, '_prev_parent_matrix', None)
+        init(self, '_stroke_context', None)
+        init(self, '_cached_extents', None)
+        init(self, '_cached_extents_key', None)
+        init(self, '_local_bounds', None)
+        init(self, '_local_bounds_generation', None)
+        init(self, '_clip_extents', None)
+        init(self, '_clip_extents_key', None)
+        init(self, '_z_index', None)
+        init(self, '_layer', None)
+        init(self, '_shown_values', None)
+        init(self, '_signal_handlers', None)
+        init(self, '_child_handlers_store', None)
+
+
+    # the attributes are in slots. object.__setattr__ can't be used on the
+    # gobject based sprites and the scene, hence the method
+    _set_quietly = object.__setattr__
+
+    def __setattr__(self, name, val):
+        if name in _get_settable_properties(type(self)):
+            object.__setattr__(self, name, val)
+            return
+
+        prev = getattr(self, name, "hamster_graphics_no_value_really")
+        if type(prev) == type(val) and prev == val:
+            return
+        object.__setattr__(self, name, val)
+
+        if _skip_tweened_change(self, name, prev, val):
+            return
+
+        # prev parent matrix walks downwards
+        if name == '_prev_parent_matrix' and self.visible:
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+
+        if name in self.cache_attrs or name in self.graphics_unrelated_attrs:
+            return
+
+        shown = getattr(self, '_shown_values', None)
+        if shown:
+            shown.clear()
+
+        if name == 'visible' and val == False:
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+
+        if name in self.transformation_attrs:
+            object.__setattr__(self, '_matrix', None)
+            for sprite in self.sprites:
+                sprite._prev_parent_matrix = None
+        elif name not in self.visibility_attrs:
+            object.__setattr__(self, '_sprite_dirty', True)
+
+        if name == 'parent':
+            self._prev_parent_matrix = None
+            return
+
+        if name == 'opacity' and self.cache_as_bitmap:
+            self.graphics._last_matrix = None
+
+        if name == 'z_order' and self.parent:
+            self.parent._sort()
+
+        if self._layer and (name in self.transformation_attrs or name in self.visibility_attrs):
+            # moving the layer around does not change what is in it
+            layer = self._layer
+            self.redraw()
+            object.__setattr__(self, '_layer', layer)
+        else:
+            self.redraw()
+
+
+    @property
+    def _child_handlers(self):
+        if self._child_handlers_store is None:
+            object.__setattr__(self, '_child_handlers_store', defaultdict(list))
+        return self._child_handlers_store
+
+    def _add(self, sprite, index = None):
+        if not self.sprites:
+            object.__setattr__(self, 'sprites', [])
+        Parent._add(self, sprite, index)
+
+
+    def connect(self, signal, callback, *args):
+        """connect callback to the signal. the callback receives the sprite,
+        the signal arguments and then the args given here. returns handler
+        id that can be used to disconnect"""
+        return self.__connect(signal, callback, args, False)
+
+    def connect_after(self, signal, callback, *args):
+        """connect callback that is called after the ones connected with
+        :func:`connect`"""
+        return self.__connect(signal, callback, args, True)
+
+    def __connect(self, signal, callback, args, after):
+        if signal not in self.signals:
+            raise TypeError("%s: unknown signal name: %s" % (self.__class__.__name__, signal))
+
+        if self._signal_handlers is None:
+            object.__setattr__(self, '_signal_handlers', defaultdict(list))
+
+        handler_id = next(_handler_ids)
+        self._signal_handlers[signal].append((handler_id, callback, args, after))
+        return handler_id
+
+    def disconnect(self, handler_id):
+        """disconnect handler by id"""
+        for signal, handlers in (self._signal_handlers or {}).items():
+            for handler in handlers:
+                if handler[0] == handler_id:
+                    handlers.remove(handler)
+                    if not handlers:
+                        del self._signal_handlers[signal]
+                    return
+
+    handler_disconnect = disconnect
+
+    def handler_is_connected(self, handler_id):
+        return any(handler[0] == handler_id
+                   for handlers in (self._signal_handlers or {}).values()
+                   for handler in handlers)
+
+    def emit(self, signal, *args):
+        """call handlers of the signal with given arguments"""
+        if signal not in self.signals:
+            raise TypeError("%s: unknown signal name: %s" % (self.__class__.__name__, signal))
+
+        handlers = self._signal_handlers and self._signal_handlers.get(signal)
+        if not handlers:
+            return
+
+        # copy, as handlers might connect or disconnect on the way
+        handlers = list(handlers)
+        for run_after in (False, True):
+            for handler_id, callback, handler_args, after in handlers:
+                if after == run_after:
+                    callback(self, *(args + handler_args))
+
+
+    def _do_click(self, event):
+        if self.interactive and self.can_focus:
+            self.grab_focus()
+        self.emit("on-click", event)
+
+
+class BitmapSprite(Sprite):
+    """Caches given image data in a surface similar to targets, which ensures
+       that drawing it will be quick and low on CPU.
+       Image data can be either :class:`cairo.ImageSurface` or :class:`GdkPixbuf.Pixbuf`
+    """
+    def __init__(self, image_data = None, cache_mode = None, **kwargs):
+        Sprite.__init__(self, **kwargs)
+
+        self.width, self.height = 0, 0
+        self.cache_mode = cache_mode or cairo.CONTENT_COLOR_ALPHA
+        #: image data
+        self.image_data = image_data
+
+        self._surface = None
+
+        self.connect("on-render", self.on_render)
+
+
+    def on_render(self, sprite):
+        if not self._surface:
+            self.graphics.rectangle(0, 0, self.width, self.height)
+            self.graphics.new_path()
+
+    def update_surface_cache(self):
+        """for efficiency the image data is cached on a surface similar to the
+        target one. so if you do custom drawing after setting the image data,
+        it won't be reflected as the sprite has no idea about what is going on
+        there. call this function to trigger cache refresh."""
+        self._surface = None
+
+
+    def __setattr__(self, name, val):
         if self.__dict__.get(name, "hamster_graphics_no_value_really") == val:
             return
 
@@ -1397,25 +2111,344 @@ class Image(BitmapSprite):
 
 
 
-class Icon(BitmapSprite):
-    """Displays icon by name and size in the theme"""
-    def __init__(self, name, size=24, **kwargs):
-        BitmapSprite.__init__(self, **kwargs)
-        self.theme = gtk.IconTheme.get_default()
+class Icon(BitmapSprite):
+    """Displays icon by name and size in the theme"""
+    def __init__(self, name, size=24, **kwargs):
+        BitmapSprite.__init__(self, **kwargs)
+        self.theme = gtk.IconTheme.get_default()
+
+        #: icon name from theme
+        self.name = name
+
+        #: icon size in pixels
+        self.size = size
+
+    def __setattr__(self, name, val):
+        BitmapSprite.__setattr__(self, name, val)
+        if name in ('name', 'size'): # no other reason to discard cache than just on path change
+            if self.__dict__.get('name') and self.__dict__.get('size'):
+                self.image_data = self.theme.load_icon(self.name, self.size, 0)
+            else:
+                self.image_data = None
+
+
+def _font_key(font_desc):
+    """hashable key of the font description. the string form alone does not
+    tell absolute sizes apart"""
+    return font_desc.to_string(), font_desc.get_size(), font_desc.get_size_is_absolute()
+
+
+class Font(object):
+    """An interned font - use :func:`get_font` to get one. Holds the shared
+    pango description and the font metrics, so that sizes can be estimated
+    without laying out any text"""
+    __slots__ = ('desc', '_metrics')
+
+    def __init__(self, desc):
+        #: the pango.FontDescription. it is shared by everybody using the
+        #: font so do not modify it - copy it first
+        self.desc = desc
+        self._metrics = None
+
+    def _get_metrics(self):
+        if self._metrics is None:
+            global _font_context
+            if _font_context is None:
+                _font_context = pangocairo.create_context(text_measure_cache._context)
+
+            metrics = _font_context.get_metrics(self.desc, None)
+            self._metrics = (metrics.get_ascent() / float(pango.SCALE),
+                             metrics.get_descent() / float(pango.SCALE),
+                             metrics.get_approximate_char_width() / float(pango.SCALE))
+        return self._metrics
+
+    @property
+    def ascent(self):
+        """pixels above the baseline"""
+        return self._get_metrics()[0]
+
+    @property
+    def descent(self):
+        """pixels below the baseline"""
+        return self._get_metrics()[1]
+
+    @property
+    def line_height(self):
+        """ascent and descent together"""
+        ascent, descent, char_width = self._get_metrics()
+        return ascent + descent
+
+    @property
+    def char_width(self):
+        """average width of a character in pixels"""
+        return self._get_metrics()[2]
+
+    def estimate_size(self, text):
+        """rough width and height of the text, for when a pango layout would
+        be too expensive. does not account for markup or wrapping"""
+        ascent, descent, char_width = self._get_metrics()
+        lines = text.split("\n")
+        return max(len(line) for line in lines) * char_width, len(lines) * (ascent + descent)
+
+    def __repr__(self):
+        return "<Font %s>" % self.desc.to_string()
+
+
+_fonts = {}
+_font_context = None
+
+def get_font(font_desc = None, size = None):
+    """returns the interned :class:`Font` for the given pango font
+    description string or pango.FontDescription, by default the system
+    font. size is the absolute size in pixels and overrides the size of
+    the description. the same font is always the same object"""
+    if isinstance(font_desc, Font):
+        font_desc = font_desc.desc
+
+    if isinstance(font_desc, pango.FontDescription):
+        key = _font_key(font_desc), size
+    else:
+        font_desc = font_desc or _font_desc
+        key = font_desc, size
+
+    font = _fonts.get(key)
+    if font is None:
+        if isinstance(font_desc, pango.FontDescription):
+            desc = font_desc.copy()
+        else:
+            desc = pango.FontDescription(font_desc)
+        if size:
+            desc.set_absolute_size(size * pango.SCALE)
+
+        # descriptions that end up the same share the font
+        font = _fonts.setdefault((_font_key(desc), None), Font(desc))
+        _fonts[key] = font
+    return font
+
+
+class TextMeasureCache(object):
+    """Least recently used cache of text sizes, shared by all the labels so
+    that the same strings in the same fonts are measured by pango just once.
+    The measuring layouts are pooled on a single test context."""
+    def __init__(self, max_size = 4096, pool_size = 4):
+        #: maximum number of sizes to keep
+        self.max_size = max_size
+
+        #: number of cache hits since the last :func:`clear`
+        self.hits = 0
+
+        #: number of cache misses since the last :func:`clear`
+        self.misses = 0
+
+        self._sizes = OrderedDict()
+        self._context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 0, 0))
+        self._pool, self._pool_size = [], pool_size
+
+    def acquire_layout(self):
+        """returns a layout from the pool, for measuring. hand it back with
+        :func:`release_layout` when done"""
+        if self._pool:
+            return self._pool.pop()
+        return pangocairo.create_layout(self._context)
+
+    def release_layout(self, layout):
+        if len(self._pool) < self._pool_size:
+            self._pool.append(layout)
+
+    def measure(self, font_desc, markup, width = -1, wrap = None, ellipsize = None,
+                alignment = pango.Alignment.LEFT, single_paragraph = False):
+        """returns pixel width and height of the markup. width is in pango
+        units, -1 for unconstrained. see :func:`configure_layout` for the rest"""
+        key = (_font_key(font_desc), markup, width, wrap, ellipsize, alignment, single_paragraph)
+
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self.hits += 1
+            self._sizes[key] = size # most recently used goes last
+            return size
+
+        self.misses += 1
+        layout = self.acquire_layout()
+        self.configure_layout(layout, font_desc, markup, width, wrap, ellipsize,
+                              alignment, single_paragraph)
+        size = layout.get_pixel_size()
+        self.release_layout(layout)
+
+        self._sizes[key] = size
+        if len(self._sizes) > self.max_size:
+            self._sizes.popitem(last = False)
+        return size
+
+    def configure_layout(self, layout, font_desc, markup, width = -1, wrap = None,
+                         ellipsize = None, alignment = pango.Alignment.LEFT,
+                         single_paragraph = False):
+        """set up the layout the way labels do. wrap takes precedence over
+        ellipsize, which defaults to ellipsizing at the end"""
+        layout.set_font_description(font_desc)
+        layout.set_markup(markup)
+        layout.set_single_paragraph_mode(single_paragraph)
+        layout.set_alignment(alignment or pango.Alignment.LEFT)
+
+        if wrap is not None:
+            layout.set_wrap(wrap)
+            layout.set_ellipsize(pango.EllipsizeMode.NONE)
+        else:
+            layout.set_ellipsize(ellipsize or pango.EllipsizeMode.END)
+
+        layout.set_width(int(width))
+
+    def get_stats(self):
+        """returns dict with hits, misses, hit_rate, size and max_size"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(lookups) if lookups else None,
+                "size": len(self._sizes),
+                "max_size": self.max_size}
+
+    def clear(self):
+        """drop all the sizes and reset the statistics. call when fonts
+        change, for example on theme or resolution switch"""
+        self._sizes.clear()
+        self.hits, self.misses = 0, 0
+
+
+#: the process-wide :class:`TextMeasureCache` used by the labels
+text_measure_cache = TextMeasureCache()
+
+
+class TextRenderCache(object):
+    """Keeps the shaped pango layouts of :func:`Graphics.show_layout`, so that
+    text that has not changed is not shaped again on every repaint. With
+    :attr:`masks` on, also keeps the text rasterized into alpha masks per
+    scale, and repaints are just a mask paint in the current source.
+    Least recently used entries go once :attr:`max_bytes` is exceeded."""
+    def __init__(self, max_bytes = 16 * 1024 * 1024, masks = False):
+        #: memory budget in bytes. layout sizes are an estimate, masks are
+        #: counted by their surface size
+        self.max_bytes = max_bytes
+
+        #: rasterize the text into alpha masks. off by default as the masks
+        #: are grayscale antialiased and lose subpixel antialiasing and
+        #: hinting of the target surface. masks are used only where the
+        #: text lands on whole device pixels and is not rotated
+        self.masks = masks
+
+        #: bytes currently taken by the cached layouts and masks
+        self.bytes = 0
+
+        #: number of cache hits since the last :func:`clear`
+        self.hits = 0
+
+        #: number of cache misses since the last :func:`clear`
+        self.misses = 0
+
+        self._entries = OrderedDict() # key -> (value, bytes)
+        self._context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
+
+    def show_layout(self, context, text, font_desc, alignment = pango.Alignment.LEFT,
+                    width = -1, wrap = None, ellipsize = None,
+                    single_paragraph_mode = False):
+        """draw the markup at the current point of the context"""
+        key = (text, _font_key(font_desc), alignment, width, wrap, ellipsize,
+               single_paragraph_mode)
+        layout = self._get(key)
+        if layout is None:
+            layout = self._create_layout(text, font_desc, alignment, width, wrap,
+                                         ellipsize, single_paragraph_mode)
+            self._add(key, layout, 1024 + 64 * len(text))
+
+        if self.masks:
+            matrix = context.get_matrix()
+            x, y = context.get_current_point()
+            device_x, device_y = matrix.transform_point(x, y)
+            if matrix.xy == 0 and matrix.yx == 0 and matrix.xx > 0 and matrix.yy > 0 \
+               and device_x == round(device_x) and device_y == round(device_y):
+                self._paint_mask(context, key, layout, x, y, matrix.xx, matrix.yy)
+                return
+
+        pangocairo.show_layout(context, layout)
+
+    def _create_layout(self, text, font_desc, alignment, width, wrap, ellipsize,
+                       single_paragraph_mode):
+        layout = pangocairo.create_layout(self._context)
+        layout.set_font_description(font_desc)
+        layout.set_markup(text)
+        layout.set_width(int(width or -1))
+        layout.set_single_paragraph_mode(single_paragraph_mode)
+        if alignment is not None:
+            layout.set_alignment(alignment)
+
+        if width > 0:
+            if wrap is not None:
+                layout.set_wrap(wrap)
+            else:
+                layout.set_ellipsize(ellipsize or pango.EllipsizeMode.END)
+        return layout
+
+    def _paint_mask(self, context, layout_key, layout, x, y, scale_x, scale_y):
+        key = ("mask", layout_key, round(scale_x, 3), round(scale_y, 3))
+        mask = self._get(key)
+        if mask is None:
+            ink, logical = layout.get_pixel_extents()
+            # a pixel of slack around as the scaled glyphs don't quite
+            # match the ink extents measured at scale 1
+            mask_x = int(math.floor(ink.x * scale_x)) - 1
+            mask_y = int(math.floor(ink.y * scale_y)) - 1
+            mask_w = int(math.ceil((ink.x + ink.width) * scale_x)) + 1 - mask_x
+            mask_h = int(math.ceil((ink.y + ink.height) * scale_y)) + 1 - mask_y
+
+            surface = cairo.ImageSurface(cairo.FORMAT_A8, max(mask_w, 1), max(mask_h, 1))
+            mask_context = cairo.Context(surface)
+            mask_context.translate(-mask_x, -mask_y)
+            mask_context.scale(scale_x, scale_y)
+            pangocairo.show_layout(mask_context, layout)
+
+            mask = (surface, mask_x, mask_y)
+            self._add(key, mask, surface.get_stride() * surface.get_height())
+
+        surface, mask_x, mask_y = mask
+        context.save()
+        context.translate(x, y)
+        context.scale(1.0 / scale_x, 1.0 / scale_y)
+        context.mask_surface(surface, mask_x, mask_y)
+        context.restore()
+
+    def _get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries[key] = entry # most recently used goes last
+        return entry[0]
+
+    def _add(self, key, value, size):
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            key, (value, size) = self._entries.popitem(last = False)
+            self.bytes -= size
+
+    def get_stats(self):
+        """returns dict with hits, misses, hit_rate, entries, bytes and max_bytes"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(lookups) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes}
 
-        #: icon name from theme
-        self.name = name
+    def clear(self):
+        """drop all the layouts and masks and reset the statistics"""
+        self._entries.clear()
+        self.bytes, self.hits, self.misses = 0, 0, 0
 
-        #: icon size in pixels
-        self.size = size
 
-    def __setattr__(self, name, val):
-        BitmapSprite.__setattr__(self, name, val)
-        if name in ('name', 'size'): # no other reason to discard cache than just on path change
-            if self.__dict__.get('name') and self.__dict__.get('size'):
-                self.image_data = self.theme.load_icon(self.name, self.size, 0)
-            else:
-                self.image_data = None
+#: the process-wide :class:`TextRenderCache` used by :func:`Graphics.show_layout`
+text_render_cache = TextRenderCache()
 
 
 class Label(Sprite):
@@ -1423,7 +2456,7 @@ class Label(Sprite):
         "on-change": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
     }
 
-    cache_attrs = Sprite.cache_attrs | set(("_letter_sizes", "__surface", "_ascent", "_bounds_width", "_measures"))
+    cache_attrs = Sprite.cache_attrs | set(("_letter_sizes", "__surface", "_ascent", "_bounds_width", "_layout"))
 
     def __init__(self, text = "", size = None, color = None,
                  alignment = pango.Alignment.LEFT, single_paragraph = False,
@@ -1432,17 +2465,16 @@ class Label(Sprite):
         Sprite.__init__(self, **kwargs)
         self.width, self.height = None, None
 
-
-        self._test_context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 0, 0))
-        self._test_layout = pangocairo.create_layout(self._test_context)
-
+        self._layout = None
 
         #: absolute font size in pixels. this will execute set_absolute_size
         #: instead of set_size, which is fractional
         self.size = size
 
-        #: pango.FontDescription, defaults to system font
-        self.font_desc = pango.FontDescription(font_desc or _font_desc)
+        #: pango.FontDescription, defaults to system font. the description
+        #: is shared with the other labels using the same font, see
+        #: :func:`get_font`
+        self.font_desc = font_desc
 
         #: color of label either as hex string or an (r,g,b) tuple
         self.color = color
@@ -1481,18 +2513,13 @@ class Label(Sprite):
         #: label contents marked up using pango markup. upon setting will replace text
         self.markup = markup
 
-        self._measures = {}
-
         self.connect("on-render", self.on_render)
 
-        self.graphics_unrelated_attrs = self.graphics_unrelated_attrs | set(("__surface", "_bounds_width", "_measures"))
+        self.graphics_unrelated_attrs = self.graphics_unrelated_attrs | set(("__surface", "_bounds_width", "_layout"))
 
     def __setattr__(self, name, val):
         if name == "font_desc":
-            if isinstance(val, basestring):
-                val = pango.FontDescription(val)
-            elif isinstance(val, pango.FontDescription):
-                val = val.copy()
+            val = get_font(val, self.__dict__.get("size")).desc
 
         if self.__dict__.get(name, "hamster_graphics_no_value_really") != val:
             if name == "width" and val and self.__dict__.get('_bounds_width') and val * pango.SCALE == self.__dict__['_bounds_width']:
@@ -1509,12 +2536,13 @@ class Label(Sprite):
                     self.__dict__['_bounds_width'] = val * pango.SCALE
 
 
-            if name in ("width", "text", "markup", "size", "font_desc", "wrap", "ellipsize", "max_width"):
-                self._measures = {}
+            if name in ("width", "text", "markup", "size", "font_desc", "wrap",
+                        "ellipsize", "max_width", "alignment", "single_paragraph"):
+                self.__dict__['_layout'] = None
                 # avoid chicken and egg
                 if hasattr(self, "size") and (hasattr(self, "text") or hasattr(self, "markup")):
                     if self.size:
-                        self.font_desc.set_absolute_size(self.size * pango.SCALE)
+                        self.__dict__['font_desc'] = get_font(self.font_desc, self.size).desc
                     markup = getattr(self, "markup", "")
                     self.__dict__['width'], self.__dict__['height'] = self.measure(markup or getattr(self, "text", ""), escape = len(markup) == 0)
 
@@ -1538,39 +2566,31 @@ class Label(Sprite):
         if escape:
             text = text.replace ("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
-        if (max_width, text) in self._measures:
-            return self._measures[(max_width, text)]
-
-        width, height = None, None
-
-        context = self._test_context
-
-        layout = self._test_layout
-        layout.set_font_description(self.font_desc)
-        layout.set_markup(text)
-        layout.set_single_paragraph_mode(self.single_paragraph)
-
-        if self.alignment:
-            layout.set_alignment(self.alignment)
-
-        if self.wrap is not None:
-            layout.set_wrap(self.wrap)
-            layout.set_ellipsize(pango.EllipsizeMode.NONE)
-        else:
-            layout.set_ellipsize(self.ellipsize or pango.EllipsizeMode.END)
+        return text_measure_cache.measure(self.font_desc, text,
+                                          self._get_layout_width(max_width),
+                                          self.wrap, self.ellipsize,
+                                          self.alignment, self.single_paragraph)
 
+    def _get_layout_width(self, max_width = None):
         if max_width is not None:
-            layout.set_width(max_width * pango.SCALE)
-        else:
-            if self.max_width:
-                max_width = self.max_width * pango.SCALE
-
-            layout.set_width(int(self._bounds_width or max_width or -1))
-
-        width, height = layout.get_pixel_size()
-
-        self._measures[(max_width, text)] = width, height
-        return self._measures[(max_width, text)]
+            return max_width * pango.SCALE
+        if self.max_width:
+            max_width = self.max_width * pango.SCALE
+        return int(self._bounds_width or max_width or -1)
+
+    @property
+    def _test_layout(self):
+        """layout of the current text, for cursor and hit positions. made on
+        demand, the measurements themselves go through the shared cache"""
+        if self._layout is None:
+            markup = self.markup or self.text.replace ("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            layout = pangocairo.create_layout(text_measure_cache._context)
+            text_measure_cache.configure_layout(layout, self.font_desc, markup,
+                                                self._get_layout_width(),
+                                                self.wrap, self.ellipsize,
+                                                self.alignment, self.single_paragraph)
+            self.__dict__['_layout'] = layout
+        return self._layout
 
 
     def on_render(self, sprite):
@@ -1709,6 +2729,677 @@ class Circle(Sprite):
         self.graphics.fill_stroke(self.fill, self.stroke, line_width = self.line_width)
 
 
+class SpriteBatch(Sprite):
+    """Draws many instances of the same shape in one go. The shape is drawn
+    once into the :attr:`template` graphics (just the path, do not fill or
+    stroke it) and every instance has its own position, rotation, scale,
+    opacity and color. Instances are not sprites - they don't have matrices
+    or signals of their own and are kept in compact arrays, which makes it
+    feasible to have tens of thousands of them.
+    Mouse events are fired on the batch itself, use :func:`get_instance_at`
+    to find out which instance is under the cursor.
+
+    Example::
+
+        batch = graphics.SpriteBatch(fill="#eee", interactive=True)
+        batch.template.circle(0, 0, 5)
+        batch.add_instances((random.randint(0, 800), random.randint(0, 600))
+                            for i in range(10000))
+    """
+    def __init__(self, fill = None, stroke = None, line_width = 1, **kwargs):
+        Sprite.__init__(self, **kwargs)
+
+        #: instance of :class:`Graphics` holding the path of the shape. The
+        #: path is drawn around (0, 0) of the instance
+        self.template = Graphics()
+
+        #: default fill color of the instances
+        self.fill = fill
+
+        #: stroke color of the instances
+        self.stroke = stroke
+
+        #: stroke line width
+        self.line_width = line_width
+
+        #: per-instance x coordinates. The instance arrays can be modified in
+        #: place for bulk updates - call :func:`update_instances` afterwards
+        self.instance_x = array.array('d')
+
+        #: per-instance y coordinates
+        self.instance_y = array.array('d')
+
+        #: per-instance rotation in radians
+        self.instance_rotation = array.array('d')
+
+        #: per-instance scale
+        self.instance_scale = array.array('d')
+
+        #: per-instance opacity
+        self.instance_opacity = array.array('d')
+
+        #: per-instance colors as normalized (r, g, b) tuples. None means
+        #: the instance is filled with the batch's fill color
+        self.instance_color = []
+
+        # template path, its bounds and a context holding it for hit tests
+        self.__dict__['_template_path'] = None
+        self.__dict__['_template_context'] = None
+        self.__dict__['_template_radius'] = 0
+        self.__dict__['_template_generation'] = None
+
+        # lazily built (cells, cell_size) grid of instances for hit tests
+        self.__dict__['_instance_cells'] = None
+
+        # instances have changed since the last render and the redraw has
+        # been queued already
+        self.__dict__['_instances_changed'] = False
+
+        self.connect("on-render", self.on_render)
+
+
+    def add_instance(self, x = 0, y = 0, rotation = 0, scale = 1, opacity = 1, color = None):
+        """add an instance and return its index"""
+        self.__append_instance(x, y, rotation, scale, opacity, color)
+        self.update_instances()
+        return len(self.instance_x) - 1
+
+    def add_instances(self, instances):
+        """add many instances at once. instances is an iterable of tuples
+        with the arguments of :func:`add_instance` - (x, y) or up to
+        (x, y, rotation, scale, opacity, color). returns index of the first
+        added instance"""
+        first = len(self.instance_x)
+        for instance in instances:
+            self.__append_instance(*instance)
+        self.update_instances()
+        return first
+
+    def __append_instance(self, x = 0, y = 0, rotation = 0, scale = 1, opacity = 1, color = None):
+        self.instance_x.append(x)
+        self.instance_y.append(y)
+        self.instance_rotation.append(rotation)
+        self.instance_scale.append(scale)
+        self.instance_opacity.append(opacity)
+        self.instance_color.append(tuple(Colors.parse(color)) if color is not None else None)
+
+    def set_instance(self, index, **kwargs):
+        """change attributes of the instance at given index. accepts x, y,
+        rotation, scale, opacity and color"""
+        for key, val in kwargs.items():
+            if key == "color":
+                self.instance_color[index] = tuple(Colors.parse(val)) if val is not None else None
+            elif key in ("x", "y", "rotation", "scale", "opacity"):
+                getattr(self, "instance_%s" % key)[index] = val
+            else:
+                raise AttributeError("SpriteBatch instances have no attribute %s" % key)
+        self.update_instances()
+
+    def remove_instance(self, index):
+        """remove instance at given index. indexes of the instances after it
+        shift down by one"""
+        for instances in (self.instance_x, self.instance_y, self.instance_rotation,
+                          self.instance_scale, self.instance_opacity, self.instance_color):
+            del instances[index]
+        self.update_instances()
+
+    def clear_instances(self):
+        """remove all instances"""
+        for instances in (self.instance_x, self.instance_y, self.instance_rotation,
+                          self.instance_scale, self.instance_opacity):
+            del instances[:]
+        del self.instance_color[:]
+        self.update_instances()
+
+    def update_instances(self):
+        """call this after modifying the instance arrays directly. the bounds
+        are recomputed once, when the batch renders"""
+        self.__dict__['_instance_cells'] = None
+        self.__dict__["_sprite_dirty"] = True
+        if not self._instances_changed:
+            self.__dict__['_instances_changed'] = True
+            self.redraw()
+
+
+    def get_instance_at(self, x, y):
+        """returns index of the topmost instance at the given coordinates
+        (in batch's coordinates, such as those of mouse events) or None"""
+        self.__update_template()
+        if self._template_context is None or not self.instance_x:
+            return None
+
+        if self._instance_cells is None:
+            # bucket the instances by their position. an instance reaches
+            # only into the neighbouring cells
+            cell_size = max(self._template_radius * max(self.instance_scale), 1) * 2
+            cells = defaultdict(list)
+            for i, (instance_x, instance_y) in enumerate(zip(self.instance_x, self.instance_y)):
+                cells[(int(instance_x // cell_size), int(instance_y // cell_size))].append(i)
+            self.__dict__['_instance_cells'] = cells, cell_size
+
+        cells, cell_size = self._instance_cells
+        cell_x, cell_y = int(x // cell_size), int(y // cell_size)
+        candidates = []
+        for cx in range(cell_x - 1, cell_x + 2):
+            for cy in range(cell_y - 1, cell_y + 2):
+                candidates.extend(cells.get((cx, cy), []))
+
+        for i in sorted(candidates, reverse=True): # later instances are on top
+            scale = self.instance_scale[i]
+            if self.instance_opacity[i] <= 0 or not scale:
+                continue
+
+            # move the point into instance's coordinates
+            dx, dy = x - self.instance_x[i], y - self.instance_y[i]
+            rotation = self.instance_rotation[i]
+            if rotation:
+                cos, sin = math.cos(rotation), math.sin(rotation)
+                dx, dy = dx * cos + dy * sin, dy * cos - dx * sin
+
+            if self._template_context.in_fill(dx / scale, dy / scale):
+                return i
+
+        return None
+
+    def check_hit(self, x, y):
+        if not Sprite.check_hit(self, x, y):
+            return False
+        return self.get_instance_at(*self.from_scene_coords(x, y)) is not None
+
+
+    def __update_template(self):
+        """replays the template into a path that can be appended to the
+        context for each instance"""
+        if self._template_generation == self.template._generation:
+            return
+
+        context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 0, 0))
+        self.template._draw(context, 1)
+
+        path, radius = None, 0
+        x1, y1, x2, y2 = context.path_extents()
+        if x1 != x2 or y1 != y2:
+            path = context.copy_path()
+            radius = max(math.sqrt(x * x + y * y) for x, y in ((x1, y1), (x2, y1), (x1, y2), (x2, y2)))
+        else:
+            context = None
+
+        self.__dict__['_template_path'] = path
+        self.__dict__['_template_context'] = context
+        self.__dict__['_template_radius'] = radius
+        self.__dict__['_template_generation'] = self.template._generation
+
+
+    def on_render(self, sprite):
+        # the graphics of the batch is just the bounding box of the instances
+        # so that the batch has extents and can be interacted with
+        self.__dict__['_instances_changed'] = False
+        self.__update_template()
+        if self._template_path is None or not self.instance_x:
+            self.graphics.clear()
+            return
+
+        reach = self._template_radius * max(self.instance_scale)
+        if self.stroke:
+            reach += self.line_width * max(self.instance_scale) / 2.0
+
+        x, y = min(self.instance_x) - reach, min(self.instance_y) - reach
+        self.graphics.rectangle(x, y,
+                                max(self.instance_x) + reach - x,
+                                max(self.instance_y) + reach - y)
+        self.graphics.new_path()
+
+
+    def _draw(self, context, opacity = 1, parent_matrix = None):
+        if self.visible is False:
+            return
+
+        if self._sprite_dirty:
+            self._render()
+
+        in_clip = self._template_path is not None
+        scene = self.get_scene()
+        if in_clip and scene and scene._draw_clip:
+            extents = self.get_extents()
+            in_clip = extents is not None and gdk.rectangle_intersect(scene._draw_clip, extents)[0]
+
+        if in_clip:
+            context.save()
+            context.transform(self.get_local_matrix())
+            self._draw_instances(context, self.opacity * opacity)
+            context.restore()
+
+        Sprite._draw(self, context, opacity, parent_matrix)
+
+    def _draw_instances(self, context, opacity):
+        path = self._template_path
+        fill = tuple(Colors.parse(self.fill)) if self.fill else None
+        stroke = Colors.parse(self.stroke) if self.stroke else None
+        context.set_line_width(self.line_width)
+
+        xs, ys = self.instance_x, self.instance_y
+        rotations, scales = self.instance_rotation, self.instance_scale
+        opacities, colors = self.instance_opacity, self.instance_color
+
+        base_matrix = context.get_matrix()
+        context.new_path()
+
+        # consecutive opaque fills of the same color are painted in one go
+        run_color = None
+
+        for i in xrange(len(xs)):
+            alpha = opacities[i] * opacity
+            color = colors[i] or fill
+            if alpha <= 0 or (not color and not stroke):
+                continue
+
+            scale, rotation = scales[i], rotations[i]
+            if rotation:
+                cos, sin = math.cos(rotation) * scale, math.sin(rotation) * scale
+                matrix = cairo.Matrix(cos, sin, -sin, cos, xs[i], ys[i])
+            else:
+                matrix = cairo.Matrix(scale, 0, 0, scale, xs[i], ys[i])
+
+            merge = alpha >= 1 and not stroke
+            if run_color and (not merge or color != run_color):
+                context.set_source_rgb(*run_color)
+                context.fill()
+                run_color = None
+
+            context.set_matrix(matrix * base_matrix)
+            context.append_path(path)
+
+            if merge:
+                run_color = color
+                continue
+
+            if color:
+                context.set_source_rgba(color[0], color[1], color[2], alpha)
+                context.fill_preserve()
+            if stroke:
+                context.set_source_rgba(stroke[0], stroke[1], stroke[2], alpha)
+                context.stroke_preserve()
+            context.new_path()
+
+        if run_color:
+            context.set_source_rgb(*run_color)
+            context.fill()
+
+        context.set_matrix(base_matrix)
+
+
+class Clock(object):
+    """Time source and timers of the scene's frame loop. Reads the monotonic
+    clock of GLib and schedules on the GLib main loop. Subclass to plug in
+    something else, see :class:`VirtualClock`."""
+    def now(self):
+        """current time in seconds. only differences between the values matter"""
+        return glib.get_monotonic_time() / 1000000.0
+
+    def timeout_add(self, interval, callback, *args):
+        """call callback after interval seconds and repeat while it returns
+        True. returns id of the timeout"""
+        return gobject.timeout_add(int(round(interval * 1000)), callback, *args)
+
+    def source_remove(self, source_id):
+        """cancel the timeout set up by :func:`timeout_add`"""
+        gobject.source_remove(source_id)
+
+
+class VirtualClock(Clock):
+    """Clock that moves only when told to, firing the timeouts that come due
+    on the way. Use it for tests and for rendering without a display"""
+    def __init__(self, time = 0):
+        #: current time in seconds
+        self.time = time
+
+        self._timeouts = [] # heap of (due, id, interval, callback, args)
+        self._timeout_ids = itertools.count(1)
+
+    def now(self):
+        return self.time
+
+    def timeout_add(self, interval, callback, *args):
+        source_id = next(self._timeout_ids)
+        heapq.heappush(self._timeouts, (self.time + interval, source_id, interval, callback, args))
+        return source_id
+
+    def source_remove(self, source_id):
+        self._timeouts = [timeout for timeout in self._timeouts if timeout[1] != source_id]
+        heapq.heapify(self._timeouts)
+
+    def advance(self, seconds, on_timeout = None):
+        """move the time forward by the given amount of seconds. on_timeout
+        is called after every timeout that has fired"""
+        target_time = self.time + seconds
+        # a little slack so that rounding doesn't push a frame to the next call
+        while self._timeouts and self._timeouts[0][0] <= target_time + 1e-9:
+            due, source_id, interval, callback, args = heapq.heappop(self._timeouts)
+            self.time = max(self.time, due)
+            if callback(*args):
+                heapq.heappush(self._timeouts, (due + interval, source_id, interval, callback, args))
+
+            if on_timeout:
+                on_timeout()
+
+        self.time = max(self.time, target_time)
+
+
+class FramePacer(object):
+    """Calls the callback at the framerate for as long as it returns True.
+    The frames are scheduled at absolute times, so neither the timer
+    granularity nor the time spent drawing makes the rate drift. When it falls
+    behind by more than a frame, the pacer skips ahead instead of bursting."""
+    def __init__(self, clock, callback, framerate = 60):
+        self.clock = clock
+        self.callback = callback
+
+        #: frames per second
+        self.framerate = framerate
+
+        self._next_frame = None
+        self._source = None
+
+    @property
+    def running(self):
+        return self._source is not None
+
+    def start(self):
+        """schedule the first frame in one frame's time, if not running already"""
+        if self._source is None:
+            self._next_frame = self.clock.now() + 1.0 / self.framerate
+            self.__schedule()
+
+    def stop(self):
+        if self._source is not None:
+            self.clock.source_remove(self._source)
+            self._source = None
+
+    def __schedule(self):
+        self._source = self.clock.timeout_add(max(0, self._next_frame - self.clock.now()), self.__tick)
+
+    def __tick(self):
+        self._source = None
+        if not self.callback() or self._source is not None:
+            return False
+
+        period = 1.0 / self.framerate
+        now = self.clock.now()
+        self._next_frame += period
+        if self._next_frame < now - period:
+            self._next_frame = now + period
+        self.__schedule()
+        return False
+
+
+class FixedTimestep(object):
+    """Collects the frame deltas and hands them out in steps of fixed size,
+    so that tweens and simulations advance the same way no matter the
+    framerate. To avoid spiraling when the frames take too long, at most
+    max_steps are run per frame and the rest of the backlog is dropped."""
+    def __init__(self, step = 1 / 60.0, max_steps = 5):
+        #: size of the step in seconds
+        self.step = step
+
+        #: most steps to run in a single frame
+        self.max_steps = max_steps
+
+        #: time collected that has not made a whole step yet
+        self.accumulator = 0
+
+    @property
+    def alpha(self):
+        """how far into the next step we are, 0..1. use it to interpolate
+        between the previous and the current state when drawing"""
+        return self.accumulator / self.step
+
+    def advance(self, delta):
+        """add delta seconds and return the number of steps to run"""
+        self.accumulator += delta
+        steps = int(self.accumulator / self.step + 1e-9)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = self.accumulator % self.step
+        else:
+            self.accumulator = max(0, self.accumulator - steps * self.step)
+        return steps
+
+
+class FrameTimeHistogram(object):
+    """Counts of frame times in buckets of bucket_size seconds. Cheap enough
+    to be always on, unlike the :class:`FrameProfiler`"""
+    def __init__(self, bucket_size = 0.001, max_time = 0.1):
+        #: width of a bucket in seconds
+        self.bucket_size = bucket_size
+
+        #: counts per bucket. the last one holds everything from max_time up
+        self.counts = [0] * (int(round(max_time / bucket_size)) + 1)
+
+        #: number of recorded frames
+        self.total = 0
+
+        #: longest recorded time
+        self.max = 0
+
+        self._sum = 0
+
+    def add(self, seconds):
+        self.counts[min(int(seconds / self.bucket_size), len(self.counts) - 1)] += 1
+        self.total += 1
+        self._sum += seconds
+        self.max = max(self.max, seconds)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total, self.max, self._sum = 0, 0, 0
+
+    def mean(self):
+        return self._sum / self.total if self.total else None
+
+    def percentile(self, percent):
+        """upper bound of the bucket the given percentile falls in"""
+        if not self.total:
+            return None
+
+        count = 0
+        for i, bucket_count in enumerate(self.counts):
+            count += bucket_count
+            if count * 100.0 >= percent * self.total:
+                if i == len(self.counts) - 1:
+                    return self.max
+                return min((i + 1) * self.bucket_size, self.max)
+
+    def get_buckets(self):
+        """returns list of (start seconds, count) of the buckets that have any"""
+        return [(i * self.bucket_size, count) for i, count in enumerate(self.counts) if count]
+
+
+class FrameProfiler(object):
+    """Collects timings of scene frames and render statistics of the sprites.
+    Set an instance as :attr:`Scene.profiler` to start profiling.
+
+    Each frame is broken down in phases: `tweens`, `enter-frame` (the
+    on-enter-frame handlers), `draw` (sprite tree traversal), `render`
+    (on-render emissions, also part of `draw`), `hit-test` and
+    `finish-frame`. `frame` is the total time of the frame. The last
+    `history` frames are kept.
+
+    Phases that run between the frames, like hit-tests of mouse moves or
+    tween updates of the partial redraw loop, don't count towards the
+    frame and are kept in :attr:`between_frames` instead.
+
+    Example::
+
+        scene.profiler = graphics.FrameProfiler()
+        scene.profiler.show_overlay = True
+        ...
+        scene.profiler.dump("before.json")
+    """
+    phases = ("tweens", "enter-frame", "draw", "render", "hit-test", "finish-frame", "frame")
+
+    def __init__(self, history = 300):
+        #: timings of the recent frames as a list of {phase: seconds} dicts
+        self.frames = deque(maxlen = history)
+
+        #: timings of the phases that ran between the recent frames as a
+        #: list of {phase: seconds} dicts, one per gap between two frames
+        self.between_frames = deque(maxlen = history)
+
+        #: number of on-render emissions per sprite
+        self.render_counts = weakref.WeakKeyDictionary()
+
+        #: seconds spent in on-render per sprite
+        self.render_times = weakref.WeakKeyDictionary()
+
+        #: number of redraw requests per sprite
+        self.redraw_counts = weakref.WeakKeyDictionary()
+
+        #: whether the stats should be painted on top of the scene. Call
+        #: :func:`Scene.redraw` after toggling
+        self.show_overlay = False
+
+        #: scene-space (x, y, width, height) of the last painted overlay
+        self.overlay_extents = None
+
+        self._current = None
+        self._frame_start = None
+        self._between = defaultdict(float)
+        self._phase_starts = {}
+
+    def start_frame(self):
+        """start timing a frame. phases ended outside of a frame go to
+        :attr:`between_frames`"""
+        if self._between:
+            self.between_frames.append(dict(self._between))
+            self._between.clear()
+        self._current, self._frame_start = defaultdict(float), _timer()
+
+    def start_phase(self, phase):
+        now = _timer()
+        # phases can nest, like renders of children triggered from on-render
+        start, depth = self._phase_starts.get(phase, (now, 0))
+        self._phase_starts[phase] = (start, depth + 1)
+
+    def end_phase(self, phase):
+        if phase not in self._phase_starts:
+            return
+
+        start, depth = self._phase_starts[phase]
+        if depth > 1:
+            self._phase_starts[phase] = (start, depth - 1)
+        else:
+            del self._phase_starts[phase]
+            timings = self._between if self._current is None else self._current
+            timings[phase] += _timer() - start
+
+    def end_frame(self):
+        """store the timings of the current frame"""
+        if self._current is None:
+            return
+        self._current["frame"] = _timer() - self._frame_start
+        self.frames.append(dict(self._current))
+        self._current, self._frame_start = None, None
+
+    def sprite_rendered(self, sprite, duration):
+        self.render_counts[sprite] = self.render_counts.get(sprite, 0) + 1
+        self.render_times[sprite] = self.render_times.get(sprite, 0) + duration
+
+    def sprite_redrawn(self, sprite):
+        self.redraw_counts[sprite] = self.redraw_counts.get(sprite, 0) + 1
+
+    def reset(self):
+        """forget all collected data"""
+        self.frames.clear()
+        self.between_frames.clear()
+        self._between.clear()
+        self.render_counts.clear()
+        self.render_times.clear()
+        self.redraw_counts.clear()
+
+
+    def get_percentiles(self, phase, percentiles = (50, 95, 99), between_frames = False):
+        """returns {percentile: seconds} of the given phase over the
+        recorded frames, or over the gaps between them if `between_frames`
+        is set"""
+        records = self.between_frames if between_frames else self.frames
+        values = sorted(record.get(phase, 0) for record in records)
+        if not values:
+            return dict((percentile, None) for percentile in percentiles)
+        return dict((percentile, values[int(round((len(values) - 1) * percentile / 100.0))])
+                    for percentile in percentiles)
+
+    def get_stats(self, between_frames = False):
+        """returns {phase: {percentile: seconds}} for all phases"""
+        phases = self.get_between_frame_phases() if between_frames else self.phases
+        return dict((phase, self.get_percentiles(phase, between_frames = between_frames))
+                    for phase in phases)
+
+    def get_between_frame_phases(self):
+        """returns the phases that have run between the recorded frames"""
+        names = set()
+        for record in self.between_frames:
+            names.update(record.keys())
+        return [phase for phase in self.phases if phase in names]
+
+    def get_top_sprites(self, count = 10):
+        """returns list of (sprite, renders, render time, redraws) of the
+        sprites that have spent the most time in on-render"""
+        sprites = set(self.render_counts.keys()) | set(self.redraw_counts.keys())
+        stats = [(sprite, self.render_counts.get(sprite, 0),
+                  self.render_times.get(sprite, 0), self.redraw_counts.get(sprite, 0))
+                 for sprite in sprites]
+        stats.sort(key = lambda stat: (stat[2], stat[1], stat[3]), reverse = True)
+        return stats[:count]
+
+    def dump(self, path):
+        """write the collected data to a json file"""
+        data = {
+            "frames": list(self.frames),
+            "percentiles": self.get_stats(),
+            "between_frames": list(self.between_frames),
+            "between_frames_percentiles": self.get_stats(between_frames = True),
+            "sprites": [{"sprite": repr(sprite), "renders": renders,
+                         "render_time": render_time, "redraws": redraws}
+                        for sprite, renders, render_time, redraws in self.get_top_sprites(None)],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent = 2)
+
+
+    def draw_overlay(self, context):
+        """paint the stats in the top left corner of the scene"""
+        lines = ["%-13s %7s %7s %7s" % ("ms", "p50", "p95", "p99")]
+        for phase in self.phases:
+            percentiles = self.get_percentiles(phase)
+            lines.append("%-13s %s" % (phase, " ".join(["%7.2f" % (percentiles[p] * 1000)
+                                                        if percentiles[p] is not None else "      -"
+                                                        for p in (50, 95, 99)])))
+        for phase in self.get_between_frame_phases():
+            percentiles = self.get_percentiles(phase, between_frames = True)
+            lines.append("%-13s %s" % ("~" + phase, " ".join(["%7.2f" % (percentiles[p] * 1000)
+                                                              for p in (50, 95, 99)])))
+        lines.append("")
+        for sprite, renders, render_time, redraws in self.get_top_sprites(5):
+            lines.append("%-27s %5d %6.1fms" % (repr(sprite)[:27], renders, render_time * 1000))
+
+        context.save()
+        layout = pangocairo.create_layout(context)
+        layout.set_font_description(pango.FontDescription("Monospace 8"))
+        layout.set_text("\n".join(lines), -1)
+        width, height = layout.get_pixel_size()
+
+        x, y, padding = 5, 5, 5
+        context.rectangle(x, y, width + padding * 2, height + padding * 2)
+        context.set_source_rgba(0, 0, 0, 0.7)
+        context.fill()
+        context.move_to(x + padding, y + padding)
+        context.set_source_rgb(1, 1, 1)
+        pangocairo.show_layout(context, layout)
+        context.restore()
+
+        self.overlay_extents = (x, y, width + padding * 2, height + padding * 2)
+
+
 class Scene(Parent, gtk.DrawingArea):
     """ Drawing area for displaying sprites.
         Add sprites to the Scene by calling :func:`add_child`.
@@ -1723,6 +3414,7 @@ class Scene(Parent, gtk.DrawingArea):
         "on-enter-frame": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, )),
         "on-finish-frame": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, )),
         "on-resize": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, )),
+        "on-fixed-step": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, )),
 
         "on-click": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT)),
         "on-drag": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT)),
@@ -1744,9 +3436,15 @@ class Scene(Parent, gtk.DrawingArea):
 
     def __init__(self, interactive = True, framerate = 60,
                        background_color = None, scale = False, keep_aspect = True,
-                       style_class=None):
+                       style_class=None, partial_redraw = False, clock = None):
         gtk.DrawingArea.__init__(self)
 
+        #: :class:`Clock` driving the frame loop, the tweener and the mouse
+        #: move throttling. Pass a :class:`VirtualClock` to the constructor
+        #: to control the time yourself
+        self.clock = clock or Clock()
+        self._frame_pacer = FramePacer(self.clock, self.__redraw_loop, framerate)
+
         self._style = self.get_style_context()
 
         #: widget style. One of gtk.STYLE_CLASS_*. By default it's BACKGROUND
@@ -1786,6 +3484,45 @@ class Scene(Parent, gtk.DrawingArea):
         #: read only info about current framerate (frames per second)
         self.fps = None # inner frames per second counter
 
+        #: set to a :class:`FixedTimestep` to update the tweener in steps of
+        #: fixed size. every step also emits on-fixed-step with the step
+        #: size, for simulations to advance in
+        self.timestep = None
+
+        #: :class:`FrameTimeHistogram` of the time between frames
+        self.frame_intervals = FrameTimeHistogram()
+
+        #: :class:`FrameTimeHistogram` of the time spent drawing a frame
+        self.frame_durations = FrameTimeHistogram()
+
+        #: framerate to drop to while the scene is not on screen - unmapped,
+        #: minimized or fully covered, 2 for example. None (the default)
+        #: keeps the full framerate
+        self.hidden_framerate = None
+
+        #: framerate to drop to while the window is not focused. None (the
+        #: default) keeps the full framerate
+        self.unfocused_framerate = None
+
+        #: skip the frames in which the tweens have not changed anything on
+        #: screen. Turn on only when all the tweened objects are sprites - if
+        #: you draw in on-enter-frame from tweened values of other objects,
+        #: those frames would be skipped too. Partial redraw always skips.
+        self.skip_idle_frames = False
+
+        #: when frames keep taking longer than the framerate allows, switch
+        #: to :attr:`degraded` mode instead of falling further behind. Off
+        #: by default, as degraded frames can look blurry
+        self.degrade_on_overrun = False
+
+        #: True while the scene skips expensive work to keep up - debug
+        #: extents are not drawn, and sprites with cache_as_bitmap reuse
+        #: their bitmap on transformations instead of rendering it again
+        self.degraded = False
+
+        self.__overruns, self.__good_frames = 0, 0
+        self.__obscured = False
+
         self._window = None # scenes don't really get reparented
 
         #: Last known x position of the mouse (set on expose event)
@@ -1836,6 +3573,29 @@ class Scene(Parent, gtk.DrawingArea):
 
         self._original_width, self._original_height = None,  None
 
+        #: When enabled, sprite changes repaint only the area the sprite
+        #: occupied before and after the change instead of the whole scene,
+        #: and sprites outside of the repainted area are not drawn.
+        #: Tweens are then advanced before the repaint is queued.
+        #: Leave off if you draw directly on the context in on-enter-frame, as
+        #: that gets clipped to the damaged area too. Does not apply when
+        #: :attr:`scale` is on. Defaults to False.
+        self.partial_redraw = partial_redraw
+
+        self.__redraw_all = False
+        self.__damaged_sprites = set()
+        self.__damage_rects = []
+        self._draw_clip = None # the area being repainted in partial redraw mode
+
+        # grid of interactive sprite extents for hit-testing and the sprites
+        # (along with their children) that have changed since last lookup
+        self._hit_grid = SpriteGrid()
+        self.__hit_stale = set([self])
+
+        #: instance of :class:`FrameProfiler` collecting frame timings and
+        #: render statistics. Profiling is off while it's None
+        self.profiler = None
+
         self._focus_sprite = None # our internal focus management
 
         self.__last_mouse_move = None
@@ -1856,6 +3616,11 @@ class Scene(Parent, gtk.DrawingArea):
             self.connect("key-press-event", self.__on_key_press)
             self.connect("key-release-event", self.__on_key_release)
 
+        self.add_events(gdk.EventMask.VISIBILITY_NOTIFY_MASK)
+        self.connect("visibility-notify-event", self.__on_visibility_notify)
+        self.connect("map", self.__on_visibility_changed)
+        self.connect("unmap", self.__on_visibility_changed)
+
 
 
     def __setattr__(self, name, val):
@@ -1920,6 +3685,18 @@ class Scene(Parent, gtk.DrawingArea):
         return tween
 
 
+    def play_timeline(self, timeline):
+        """Play the given pytweener.Timeline using the internal tweener,
+           redrawing scene after every update. Returns the timeline.
+        """
+        if not self.tweener: # here we complain
+            raise Exception("pytweener was not found. Include it to enable animations")
+
+        self.tweener.add_timeline(timeline)
+        self.redraw()
+        return timeline
+
+
     def stop_animation(self, sprites):
         """stop animation without firing on_complete"""
         if isinstance(sprites, list) is False:
@@ -1932,20 +3709,138 @@ class Scene(Parent, gtk.DrawingArea):
     def redraw(self):
         """Queue redraw. The redraw will be performed not more often than
            the `framerate` allows"""
+        self.__redraw_all = True
+        self.__queue_frame()
+
+    def __queue_frame(self):
         if self.__drawing_queued == False: #if we are moving, then there is a timeout somewhere already
             self.__drawing_queued = True
-            self._last_frame_time = dt.datetime.now()
-            gobject.timeout_add(1000 / self.framerate, self.__redraw_loop)
+            self._last_frame_time = self.clock.now()
+            self._frame_pacer.framerate = self.get_effective_framerate()
+            self._frame_pacer.start()
 
     def __redraw_loop(self):
         """loop until there is nothing more to tween"""
-        self.queue_draw() # this will trigger do_expose_event when the current events have been flushed
+        self._frame_pacer.framerate = self.get_effective_framerate()
+        if self.__tweens_in_loop():
+            # tween first so that the tweened sprites make it in the damage
+            self.__update_tweens()
+
+        if self.__damage_tracking() and not self.__redraw_all:
+            self.__queue_damage()
+            if self.profiler and self.profiler.show_overlay and self.profiler.overlay_extents:
+                self.queue_draw_area(*self.profiler.overlay_extents)
+        elif self.skip_idle_frames and not self.__redraw_all:
+            pass # the tweens have not changed anything on screen
+        else:
+            self.queue_draw() # this will trigger do_expose_event when the current events have been flushed
+
+        self.__redraw_all = False
+        self.__damaged_sprites.clear()
+        del self.__damage_rects[:]
 
         self.__drawing_queued = self.tweener and self.tweener.has_tweens()
         return self.__drawing_queued
 
+    def __damage_tracking(self):
+        return self.partial_redraw and not self.scale
+
+    def __tweens_in_loop(self):
+        """tweens are updated before the repaint is queued, not in do_draw"""
+        return self.__damage_tracking() or self.skip_idle_frames
+
+
+    def get_effective_framerate(self):
+        """the framerate the frame loop runs at - :attr:`framerate`, or
+        a lower one while the scene is hidden or the window is unfocused"""
+        if self.hidden_framerate and not self._is_on_screen():
+            return min(self.framerate, self.hidden_framerate)
+        if self.unfocused_framerate and not self._is_window_active():
+            return min(self.framerate, self.unfocused_framerate)
+        return self.framerate
+
+    def _is_on_screen(self):
+        if not self.get_mapped() or self.__obscured:
+            return False
+        window = self.get_toplevel().get_window()
+        return not (window and window.get_state() & gdk.WindowState.ICONIFIED)
+
+    def _is_window_active(self):
+        toplevel = self.get_toplevel()
+        return not isinstance(toplevel, gtk.Window) or toplevel.is_active()
+
+    def __on_visibility_notify(self, widget, event):
+        self.__obscured = event.state == gdk.VisibilityState.FULLY_OBSCURED
+        self.__on_visibility_changed()
+
+    def __on_visibility_changed(self, *args):
+        # reschedule right away so that coming back does not wait for the slow frame
+        if self._frame_pacer.running:
+            self._frame_pacer.stop()
+            self._frame_pacer.framerate = self.get_effective_framerate()
+            self._frame_pacer.start()
+
+    def _damage_sprite(self, sprite):
+        """queue repaint of the area covered by the sprite and its children.
+        called by sprites on changes. without partial redraw the whole scene
+        gets repainted"""
+        self.__hit_stale.add(sprite)
+
+        if self.profiler:
+            self.profiler.sprite_redrawn(sprite)
+
+        if not self.__damage_tracking():
+            self.redraw()
+            return
+
+        if sprite not in self.__damaged_sprites:
+            # remember where the sprite was drawn before the change
+            self.__damaged_sprites.add(sprite)
+            sprites = [sprite]
+            while sprites:
+                current = sprites.pop()
+                if current._cached_extents:
+                    self.__damage_rects.append((current._cached_extents,
+                                                current._get_stroke_padding()))
+                sprites.extend(current.sprites)
+
+        self.__queue_frame()
+
+    def __queue_damage(self):
+        """queue repaint of the areas where the damaged sprites were and where
+        they will be drawn now"""
+        for sprite in self.__damaged_sprites:
+            if sprite.get_scene() is not self:
+                continue # removed from the scene, the old area is enough
+
+            if any((parent.visible == False for parent in sprite.get_parents())):
+                continue
+
+            sprites = [sprite]
+            while sprites:
+                current = sprites.pop()
+                if not current.visible:
+                    current._set_quietly('_cached_extents', None)
+                    current._set_quietly('_cached_extents_key', None)
+                    continue
+
+                extents = current.get_extents()
+                if extents:
+                    self.__damage_rects.append((extents, current._get_stroke_padding()))
+                sprites.extend(current.sprites)
+
+        # pad for the strokes and antialiasing that go beyond the path
+        # extents, never less than the 5px that hairlines have always had
+        for rect, pad in self.__damage_rects:
+            pad = max(int(math.ceil(pad)), 5)
+            self.queue_draw_area(rect.x - pad, rect.y - pad, rect.width + pad * 2, rect.height + pad * 2)
+
 
     def do_draw(self, context):
+        frame_start = self.clock.now()
+        if self.profiler:
+            self.profiler.start_frame()
+
         if self.scale:
             aspect_x = self.width / self._original_width
             aspect_y = self.height / self._original_height
@@ -1953,33 +3848,104 @@ class Scene(Parent, gtk.DrawingArea):
                 aspect_x = aspect_y = min(aspect_x, aspect_y)
             context.scale(aspect_x, aspect_y)
 
-        if self.fps is None:
+        if self._window is None:
             self._window = self.get_window()
+
+            toplevel = self.get_toplevel()
+            if isinstance(toplevel, gtk.Window):
+                toplevel.connect("window-state-event", self.__on_visibility_changed)
+                toplevel.connect("notify::is-active", self.__on_visibility_changed)
+
             self.emit("on-first-frame", context)
 
         cursor, self.mouse_x, self.mouse_y, mods = self._window.get_pointer()
 
 
-        # update tweens
-        now = dt.datetime.now()
-        delta = (now - (self._last_frame_time or dt.datetime.now())).total_seconds()
-        self._last_frame_time = now
-        if self.tweener:
-            self.tweener.update(delta)
+        if self.__damage_tracking():
+            has_clip, self._draw_clip = gdk.cairo_get_clip_rectangle(context)
+
+        if not self.__tweens_in_loop():
+            self.__update_tweens()
 
-        self.fps = 1 / delta
+        profiler = self.profiler
 
         # start drawing
+        if profiler: profiler.start_phase("enter-frame")
         self.emit("on-enter-frame", context)
+        if profiler: profiler.end_phase("enter-frame")
+
+        if profiler: profiler.start_phase("draw")
         for sprite in self._z_ordered_sprites:
             sprite._draw(context)
+        self._draw_clip = None
+        if profiler: profiler.end_phase("draw")
 
         self.__check_mouse(self.mouse_x, self.mouse_y)
+
+        if profiler: profiler.start_phase("finish-frame")
         self.emit("on-finish-frame", context)
+        if profiler: profiler.end_phase("finish-frame")
+
+        if profiler:
+            profiler.end_frame()
+            if profiler.show_overlay:
+                profiler.draw_overlay(context)
 
         # reset the mouse signal time as redraw means we are good now
         self.__previous_mouse_signal_time = None
 
+        frame_duration = self.clock.now() - frame_start
+        self.frame_durations.add(frame_duration)
+        if self.degrade_on_overrun or self.degraded:
+            self.__check_frame_budget(frame_duration)
+
+    def __check_frame_budget(self, duration):
+        """degrade after a few frames over the budget, come back after a
+        good while of frames well within it"""
+        budget = 1.0 / self.framerate
+        if duration > budget and self.degrade_on_overrun:
+            self.__overruns, self.__good_frames = self.__overruns + 1, 0
+            if self.__overruns >= 3:
+                self.degraded = True
+        else:
+            self.__overruns = 0
+            if self.degraded and (duration < budget / 2 or not self.degrade_on_overrun):
+                self.__good_frames += 1
+                if self.__good_frames >= 30 or not self.degrade_on_overrun:
+                    self.degraded, self.__good_frames = False, 0
+                    self.redraw() # back to the full quality
+
+
+    def __advance_tweener(self, delta):
+        """advance the tweens. changes they make that are too small to show
+        do not invalidate the sprites"""
+        global _tweening
+        _tweening = True
+        try:
+            self.tweener.update(delta)
+        finally:
+            _tweening = False
+
+    def __update_tweens(self):
+        now = self.clock.now()
+        delta = now - (now if self._last_frame_time is None else self._last_frame_time)
+        self._last_frame_time = now
+
+        if self.profiler: self.profiler.start_phase("tweens")
+        if self.timestep:
+            step = self.timestep.step
+            for i in range(self.timestep.advance(delta)):
+                if self.tweener:
+                    self.__advance_tweener(step)
+                self.emit("on-fixed-step", step)
+        elif self.tweener:
+            self.__advance_tweener(delta)
+        if self.profiler: self.profiler.end_phase("tweens")
+
+        if delta:
+            self.fps = 1 / delta
+            self.frame_intervals.add(delta)
+
 
     def do_configure_event(self, event):
         if self._original_width is None:
@@ -2012,12 +3978,78 @@ class Scene(Parent, gtk.DrawingArea):
 
     def get_sprite_at_position(self, x, y):
         """Returns the topmost visible interactive sprite for given coordinates"""
-        over = None
-        for sprite in self.all_mouse_sprites():
-            if sprite.interactive and sprite.check_hit(x, y):
-                over = sprite
+        self.__refresh_hit_grid()
+
+        candidates = []
+        for sprite in list(self._hit_grid.get_sprites_at(x, y)):
+            if not sprite.interactive:
+                continue
+
+            # changes that did not go through redraw, like painting in the
+            # sprite's graphics directly, are caught here
+            extents = sprite.get_extents()
+            if extents is not self._hit_grid.get_extents(sprite):
+                self._hit_grid.update(sprite, extents)
+
+            if extents and extents.x <= x <= extents.x + extents.width \
+                       and extents.y <= y <= extents.y + extents.height:
+                order = self.__mouse_order(sprite)
+                if order is not None:
+                    candidates.append((order, sprite))
+
+        # topmost first - same as the last one in all_mouse_sprites
+        for order, sprite in sorted(candidates, reverse=True):
+            if sprite.check_hit(x, y):
+                return sprite
+
+
+    def __refresh_hit_grid(self):
+        """re-index the sprites that have changed since the last lookup"""
+        stale, self.__hit_stale = self.__hit_stale, set()
+        for root in stale:
+            parent = root
+            while parent and parent is not self:
+                parent = parent.parent
+            attached = parent is self
+
+            sprites = list(root.sprites) if root is self else [root]
+            while sprites:
+                sprite = sprites.pop()
+                if attached and sprite.visible and sprite.interactive:
+                    self._hit_grid.update(sprite, sprite.get_extents())
+                else:
+                    self._hit_grid.remove(sprite)
+
+                # children of hidden sprites are filtered out on lookup
+                if not attached or sprite.visible:
+                    sprites.extend(sprite.sprites)
+
+    def __mouse_order(self, sprite):
+        """returns position of the sprite in the all_mouse_sprites traversal
+        as a tuple of z-indexes from the scene downwards. returns None if the
+        sprite is not part of the traversal"""
+        order = []
+        while sprite is not self:
+            parent = sprite.parent
+            if parent is None or not sprite.visible:
+                return None
+
+            z_ordered = parent._z_ordered_sprites
+            z_index = getattr(sprite, '_z_index', None)
+            if z_index is None or z_index >= len(z_ordered) or z_ordered[z_index] is not sprite:
+                return None
 
-        return over
+            if type(parent).get_mouse_sprites.__func__ is not Parent.get_mouse_sprites.__func__:
+                # parent decides on its own which children get the mouse
+                mouse_sprites = parent.get_mouse_sprites()
+                if not mouse_sprites or sprite not in mouse_sprites:
+                    return None
+
+            order.append(z_index)
+            sprite = parent
+
+        order.reverse()
+        return tuple(order)
 
 
     def __check_mouse(self, x, y):
@@ -2037,7 +4069,9 @@ class Scene(Parent, gtk.DrawingArea):
 
         #check if we have a mouse over
         if self._drag_sprite is None:
+            if self.profiler: self.profiler.start_phase("hit-test")
             over = self.get_sprite_at_position(x, y)
+            if self.profiler: self.profiler.end_phase("hit-test")
             if self._mouse_sprite and self._mouse_sprite != over:
                 self._mouse_sprite._do_mouse_out()
                 self.emit("on-mouse-out", self._mouse_sprite)
@@ -2070,17 +4104,18 @@ class Scene(Parent, gtk.DrawingArea):
     """ mouse events """
     def __on_mouse_move(self, scene, event):
         if self.__last_mouse_move:
-            gobject.source_remove(self.__last_mouse_move)
+            self.clock.source_remove(self.__last_mouse_move)
+            self.__last_mouse_move = None
 
         self.mouse_x, self.mouse_y = event.x, event.y
 
         # don't emit mouse move signals more often than every 0.05 seconds
-        timeout = dt.timedelta(seconds=0.05)
-        if self.__previous_mouse_signal_time and dt.datetime.now() - self.__previous_mouse_signal_time < timeout:
-            self.__last_mouse_move = gobject.timeout_add((timeout - (dt.datetime.now() - self.__previous_mouse_signal_time)).microseconds / 1000,
-                                                         self.__on_mouse_move,
-                                                         scene,
-                                                         event.copy())
+        timeout, now = 0.05, self.clock.now()
+        if self.__previous_mouse_signal_time is not None and now - self.__previous_mouse_signal_time < timeout:
+            self.__last_mouse_move = self.clock.timeout_add(timeout - (now - self.__previous_mouse_signal_time),
+                                                            self.__on_delayed_mouse_move,
+                                                            scene,
+                                                            event.copy())
             return
 
         state = event.state
@@ -2107,7 +4142,7 @@ class Scene(Parent, gtk.DrawingArea):
 
         if self._drag_sprite:
             diff_x, diff_y = event.x - self.__drag_start_x, event.y - self.__drag_start_y
-            if isinstance(self._drag_sprite.parent, Sprite):
+            if isinstance(self._drag_sprite.parent, (Sprite, LightSprite)):
                 matrix = self._drag_sprite.parent.get_matrix()
                 matrix.invert()
                 diff_x, diff_y = matrix.transform_distance(diff_x, diff_y)
@@ -2123,7 +4158,11 @@ class Scene(Parent, gtk.DrawingArea):
             self._mouse_sprite._do_mouse_move(sprite_event)
 
         self.emit("on-mouse-move", event)
-        self.__previous_mouse_signal_time = dt.datetime.now()
+        self.__previous_mouse_signal_time = self.clock.now()
+
+    def __on_delayed_mouse_move(self, scene, event):
+        self.__last_mouse_move = None
+        self.__on_mouse_move(scene, event)
 
 
     def start_drag(self, sprite, cursor_x = None, cursor_y = None):
@@ -2233,3 +4272,180 @@ class Scene(Parent, gtk.DrawingArea):
         if not handled:
             self.emit("on-key-release", event)
         return True
+
+
+class _OffscreenWindow(object):
+    """stands in for the gdk window of an offscreen scene"""
+    def __init__(self, scene):
+        self.scene = scene
+        self.cursor = None
+
+    def get_pointer(self):
+        return None, self.scene.mouse_x, self.scene.mouse_y, 0
+
+    def set_cursor(self, cursor):
+        self.cursor = cursor
+
+
+class OffscreenScene(Scene):
+    """Scene that renders into a :class:`cairo.ImageSurface` instead of a
+    window, so it works without a display. Time does not pass on its own -
+    call :func:`advance` to move the clock forward, which runs the redraw
+    loop, the tweener and any pending frames just like the main loop would.
+    Mouse and keyboard input can be simulated with the functions below.
+
+    Example::
+
+        scene = graphics.OffscreenScene(400, 300, background_color="#fff")
+        scene.add_child(graphics.Label("Hello", 24, "#000"))
+        scene.advance()
+        scene.surface.write_to_png("hello.png")
+    """
+    def __init__(self, width, height, framerate = 60, background_color = None, **kwargs):
+        self.__dict__['_draw_queued'] = False
+        self.__dict__['_pressed_buttons'] = 0
+
+        # partial redraws would leave the rest of the surface unpainted
+        kwargs['partial_redraw'] = False
+        kwargs.setdefault('clock', VirtualClock())
+        Scene.__init__(self, framerate = framerate,
+                       background_color = background_color, **kwargs)
+
+        #: :class:`cairo.ImageSurface` the scene is rendered into
+        self.surface = None
+
+        #: number of frames rendered so far
+        self.frames = 0
+
+        self._offscreen_window = _OffscreenWindow(self)
+
+        self.resize(width, height)
+
+
+    @property
+    def time(self):
+        """seconds passed on the virtual clock"""
+        return self.clock.now()
+
+    def get_window(self):
+        return self._offscreen_window
+
+    def _is_on_screen(self):
+        return True
+
+    def _is_window_active(self):
+        return True
+
+    def queue_draw(self):
+        self._draw_queued = True
+
+    def queue_draw_area(self, x, y, width, height):
+        self._draw_queued = True
+
+
+    def resize(self, width, height):
+        """change size of the scene. creates a new surface"""
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+
+        event = gdk.Event.new(gdk.EventType.CONFIGURE)
+        event.width, event.height = width, height
+        self.do_configure_event(event)
+        self.redraw()
+
+    def advance(self, seconds = None):
+        """move the virtual clock forward by the given amount of seconds,
+        by default one frame. fires the timeouts that come due and renders
+        the frames they request. returns number of frames rendered"""
+        if seconds is None:
+            seconds = 1.0 / self.framerate
+
+        frames = self.frames
+        self.clock.advance(seconds, self.__render_queued)
+        return self.frames - frames
+
+    def __render_queued(self):
+        if self._draw_queued:
+            self.render()
+
+    def render(self):
+        """render a frame right away and return the surface"""
+        self._draw_queued = False
+
+        context = cairo.Context(self.surface)
+        context.save()
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        if self.background_color:
+            context.set_source_rgb(*Colors.parse(self.background_color)[:3])
+        else:
+            context.set_source_rgba(0, 0, 0, 0)
+        context.paint()
+        context.restore()
+
+        self.do_draw(context)
+        self.frames += 1
+        return self.surface
+
+
+    def __event(self, event_type, **attributes):
+        event = gdk.Event.new(event_type)
+        event.time = int(self.time * 1000)
+        for key, val in attributes.items():
+            setattr(event, key, val)
+        return event
+
+    def mouse_move(self, x, y, state = None):
+        """move the mouse cursor to the given scene coordinates"""
+        if not self._mouse_in:
+            self.emit("enter-notify-event", self.__event(gdk.EventType.ENTER_NOTIFY, x = x, y = y))
+
+        if state is None:
+            state = self._pressed_buttons
+        self.emit("motion-notify-event", self.__event(gdk.EventType.MOTION_NOTIFY,
+                                                      x = x, y = y, state = state))
+
+    def mouse_leave(self):
+        """move the mouse cursor out of the scene"""
+        self.emit("leave-notify-event", self.__event(gdk.EventType.LEAVE_NOTIFY))
+
+    def mouse_down(self, x, y, button = 1, clicks = 1):
+        """press mouse button at the given coordinates. set clicks to 2 or 3
+        for double and triple clicks"""
+        event_type = {1: gdk.EventType.BUTTON_PRESS,
+                      2: gdk.EventType._2BUTTON_PRESS,
+                      3: gdk.EventType._3BUTTON_PRESS}[clicks]
+        self._pressed_buttons |= self.__button_mask(button)
+        self.emit("button-press-event", self.__event(event_type, x = x, y = y, button = button,
+                                                     state = self._pressed_buttons))
+
+    def mouse_up(self, x, y, button = 1):
+        """release mouse button at the given coordinates"""
+        self.emit("button-release-event", self.__event(gdk.EventType.BUTTON_RELEASE,
+                                                       x = x, y = y, button = button,
+                                                       state = self._pressed_buttons))
+        self._pressed_buttons &= ~self.__button_mask(button)
+
+    def click(self, x, y, button = 1):
+        """move the mouse to the given coordinates and click"""
+        self.mouse_move(x, y)
+        self.mouse_down(x, y, button)
+        self.mouse_up(x, y, button)
+
+    def scroll(self, x, y, direction = gdk.ScrollDirection.DOWN):
+        """scroll the mouse wheel at the given coordinates"""
+        self.emit("scroll-event", self.__event(gdk.EventType.SCROLL, x = x, y = y,
+                                               direction = direction))
+
+    def key_press(self, keyval, state = 0):
+        """press key. keyval is one of the gdk.KEY_* constants"""
+        self.emit("key-press-event", self.__event(gdk.EventType.KEY_PRESS,
+                                                  keyval = keyval, state = state))
+
+    def key_release(self, keyval, state = 0):
+        """release key"""
+        self.emit("key-release-event", self.__event(gdk.EventType.KEY_RELEASE,
+                                                    keyval = keyval, state = state))
+
+    def __button_mask(self, button):
+        return {1: gdk.ModifierType.BUTTON1_MASK,
+                2: gdk.ModifierType.BUTTON2_MASK,
+                3: gdk.ModifierType.BUTTON3_MASK}.get(button, 0)
@@ -12,18 +12,37 @@ import collections
 import datetime as dt
 import time
 import re
+import array
+import bisect
+
+try:
+    import numpy
+except ImportError: # BulkTweener falls back to the array module
+    numpy = None
 
 class Tweener(object):
-    def __init__(self, default_duration = None, tween = None):
+    def __init__(self, default_duration = None, tween = None, tabulate = False):
         """Tweener
         This class manages all active tweens, and provides a factory for
         creating and spawning tween motions."""
         self.current_tweens = collections.defaultdict(set)
         self.default_easing = tween or Easing.Cubic.ease_in_out
         self.default_duration = default_duration or 1.0
+        self._index = {} # (object, attribute) -> tween
+
+        #: timelines being played, see :func:`add_timeline`
+        self.timelines = []
+
+        #: evaluate easings from precomputed tables - False, "linear" or
+        #: "cubic" (True means linear). See :func:`tabulate`
+        self.tabulate = tabulate
+
+        #: error bound of the tabulated easings
+        self.tabulate_error = 0.0001
 
     def has_tweens(self):
-        return len(self.current_tweens) > 0
+        return len(self.current_tweens) > 0 or \
+               any(not timeline.paused for timeline in self.timelines)
 
 
     def add_tween(self, obj, duration = None, easing = None, on_complete = None,
@@ -43,73 +62,671 @@ class Tweener(object):
             duration = self.default_duration
 
         easing = easing or self.default_easing
+        if self.tabulate:
+            interpolation = "cubic" if self.tabulate == "cubic" else "linear"
+            easing = tabulate(easing, interpolation, self.tabulate_error)
 
         tw = Tween(obj, duration, delay, easing, on_complete, on_update, round, **kwargs )
 
-        if obj in self.current_tweens:
-            for current_tween in tuple(self.current_tweens[obj]):
-                prev_keys = set((key for (key, tweenable) in current_tween.tweenables))
-                dif = prev_keys & set(kwargs.keys())
-
-                for key, tweenable in tuple(current_tween.tweenables):
-                    if key in dif:
-                        current_tween.tweenables.remove((key, tweenable))
-
+        for key in kwargs:
+            current_tween = self._index.get((obj, key))
+            if current_tween:
+                self._remove_key(current_tween, key)
                 if not current_tween.tweenables:
                     current_tween.finish()
-                    self.current_tweens[obj].remove(current_tween)
-
+                    self._discard(current_tween)
+            self._index[(obj, key)] = tw
 
         self.current_tweens[obj].add(tw)
         return tw
 
 
-    def get_tweens(self, obj):
-        """Get a list of all tweens acting on the specified object
+    def add_timeline(self, timeline):
+        """start playing the :class:`Timeline` on every update.
+        returns the timeline"""
+        timeline.tweener = self
+        if timeline not in self.timelines:
+            self.timelines.append(timeline)
+        return timeline
+
+    def remove_timeline(self, timeline):
+        """stop playing the timeline without completing it"""
+        if timeline in self.timelines:
+            self.timelines.remove(timeline)
+
+
+    def get_tweens(self, obj, attr = None):
+        """Get a list of all tweens acting on the specified object, or just
+        the one tweening the given attribute of it.
         Useful for manipulating tweens on the fly"""
+        if attr is not None:
+            tween = self._index.get((obj, attr))
+            return set([tween]) if tween else None
         return self.current_tweens.get(obj, None)
 
-    def kill_tweens(self, obj = None):
-        """Stop tweening an object, without completing the motion or firing the
-        on_complete"""
-        if obj is not None:
-            try:
-                del self.current_tweens[obj]
-            except:
-                pass
-        else:
+    def kill_tweens(self, obj = None, attr = None):
+        """Stop tweening an object, or just the given attribute of it, without
+        completing the motion or firing the on_complete"""
+        if obj is None:
             self.current_tweens = collections.defaultdict(set)
+            self._index = {}
+            self.timelines = []
+        elif attr is not None:
+            tween = self._index.get((obj, attr))
+            if tween:
+                self._remove_key(tween, attr)
+                if not tween.tweenables:
+                    self._discard(tween)
+        else:
+            for tween in tuple(self.current_tweens.get(obj, ())):
+                self._discard(tween)
 
     def remove_tween(self, tween):
         """"remove given tween without completing the motion or firing the on_complete"""
-        if tween.target in self.current_tweens and tween in self.current_tweens[tween.target]:
-            self.current_tweens[tween.target].remove(tween)
-            if not self.current_tweens[tween.target]:
-                del self.current_tweens[tween.target]
+        if tween in self.current_tweens.get(tween.target, ()):
+            self._discard(tween)
 
     def finish(self):
         """jump the the last frame of all tweens"""
         for obj in self.current_tweens:
             for tween in self.current_tweens[obj]:
                 tween.finish()
-        self.current_tweens = {}
+        self.current_tweens = collections.defaultdict(set)
+        self._index = {}
+
+        for timeline in self.timelines:
+            timeline.finish()
+        self.timelines = []
 
     def update(self, delta_seconds):
         """update tweeners. delta_seconds is time in seconds since last frame"""
 
         for obj in tuple(self.current_tweens):
-            for tween in tuple(self.current_tweens[obj]):
+            for tween in tuple(self.current_tweens.get(obj, ())):
                 done = tween.update(delta_seconds)
                 if done:
-                    self.current_tweens[obj].remove(tween)
+                    self._discard(tween)
                     if tween.on_complete: tween.on_complete(tween.target)
 
-            if not self.current_tweens[obj]:
-                del self.current_tweens[obj]
+        self._update_timelines(delta_seconds)
+        return self.current_tweens
+
+
+    def _update_timelines(self, delta_seconds):
+        for timeline in tuple(self.timelines):
+            if timeline.update(delta_seconds):
+                self.remove_timeline(timeline)
+
+    def _remove_key(self, tween, key):
+        """take the attribute out of the tween"""
+        del tween.tweenables[key]
+        if self._index.get((tween.target, key)) is tween:
+            del self._index[(tween.target, key)]
+
+    def _discard(self, tween):
+        """forget the tween and the attributes it owns"""
+        for key in tween.tweenables:
+            if self._index.get((tween.target, key)) is tween:
+                del self._index[(tween.target, key)]
+
+        tweens = self.current_tweens.get(tween.target)
+        if tweens and tween in tweens:
+            tweens.remove(tween)
+            if not tweens:
+                del self.current_tweens[tween.target]
+
+
+# columns of the bulk tweener - (name, array typecode)
+_bulk_columns = (("start", "d"), ("change", "d"), ("elapsed", "d"),
+                 ("delay", "d"), ("duration", "d"), ("easing", "i"),
+                 ("round", "b"), ("alive", "b"))
+
+class BulkTweener(Tweener):
+    """Tweener that keeps numeric tweenables of all the tweens in flat
+    arrays and moves them forward in one pass - using numpy when it is
+    available and the array module otherwise. Use it instead of
+    :class:`Tweener` when there are thousands of tweens running at once.
+    Tweens of colors and dates go through the regular route.
+
+    The API and the completion semantics are the same as of the Tweener,
+    with the difference that within one update all the values are set
+    before any of the on_update and on_complete callbacks get called."""
+    def __init__(self, default_duration = None, tween = None, tabulate = False):
+        Tweener.__init__(self, default_duration, tween, tabulate)
+        self._easings = []        # easing functions by id
+        self._easing_ids = {}     # easing function -> id
+        self._vectorized = {}     # easing id -> False if it can't take arrays
+        self._tween_slots = {}    # bulk tween -> {attribute: slot index}
+        self._callback_tweens = set() # bulk tweens with on_update
+        self._scalar_tweens = set()   # tweens that go through Tween.update
+        self._clear_slots()
+
+    def _clear_slots(self):
+        self._size, self._dead = 0, 0
+
+        # owner objects, attribute names, exact target values and tweens
+        self._objs, self._keys, self._targets, self._owners = [], [], [], []
+        if numpy:
+            self._columns = dict((name, numpy.zeros(64, typecode)) for name, typecode in _bulk_columns)
+        else:
+            self._columns = dict((name, array.array(typecode)) for name, typecode in _bulk_columns)
+
+
+    def add_tween(self, obj, duration = None, easing = None, on_complete = None,
+                  on_update = None, round = False, delay = None, **kwargs):
+        tween = Tweener.add_tween(self, obj, duration, easing, on_complete,
+                                  on_update, round, delay, **kwargs)
+
+        if tween.tweenables and all(tweenable.update.__name__ == "float_update"
+                                    for tweenable in tween.tweenables.itervalues()):
+            easing_id = self._get_easing_id(tween.ease)
+            self._tween_slots[tween] = dict((key, self._add_slot(tween, key, tweenable, easing_id))
+                                            for key, tweenable in tween.tweenables.iteritems())
+            if tween.on_update:
+                self._callback_tweens.add(tween)
+        else:
+            self._scalar_tweens.add(tween)
+
+        return tween
+
+    def kill_tweens(self, obj = None, attr = None):
+        if obj is None:
+            self._tween_slots, self._callback_tweens, self._scalar_tweens = {}, set(), set()
+            self._clear_slots()
+        Tweener.kill_tweens(self, obj, attr)
+
+    def finish(self):
+        for tween, slots in self._tween_slots.items():
+            tween.delta = self._columns["elapsed"][next(slots.itervalues())]
+        Tweener.finish(self)
+        self._tween_slots, self._callback_tweens, self._scalar_tweens = {}, set(), set()
+        self._clear_slots()
+
+
+    def update(self, delta_seconds):
+        done = self._update_slots(delta_seconds)
+
+        for tween in tuple(self._callback_tweens):
+            tween.delta = min(tween.delta + delta_seconds, tween.delay + tween.duration)
+            tween.on_update(tween.target)
+
+        for tween in tuple(self._scalar_tweens):
+            if tween.update(delta_seconds):
+                done.append(tween)
+
+        for tween in done:
+            self._discard(tween)
+            if tween.on_complete: tween.on_complete(tween.target)
 
+        self._update_timelines(delta_seconds)
         return self.current_tweens
 
 
+    def _remove_key(self, tween, key):
+        Tweener._remove_key(self, tween, key)
+        slots = self._tween_slots.get(tween)
+        if slots and key in slots:
+            self._kill_slot(slots.pop(key))
+            self._compact()
+
+    def _discard(self, tween):
+        Tweener._discard(self, tween)
+        for i in self._tween_slots.pop(tween, {}).itervalues():
+            self._kill_slot(i)
+        self._callback_tweens.discard(tween)
+        self._scalar_tweens.discard(tween)
+        self._compact()
+
+
+    def _update_slots(self, delta):
+        """move all the slots forward by delta seconds and set the new values.
+        returns list of bulk tweens that have completed"""
+        if not self._size:
+            return []
+
+        if numpy:
+            finished = self._update_arrays(delta)
+        else:
+            finished = self._update_lists(delta)
+
+        done = []
+        for i in finished:
+            tween = self._owners[i]
+            if not tween.complete:
+                tween.delta, tween.complete = tween.delay + tween.duration, True
+                done.append(tween)
+        return done
+
+    def _update_arrays(self, delta):
+        n, columns = self._size, self._columns
+        alive = columns["alive"][:n] != 0
+        elapsed, delay = columns["elapsed"][:n], columns["delay"][:n]
+        total = delay + columns["duration"][:n]
+        numpy.minimum(elapsed + delta, total, out = elapsed)
+
+        finished = alive & (elapsed >= total)
+        running = numpy.flatnonzero(alive & (elapsed >= delay) & ~finished)
+        if len(running):
+            start = delay[running]
+            fractions = self._ease(columns["easing"][running],
+                                   (elapsed[running] - start) / (total[running] - start))
+            values = columns["start"][running] + columns["change"][running] * fractions
+
+            objs, keys = self._objs, self._keys
+            for i, value, round in zip(running.tolist(), values.tolist(),
+                                       columns["round"][running].tolist()):
+                setattr(objs[i], keys[i], int(value) if round else value)
+
+        finished = numpy.flatnonzero(finished).tolist()
+        for i in finished:
+            setattr(self._objs[i], self._keys[i], self._targets[i])
+        return finished
+
+    def _update_lists(self, delta):
+        columns, objs, keys = self._columns, self._objs, self._keys
+        alive, elapsed, delay = columns["alive"], columns["elapsed"], columns["delay"]
+        duration, easing_ids = columns["duration"], columns["easing"]
+        start, change, rounds = columns["start"], columns["change"], columns["round"]
+        easings = self._easings
+
+        finished = []
+        for i in xrange(self._size):
+            if not alive[i]:
+                continue
+
+            total = delay[i] + duration[i]
+            elapsed[i] = min(elapsed[i] + delta, total)
+            if elapsed[i] < delay[i]:
+                continue
+
+            if elapsed[i] == total:
+                setattr(objs[i], keys[i], self._targets[i])
+                finished.append(i)
+            else:
+                fraction = easings[easing_ids[i]]((elapsed[i] - delay[i]) / (total - delay[i]))
+                value = start[i] + change[i] * fraction
+                setattr(objs[i], keys[i], int(value) if rounds[i] else value)
+        return finished
+
+    def _ease(self, easing_ids, t):
+        """apply the easings to the array of progress values"""
+        fractions = numpy.empty_like(t)
+        for easing_id in numpy.unique(easing_ids).tolist():
+            mask = easing_ids == easing_id
+            fractions[mask] = self._apply_easing(easing_id, t[mask])
+        return fractions
+
+    def _apply_easing(self, easing_id, t):
+        easing = self._easings[easing_id]
+        if getattr(easing, "ease_array", None):
+            return easing.ease_array(t)
+
+        if self._vectorized.get(easing_id) is not False:
+            # most of the curves are plain arithmetic and work on arrays
+            try:
+                res = easing(t)
+                if isinstance(res, numpy.ndarray) and res.shape == t.shape:
+                    return res
+            except (TypeError, ValueError):
+                pass
+            self._vectorized[easing_id] = False
+
+        return numpy.fromiter((easing(val) for val in t.tolist()), float, len(t))
+
+
+    def _get_easing_id(self, easing):
+        if easing not in self._easing_ids:
+            self._easing_ids[easing] = len(self._easings)
+            self._easings.append(easing)
+        return self._easing_ids[easing]
+
+    def _add_slot(self, tween, key, tweenable, easing_id):
+        i = self._size
+        values = (tweenable.start_value, tweenable.change, tween.delta,
+                  tween.delay, tween.duration, easing_id, bool(tween.round), 1)
+        if numpy:
+            if i == len(self._columns["start"]): # grow
+                for name, column in self._columns.items():
+                    self._columns[name] = numpy.concatenate((column, numpy.zeros_like(column)))
+            for (name, typecode), value in zip(_bulk_columns, values):
+                self._columns[name][i] = value
+        else:
+            for (name, typecode), value in zip(_bulk_columns, values):
+                self._columns[name].append(value)
+
+        self._objs.append(tween.target)
+        self._keys.append(key)
+        self._targets.append(tweenable.target_value)
+        self._owners.append(tween)
+        self._size += 1
+        return i
+
+    def _kill_slot(self, i):
+        self._columns["alive"][i] = 0
+        self._objs[i] = self._targets[i] = self._owners[i] = None
+        self._dead += 1
+
+    def _compact(self):
+        """drop the dead slots once they make up the most of the arrays"""
+        if self._dead < 64 or self._dead * 2 < self._size:
+            return
+
+        alive = self._columns["alive"]
+        keep = [i for i in xrange(self._size) if alive[i]]
+        new_index = dict((old, new) for new, old in enumerate(keep))
+
+        for name, typecode in _bulk_columns:
+            column = self._columns[name]
+            if numpy:
+                compacted = numpy.zeros(max(64, len(keep) * 2), typecode)
+                compacted[:len(keep)] = column[keep]
+            else:
+                compacted = array.array(typecode, (column[i] for i in keep))
+            self._columns[name] = compacted
+
+        for name in ("_objs", "_keys", "_targets", "_owners"):
+            values = getattr(self, name)
+            setattr(self, name, [values[i] for i in keep])
+
+        for slots in self._tween_slots.itervalues():
+            for key, i in slots.items():
+                slots[key] = new_index[i]
+
+        self._size, self._dead = len(keep), 0
+
+
+class TimelineGroup(object):
+    """Steps of a :class:`Timeline` that run one after another, or all at
+    once when the group is parallel. Get one from :func:`sequence` or
+    :func:`parallel` of the timeline or another group.
+    All the adding functions return the group so that calls can be chained::
+
+      timeline.add(sprite, x = 100).wait(0.5).add(sprite, x = 0)
+    """
+    def __init__(self, timeline, parallel = False):
+        self.timeline = timeline
+
+        #: True if the steps all start at once
+        self.is_parallel = parallel
+
+        self.steps = []
+
+    def add(self, obj, duration = None, easing = None, delay = None, round = False, **kwargs):
+        """tween attributes of the object to the given values. the params
+        are the same as for :func:`Tweener.add_tween`"""
+        return self._append(_TimelineTween(obj, duration, easing, delay or 0, round, kwargs))
+
+    def call(self, func, *args):
+        """call func with the given arguments when the playhead gets here"""
+        return self._append(_TimelineCall(func, args))
+
+    def wait(self, seconds):
+        """do nothing for the given number of seconds"""
+        return self._append(_TimelineWait(seconds))
+
+    def sequence(self):
+        """add a sequential group and return it"""
+        group = TimelineGroup(self.timeline)
+        self._append(group)
+        return group
+
+    def parallel(self):
+        """add a parallel group and return it"""
+        group = TimelineGroup(self.timeline, True)
+        self._append(group)
+        return group
+
+    def _append(self, step):
+        self.steps.append(step)
+        self.timeline._layout = None
+        return self
+
+    def _lay_out(self, start, timeline, tracks, calls):
+        """place the steps on the timeline starting at the given time.
+        returns the end time of the group"""
+        time = end = start
+        for step in self.steps:
+            step_end = step._lay_out(time, timeline, tracks, calls)
+            end = max(end, step_end)
+            if not self.is_parallel:
+                time = step_end
+        return end
+
+
+class _TimelineTween(object):
+    __slots__ = ('target', 'duration', 'easing', 'delay', 'round', 'values')
+
+    def __init__(self, target, duration, easing, delay, round, values):
+        self.target, self.duration, self.easing = target, duration, easing
+        self.delay, self.round, self.values = delay, round, values
+
+    def _lay_out(self, start, timeline, tracks, calls):
+        duration = timeline.default_duration if self.duration is None else self.duration
+        easing = self.easing or timeline.default_easing
+        start = start + self.delay
+        for key, value in self.values.items():
+            tracks[(self.target, key)].append((start, duration, value, easing, self.round))
+        return start + duration
+
+class _TimelineCall(object):
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        self.func, self.args = func, args
+
+    def _lay_out(self, start, timeline, tracks, calls):
+        calls.append((start, len(calls), self.func, self.args))
+        return start
+
+class _TimelineWait(object):
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def _lay_out(self, start, timeline, tracks, calls):
+        return start + self.seconds
+
+
+class _TimelineTrack(object):
+    """all the tweens of a single attribute, sorted by their start time"""
+    __slots__ = ('target', 'key', 'initial', 'starts', 'entries', 'start', 'end')
+
+    def __init__(self, target, key, tweens):
+        self.target, self.key = target, key
+        self.initial = getattr(target, key)
+
+        tweens = sorted(tweens, key = lambda tween: tween[0])
+        self.starts = [start for start, duration, value, easing, round in tweens]
+
+        # each tween picks up where the previous one has finished
+        self.entries, value_from = [], self.initial
+        for start, duration, value, easing, round in tweens:
+            self.entries.append((start, duration, Tweenable(value_from, value), easing, round))
+            value_from = value
+
+        self.start = self.starts[0]
+        self.end = max(start + duration for start, duration, value, easing, round in tweens)
+
+    def set(self, time):
+        """set the attribute to its value at the given time"""
+        i = bisect.bisect_right(self.starts, time) - 1
+        if i < 0:
+            value = self.initial
+        else:
+            start, duration, tweenable, easing, round = self.entries[i]
+            if time >= start + duration:
+                value = tweenable.target_value
+            else:
+                value = tweenable.update(easing(float(time - start) / duration))
+                if isinstance(value, float) and round:
+                    value = int(value)
+        setattr(self.target, self.key, value)
+
+
+class Timeline(TimelineGroup):
+    """Tweens and callbacks laid out in time upfront and played back from a
+    single clock. The timeline itself is a sequence; use :func:`parallel`
+    and :func:`sequence` to nest groups::
+
+      timeline = Timeline(repeat = -1)
+      timeline.add(sprite, x = 100, duration = 0.5)
+      group = timeline.parallel()
+      group.add(sprite, y = 100)
+      group.add(other_sprite, opacity = 0)
+      timeline.call(do_something)
+      scene.play_timeline(timeline)
+
+    Each tween starts from where the previous tween of the same attribute
+    has left off, and the very first one from the value the attribute has
+    when the timeline is first played or seeked. As everything is known in advance,
+    the timeline can be seeked, reversed and time scaled at any point -
+    setting the attributes to a given time costs a binary search per
+    animated attribute."""
+    def __init__(self, default_duration = None, default_easing = None,
+                 repeat = 0, time_scale = 1, on_complete = None, on_update = None):
+        TimelineGroup.__init__(self, self)
+
+        #: defaults for the tweens that don't specify their own. when not
+        #: set, the ones of the tweener are used
+        self.default_duration = default_duration
+        self.default_easing = default_easing
+
+        #: number of times to play the timeline again after the first
+        #: time. -1 to play forever
+        self.repeat = repeat
+
+        #: speed of the playback. 2 plays twice as fast
+        self.time_scale = time_scale
+
+        #: callback to execute on complete, gets the timeline
+        self.on_complete = on_complete
+
+        #: callback to execute on every update, gets the timeline
+        self.on_update = on_update
+
+        #: is the timeline playing backwards
+        self.reversed = False
+
+        #: is the playback paused
+        self.paused = False
+
+        #: position of the playhead within the current iteration
+        self.time = 0
+
+        #: number of the current iteration, starting at 0
+        self.iteration = 0
+
+        self.tweener = None
+        self._layout = None
+        self._entered = False # have the calls at the current time been made
+
+
+    @property
+    def duration(self):
+        """duration of a single iteration in seconds"""
+        return self._get_layout()[0]
+
+    def seek(self, time):
+        """move the playhead to the given time and set all the attributes
+        accordingly. the calls on the way are skipped"""
+        duration, tracks, call_times, calls = self._get_layout()
+        self.time = max(0, min(time, duration))
+        for track in tracks:
+            track.set(self.time)
+        self._entered = True
+
+    def reverse(self):
+        """change the direction of the playback"""
+        self.reversed = not self.reversed
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        """continue the paused playback. paused timelines don't keep the
+        scene redrawing, so call redraw on the scene afterwards"""
+        self.paused = False
+
+    def cancel(self):
+        """stop the timeline without completing the motion or firing the on_complete"""
+        if self.tweener:
+            self.tweener.remove_timeline(self)
+
+    def finish(self):
+        """jump to the end of the playback"""
+        self.seek(0 if self.reversed else self.duration)
+
+
+    def update(self, delta_seconds):
+        """move the playhead by delta_seconds. returns True when the timeline
+        has completed"""
+        if self.paused:
+            return False
+
+        duration, tracks, call_times, calls = self._get_layout()
+        step = delta_seconds * self.time_scale
+        if self.reversed:
+            step = -step
+
+        while True:
+            target = self.time + step
+            end = duration if step >= 0 else 0
+            if step >= 0 and target < duration or step < 0 and target > 0:
+                self._move(self.time, target, tracks, call_times, calls)
+                break
+
+            # reached the end of the iteration
+            self._move(self.time, end, tracks, call_times, calls)
+            if self.repeat >= 0 and self.iteration >= self.repeat or not duration:
+                if self.on_update: self.on_update(self)
+                if self.on_complete: self.on_complete(self)
+                return True
+
+            self.iteration += 1
+            step = target - end
+            self.seek(duration - end)
+            self._entered = False
+
+        if self.on_update: self.on_update(self)
+        return False
+
+
+    def _move(self, time_from, time_to, tracks, call_times, calls):
+        self.time = time_to
+
+        low, high = min(time_from, time_to), max(time_from, time_to)
+        for track in tracks:
+            if track.start <= high and track.end >= low:
+                track.set(time_to)
+
+        # the calls at the starting point are made only when entering it
+        if time_to >= time_from:
+            first = bisect.bisect_left if not self._entered else bisect.bisect_right
+            due = calls[first(call_times, time_from):bisect.bisect_right(call_times, time_to)]
+        else:
+            last = bisect.bisect_right if not self._entered else bisect.bisect_left
+            due = reversed(calls[bisect.bisect_left(call_times, time_to):last(call_times, time_from)])
+        self._entered = True
+
+        for time, order, func, args in due:
+            func(*args)
+
+    def _get_layout(self):
+        if self._layout is None:
+            if self.default_duration is None:
+                self.default_duration = self.tweener.default_duration if self.tweener else 1.0
+            if self.default_easing is None:
+                self.default_easing = self.tweener.default_easing if self.tweener else Easing.Cubic.ease_in_out
+
+            tracks, calls = collections.defaultdict(list), []
+            duration = self._lay_out(0, self, tracks, calls)
+            tracks = [_TimelineTrack(target, key, tweens) for (target, key), tweens in tracks.items()]
+            calls.sort()
+            self._layout = (duration, tracks, [call[0] for call in calls], calls)
+        return self._layout
+
+
 class Tween(object):
     __slots__ = ('tweenables', 'target', 'delta', 'duration', 'delay',
                  'ease', 'delta', 'complete', 'round',
@@ -133,10 +750,10 @@ class Tween(object):
         #: easing function
         self.ease = easing
 
-        # list of (property, start_value, delta)
-        self.tweenables = set()
+        # property -> tweenable
+        self.tweenables = {}
         for key, value in kwargs.items():
-            self.tweenables.add((key, Tweenable(getattr(self.target, key), value)))
+            self.tweenables[key] = Tweenable(getattr(self.target, key), value)
 
         self.delta = 0
 
@@ -162,12 +779,12 @@ class Tween(object):
         if delta < self.delay:
             pass
         elif delta == total_duration:
-            for key, tweenable in self.tweenables:
+            for key, tweenable in self.tweenables.iteritems():
                 setattr(self.target, key, tweenable.target_value)
         else:
             fraction = self.ease((delta - self.delay) / (total_duration - self.delay))
 
-            for key, tweenable in self.tweenables:
+            for key, tweenable in self.tweenables.iteritems():
                 res = tweenable.update(fraction)
                 if isinstance(res, float) and self.round:
                     res = int(res)
@@ -263,6 +880,11 @@ def inverse(method):
 
 def symmetric(ease_in, ease_out):
     def real_symmetric(t, *args, **kwargs):
+        if numpy and isinstance(t, numpy.ndarray):
+            # both halves over the whole array, so that BulkTweener can ease in one go
+            return numpy.where(t < 0.5, ease_in(t * 2, *args, **kwargs) / 2,
+                               ease_out((t - 0.5) * 2, *args, **kwargs) / 2 + 0.5)
+
         if t < 0.5:
             return ease_in(t * 2, *args, **kwargs) / 2
 
@@ -335,6 +957,121 @@ class Easing(object):
     Expo = Symmetric(_expo_in)
 
 
+# the lookups hold on to their easing functions, so the cache is capped
+# instead of keyed weakly. the least recently used table goes first
+_tabulated = collections.OrderedDict()
+_max_tabulated = 64
+_max_table_size = 4096
+
+def tabulate(easing, interpolation = "linear", max_error = 0.0001):
+    """Returns an easing function that looks the values up in a table sampled
+    from the given one, with "linear" or "cubic" interpolation between the
+    samples. The table keeps doubling until the interpolation stays within
+    max_error of the original curve. Curves that can't be brought within the
+    bound in 4096 samples, or whose error stops shrinking as the table grows
+    (Circ and Expo have a jump or an infinitely steep end, Bounce has kinks),
+    are returned as they are.
+
+    Tables are built on first use and shared afterwards, up to the last 64
+    used ones, so pass long-lived functions rather than lambdas made on the
+    spot.
+
+    The returned function has `table` with the samples, `error` with the
+    measured max error and, when numpy is available, `ease_array` that takes
+    a whole array of values at once."""
+    if hasattr(easing, "table"):
+        return easing # already tabulated
+
+    if interpolation not in _lookups:
+        raise ValueError("interpolation should be 'linear' or 'cubic', got %s" % interpolation)
+
+    key = (easing, interpolation, max_error)
+    lookup = _tabulated.pop(key, None)
+    if lookup is None:
+        lookup = _tabulate(easing, interpolation, max_error)
+        if len(_tabulated) >= _max_tabulated:
+            _tabulated.popitem(last = False)
+    _tabulated[key] = lookup
+    return lookup
+
+def _tabulate(easing, interpolation, max_error):
+    size, previous_error = 64, None
+    while size <= _max_table_size:
+        table = [easing(float(i) / size) for i in range(size + 1)]
+        lookup = _lookups[interpolation](table, easing)
+
+        # measure at eight points between the samples and keep a margin for
+        # the peaks that fall in between those
+        points = (float(i * 8 + k) / (size * 8) for i in range(size) for k in range(1, 8))
+        error = max(abs(lookup(t) - easing(t)) for t in points)
+        if error <= max_error / 2:
+            lookup.table, lookup.error = table, error
+            lookup.ease_array = _array_lookup(table, interpolation, easing) if numpy else None
+            return lookup
+
+        if previous_error is not None and error >= previous_error:
+            break # doubling doesn't help, the curve has a jump or a steep end
+        size, previous_error = size * 2, error
+
+    return easing
+
+
+def _linear_lookup(table, easing):
+    n = len(table) - 1
+    def lookup(t):
+        if not 0 <= t <= 1:
+            return easing(t)
+        pos = t * n
+        i = int(pos)
+        if i == n: i -= 1
+        a = table[i]
+        return a + (table[i + 1] - a) * (pos - i)
+    return lookup
+
+def _cubic_lookup(table, easing):
+    # catmull-rom spline through the neighbouring samples. the ends are
+    # extended linearly so that the first and last segment get neighbours too
+    n = len(table) - 1
+    padded = [2 * table[0] - table[1]] + table + [2 * table[-1] - table[-2]]
+    def lookup(t):
+        if not 0 <= t <= 1:
+            return easing(t)
+        pos = t * n
+        i = int(pos)
+        if i == n: i -= 1
+        f = pos - i
+        p0, p1, p2, p3 = padded[i:i + 4]
+        return p1 + 0.5 * f * (p2 - p0 + f * (2 * p0 - 5 * p1 + 4 * p2 - p3 + f * (3 * (p1 - p2) + p3 - p0)))
+    return lookup
+
+_lookups = {"linear": _linear_lookup, "cubic": _cubic_lookup}
+
+def _array_lookup(table, interpolation, easing):
+    n = len(table) - 1
+    if interpolation == "cubic":
+        table = [2 * table[0] - table[1]] + table + [2 * table[-1] - table[-2]]
+    values = numpy.array(table)
+
+    def ease_array(t):
+        clipped = numpy.clip(t, 0, 1)
+        pos = clipped * n
+        i = numpy.minimum(pos.astype(int), n - 1)
+        f = pos - i
+
+        if interpolation == "linear":
+            a = values[i]
+            res = a + (values[i + 1] - a) * f
+        else:
+            p0, p1, p2, p3 = values[i], values[i + 1], values[i + 2], values[i + 3]
+            res = p1 + 0.5 * f * (p2 - p0 + f * (2 * p0 - 5 * p1 + 4 * p2 - p3 + f * (3 * (p1 - p2) + p3 - p0)))
+
+        outside = clipped != t
+        if outside.any():
+            res[outside] = [easing(val) for val in t[outside].tolist()]
+        return res
+    return ease_array
+
+
 
 class _Dummy(object):
     def __init__(self, a, b, c):
@@ -342,32 +1079,30 @@ class _Dummy(object):
         self.b = b
         self.c = c
 
-if __name__ == "__main__":
-    import datetime as dt
-
-    tweener = Tweener()
-    objects = []
-
-    object_count, update_times = 1000, 100
-
-    for i in range(object_count):
-        objects.append(_Dummy(i-100, i-100, i-100))
-
-
-    total = dt.datetime.now()
+def _benchmark(tweener, object_count, update_times):
+    objects = [_Dummy(i-100, i-100, i-100) for i in range(object_count)]
 
     t = dt.datetime.now()
-    print "Adding %d tweens..." % object_count
     for i, o in enumerate(objects):
         tweener.add_tween(o, a = i,
                              b = i,
                              c = i,
                              duration = 0.1 * update_times,
                              easing=Easing.Circ.ease_in_out)
-    print dt.datetime.now() - t
+    add_time = dt.datetime.now() - t
 
     t = dt.datetime.now()
-    print "Updating %d times......" % update_times
-    for i in range(update_times):  #update 1000 times
+    for i in range(update_times):
         tweener.update(0.1)
-    print dt.datetime.now() - t
+    return add_time, dt.datetime.now() - t
+
+
+if __name__ == "__main__":
+    update_times = 100
+    print "numpy: %s" % ("yes" if numpy else "no, using array")
+    for object_count in (1000, 10000, 100000):
+        for tweener in (Tweener(), Tweener(tabulate = True), BulkTweener(), BulkTweener(tabulate = True)):
+            add_time, update_time = _benchmark(tweener, object_count, update_times)
+            name = tweener.__class__.__name__ + (" (tables)" if tweener.tabulate else "")
+            print "%-20s %6d tweens: add %s, %d updates %s" % (name, object_count, add_time,
+                                                                update_times, update_time)
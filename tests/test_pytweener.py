@@ -0,0 +1,39 @@
+# - coding: utf-8 -
+import unittest
+
+from lib import pytweener
+
+
+class Dummy(object):
+    def __init__(self):
+        self.x = 0
+
+
+class TimelineTest(unittest.TestCase):
+    def test_seek_into_int_duration(self):
+        obj = Dummy()
+        timeline = pytweener.Timeline()
+        timeline.add(obj, x = 100, duration = 2, easing = pytweener.Easing.Linear.ease_in)
+
+        timeline.seek(1)
+        self.assertAlmostEqual(obj.x, 50)
+
+        timeline.seek(2)
+        self.assertEqual(obj.x, 100)
+
+
+class TabulateTest(unittest.TestCase):
+    def test_cache_is_capped(self):
+        ease = pytweener.Easing.Cubic.ease_in
+        pytweener.tabulate(ease)
+        for i in range(pytweener._max_tabulated * 2):
+            pytweener.tabulate(lambda t, i = i: t * t)
+
+        self.assertEqual(len(pytweener._tabulated), pytweener._max_tabulated)
+        self.assertFalse(any(key[0] is ease for key in pytweener._tabulated))
+
+        # tables in use are shared
+        self.assertIs(pytweener.tabulate(ease), pytweener.tabulate(ease))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,7 @@
 from lib import graphics
 
 from ui.widget import Widget, Tooltip, TooltipWindow
-from ui.data import TreeModel, TreeModelRow
+from ui.data import TreeModel, TreeModelRow, ColumnarTreeModel, ColumnarRow
 
 from ui.containers import Container, Box, HBox, VBox, Table, Fixed, Viewport, Group, Bin, Flow, Panes, PanesGrip
 from ui.widgets import Label, Spinner
@@ -710,6 +710,8 @@ class Table(Container):
 class Viewport(Bin):
     """View a fragment of the child. Most commonly seen in
     :class:`~ui.scroll.ScrollArea`"""
+    clips_children = True
+
     def __init__(self, contents=None, **kwargs):
         Bin.__init__(self, contents, **kwargs)
         self.connect("on-render", self.__on_render)
@@ -2,19 +2,28 @@
 
 # Copyright (c) 2011-2012 Media Modifications, Ltd.
 # Dual licensed under the MIT or GPL Version 2 licenses.
+import array
+from contextlib import contextmanager
 from gi.repository import GObject as gobject
 
 class TreeModel(gobject.GObject):
     """A helper structure that is used by treeviews and listitems - our version
         of a tree model, based on list.
         Pass in either simple list for single-column data or a nested list for
-        multi-column
+        multi-column.
+
+        The rows-* signals carry the start index and count of the affected
+        rows. Changes done within :func:`batch` are signalled once it ends,
+        with adjacent ranges merged.
     """
 
     __gsignals__ = {
         "row-changed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
         "row-deleted": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
         "row-inserted": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        "rows-changed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_INT, gobject.TYPE_INT)),
+        "rows-deleted": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_INT, gobject.TYPE_INT)),
+        "rows-inserted": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_INT, gobject.TYPE_INT)),
     }
 
     def __init__(self, iterable = None):
@@ -24,37 +33,109 @@ class TreeModel(gobject.GObject):
 
         self._data = []
 
+        # rows know their index. after inserts and deletes the indexes from
+        # _dirty_from on are stale and get renumbered on the next lookup
+        self._dirty_from = None
+
+        self._batch_depth = 0
+        self._pending = [] # (signal, start, count) waiting for the batch to end
+
         gobject.GObject.__init__(self)
         if iterable:
             self.extend(iterable)
 
     def __setitem__(self, row_idx, val):
-        self._data.__setitem__(row_idx, TreeModelRow(self, val))
-        self._on_row_changed(self._data[row_idx]._row)
+        row_idx = self._position(row_idx)
+        self._data[row_idx]._index = None
+        row = self._data[row_idx] = TreeModelRow(self, val)
+        row._index = row_idx
+        self._notify("rows-changed", row_idx, 1)
 
     def __getitem__(self, row_idx):
         return self._data.__getitem__(row_idx)
 
     def __delitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self._data))
+            removed = self._data[idx]
+        else:
+            start, step = self._position(idx), 1
+            removed = [self._data[start]]
+
+        if not removed:
+            return
+
+        for row in removed:
+            row._index = None
         del self._data[idx]
-        self._on_row_deleted()
+        self._renumber_from(min(start, start + (len(removed) - 1) * step))
+
+        if step == 1:
+            self._notify("rows-deleted", start, len(removed))
+        else:
+            # scattered rows, going from the back so the indexes hold
+            positions = sorted(start + i * step for i in range(len(removed)))
+            with self.batch():
+                for i in reversed(positions):
+                    self._notify("rows-deleted", i, 1)
 
     def __len__(self):
         return len(self._data)
 
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, row):
+        return isinstance(row, TreeModelRow) and row._parent is self and row._index is not None
+
     def index(self, item):
-        return self._data.index(item)
+        """returns index of the row. raises ValueError if the row is not in
+        the model"""
+        idx = getattr(item, "_index", None)
+        if idx is None or getattr(item, "_parent", None) is not self:
+            raise ValueError("%s is not in the model" % repr(item))
+
+        if idx >= len(self._data) or self._data[idx] is not item:
+            self._renumber()
+            idx = item._index
+        return idx
+
+    def _position(self, idx):
+        """turns negative index into a positive one"""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("row index out of range")
+        return idx
+
+    def _renumber_from(self, idx):
+        """mark indexes from idx on as stale"""
+        if idx < len(self._data):
+            self._dirty_from = idx if self._dirty_from is None else min(self._dirty_from, idx)
+
+    def _renumber(self):
+        if self._dirty_from is None:
+            return
+        data = self._data
+        for i in xrange(self._dirty_from, len(data)):
+            data[i]._index = i
+        self._dirty_from = None
 
     def append(self, row):
         if isinstance(row, list) == False:
             row = [row]
-        self._data.append(TreeModelRow(self, row))
-        self._on_row_changed(None)
+        self._append_row(row)
+        self._notify("rows-inserted", len(self._data) - 1, 1)
+
+    def _append_row(self, row):
+        row = TreeModelRow(self, row)
+        row._index = len(self._data)
+        self._data.append(row)
 
     def remove(self, target_row):
         """remove the given row"""
-        if target_row in self._data:
-            self.__delitem__(self._data.index(target_row))
+        if target_row in self:
+            self.__delitem__(self.index(target_row))
         else:
             # TODO - figure out a better way
             if isinstance(target_row, list) == False:
@@ -65,32 +146,99 @@ class TreeModel(gobject.GObject):
                     self.__delitem__(i)
                     return
 
-    def pop(self, idx):
+    def pop(self, idx = -1):
+        idx = self._position(idx)
         row = self._data.pop(idx)
-        self._on_row_deleted()
+        row._index = None
+        self._renumber_from(idx)
+        self._notify("rows-deleted", idx, 1)
         return row
 
     def insert(self, i, row):
         if isinstance(row, list) == False:
             row = [row]
-        self._data.insert(i, TreeModelRow(self, row))
-        self._on_row_changed(None)
+        i = min(max(i + len(self._data) if i < 0 else i, 0), len(self._data))
+        row = TreeModelRow(self, row)
+        row._index = i
+        self._data.insert(i, row)
+        self._renumber_from(i + 1)
+        self._notify("rows-inserted", i, 1)
 
     def extend(self, rows):
+        start = len(self._data)
         for row in rows:
             if isinstance(row, list) == False:
                 row = [row]
-            self._data.append(TreeModelRow(self, row))
-        self._on_row_changed(None)
+            self._append_row(row)
+        if len(self._data) > start:
+            self._notify("rows-inserted", start, len(self._data) - start)
+
+
+    @contextmanager
+    def batch(self):
+        """hold back the change signals until the end of the block, then
+        send them with the adjacent ranges merged. batches can be nested::
+
+            with model.batch():
+                for row in rows:
+                    model.append(row)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush()
+
+    def _notify(self, signal, start, count):
+        if not self._batch_depth:
+            self.emit(signal, start, count)
+            if signal == "rows-deleted":
+                self.emit("row-deleted")
+            else:
+                self.emit("row-changed", start if signal == "rows-changed" and count == 1 else None)
+            return
+
+        if self._pending:
+            last_signal, last_start, last_count = self._pending[-1]
+            if signal == last_signal:
+                if signal == "rows-inserted" and last_start <= start <= last_start + last_count:
+                    # inserted into or right next to the block just inserted
+                    self._pending[-1] = (signal, last_start, last_count + count)
+                    return
+                elif signal == "rows-deleted" and start <= last_start <= start + count:
+                    # the rows just before or just after the ones deleted
+                    self._pending[-1] = (signal, start, last_count + count)
+                    return
+                elif signal == "rows-changed" and start <= last_start + last_count and last_start <= start + count:
+                    end = max(start + count, last_start + last_count)
+                    start = min(start, last_start)
+                    self._pending[-1] = (signal, start, end - start)
+                    return
+
+        self._pending.append((signal, start, count))
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        for signal, start, count in pending:
+            self.emit(signal, start, count)
 
-    def _on_row_changed(self, row = None, col = None):
-        self.emit("row-changed", self._data.index(row) if row else None)
+        signals = set(signal for signal, start, count in pending)
+        if "rows-deleted" in signals:
+            self.emit("row-deleted")
+        if "rows-inserted" in signals or "rows-changed" in signals:
+            self.emit("row-changed", None)
 
-    def _on_row_deleted(self):
-        self.emit("row-deleted")
+    def _on_row_changed(self, row, col = None):
+        if row not in self:
+            return # the row has been removed from the model meanwhile
+        self._notify("rows-changed", self.index(row), 1)
 
 
 class TreeModelRow(object):
+    __slots__ = ('_parent', '_row', '_index')
+
     def __init__(self, parent = None, row = None):
         self._parent = parent
 
@@ -98,6 +246,7 @@ class TreeModelRow(object):
             row = [row]
 
         self._row = row or []
+        self._index = None # maintained by the model
 
     def __setitem__(self, col, val):
         self._row[col] = val
@@ -111,3 +260,347 @@ class TreeModelRow(object):
 
     def __repr__(self):
         return "<TreeModelRow %s %s>" % (getattr(self, "id", None) or str(id(self)), str(self._row))
+
+
+
+class ColumnarTreeModel(TreeModel):
+    """A tree model that keeps the data by column instead of by row, for big
+    tables. Pass in the column types - an :mod:`array` typecode like "i" or
+    "d" for numbers, str for text, which is kept in a string table shared by
+    the columns so that repeated labels are stored once, or object for
+    anything else. Rows are :class:`ColumnarRow` views created on access.
+
+    Example::
+
+        model = ColumnarTreeModel(["i", str, "d"], [[1, "one", 1.0],
+                                                     [2, "two", 2.0]])
+
+    Sorting and filtering reorder the rows without moving any data.
+    Deleted rows keep taking space until :func:`compact` is called.
+    """
+    def __init__(self, columns, iterable = None):
+        #: types of the columns
+        self.columns = list(columns)
+
+        self._cols = []
+        for kind in self.columns:
+            if kind is str:
+                self._cols.append(array.array("l"))
+            elif kind is object:
+                self._cols.append([])
+            else:
+                self._cols.append(array.array(kind))
+
+        self._strings, self._string_ids = [], {}
+
+        self._order = array.array("l") # the rows in sort order
+        self._view = self._order       # the rows that pass the filter
+        self._filter = None
+        self._positions = array.array("l") # row id -> index in the view, -1 if not in it
+        self._order_positions = array.array("l") # row id -> index in the order
+        self._order_dirty_from = None
+        self._alive = bytearray()
+        self._count = 0                # number of stored rows, dead or alive
+
+        TreeModel.__init__(self, iterable)
+
+
+    def __getitem__(self, row_idx):
+        if isinstance(row_idx, slice):
+            return [ColumnarRow(self, row_id) for row_id in self._view[row_idx]]
+        return ColumnarRow(self, self._view[row_idx])
+
+    def __setitem__(self, row_idx, val):
+        row_idx = self._position(row_idx)
+        self._store(self._view[row_idx], val)
+        self._notify("rows-changed", row_idx, 1)
+
+    def __delitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self._view))
+            positions = range(start, stop, step)
+        else:
+            positions = [self._position(idx)]
+
+        with self.batch():
+            for pos in sorted(positions, reverse = True):
+                self._remove_at(pos)
+                self._notify("rows-deleted", pos, 1)
+
+    def __len__(self):
+        return len(self._view)
+
+    def __iter__(self):
+        for row_id in self._view:
+            yield ColumnarRow(self, row_id)
+
+    def __contains__(self, row):
+        return isinstance(row, ColumnarRow) and row._model is self \
+               and self._find(row._id) is not None
+
+    def index(self, item):
+        """returns index of the row. raises ValueError if the row is not in
+        the model"""
+        pos = None
+        if isinstance(item, ColumnarRow) and item._model is self:
+            pos = self._find(item._id)
+        if pos is None:
+            raise ValueError("%s is not in the model" % repr(item))
+        return pos
+
+    def _find(self, row_id):
+        """returns position of the row in the view or None"""
+        if not 0 <= row_id < len(self._positions):
+            return None
+
+        pos = self._positions[row_id]
+        if not (0 <= pos < len(self._view) and self._view[pos] == row_id):
+            self._renumber()
+            pos = self._positions[row_id]
+            if not (0 <= pos < len(self._view) and self._view[pos] == row_id):
+                return None
+        return pos
+
+    def _renumber_from(self, idx):
+        """mark positions from idx on as stale"""
+        if idx < len(self._view):
+            self._dirty_from = idx if self._dirty_from is None else min(self._dirty_from, idx)
+
+    def _renumber(self):
+        if self._dirty_from is None:
+            return
+        view, positions = self._view, self._positions
+        for i in xrange(self._dirty_from, len(view)):
+            positions[view[i]] = i
+        self._dirty_from = None
+
+    def _order_index(self, row_id):
+        """returns position of the row in the sort order"""
+        pos = self._order_positions[row_id]
+        if not (0 <= pos < len(self._order) and self._order[pos] == row_id):
+            order, positions = self._order, self._order_positions
+            for i in xrange(self._order_dirty_from or 0, len(order)):
+                positions[order[i]] = i
+            self._order_dirty_from = None
+            pos = positions[row_id]
+        return pos
+
+    def _reorder_from(self, idx):
+        """mark order positions from idx on as stale"""
+        if idx < len(self._order):
+            self._order_dirty_from = idx if self._order_dirty_from is None else min(self._order_dirty_from, idx)
+
+
+    def append(self, row):
+        row_id = self._add(row)
+        if self._add_to_view(row_id, len(self._view), len(self._order)):
+            self._notify("rows-inserted", len(self._view) - 1, 1)
+
+    def insert(self, i, row):
+        i = min(max(i + len(self._view) if i < 0 else i, 0), len(self._view))
+        if i < len(self._view):
+            order_pos = self._order_index(self._view[i]) if self._filter else i
+        else:
+            order_pos = len(self._order)
+
+        row_id = self._add(row)
+        if self._add_to_view(row_id, i, order_pos):
+            self._notify("rows-inserted", i, 1)
+
+    def extend(self, rows):
+        start = len(self._view)
+        for row in rows:
+            row_id = self._add(row)
+            self._add_to_view(row_id, len(self._view), len(self._order))
+        if len(self._view) > start:
+            self._notify("rows-inserted", start, len(self._view) - start)
+
+    def pop(self, idx = -1):
+        idx = self._position(idx)
+        row = ColumnarRow(self, self._view[idx])
+        self._remove_at(idx)
+        self._notify("rows-deleted", idx, 1)
+        return row
+
+    def remove(self, target_row):
+        """remove the given row"""
+        if target_row in self:
+            self.__delitem__(self.index(target_row))
+            return
+
+        if isinstance(target_row, (list, tuple)) == False:
+            target_row = [target_row]
+        target_row = list(target_row)
+        for i, row in enumerate(self):
+            if list(row) == target_row:
+                self.__delitem__(i)
+                return
+
+
+    def sort(self, column = 0, key = None, reverse = False):
+        """sort rows by the values of the column, or by key function that
+        gets the row"""
+        if key:
+            sort_key = lambda row_id: key(ColumnarRow(self, row_id))
+        else:
+            sort_key = lambda row_id: self._get_value(row_id, column)
+
+        self._order = array.array("l", sorted(self._order, key = sort_key, reverse = reverse))
+        self._order_dirty_from = 0
+        self._refilter()
+        if len(self._view):
+            self._notify("rows-changed", 0, len(self._view))
+
+    def filter(self, predicate = None):
+        """show only rows for which the predicate, given the row, returns
+        True. call without the predicate to show all rows again"""
+        with self.batch():
+            if len(self._view):
+                self._notify("rows-deleted", 0, len(self._view))
+            self._filter = predicate
+            self._refilter()
+            if len(self._view):
+                self._notify("rows-inserted", 0, len(self._view))
+
+    def compact(self):
+        """free the space taken by the deleted rows. the rows taken from the
+        model before are not valid afterwards"""
+        live = [row_id for row_id in xrange(self._count) if self._alive[row_id]]
+        new_ids = dict((row_id, i) for i, row_id in enumerate(live))
+
+        for i, col in enumerate(self._cols):
+            values = [col[row_id] for row_id in live]
+            self._cols[i] = array.array(col.typecode, values) if isinstance(col, array.array) else values
+
+        self._order = array.array("l", [new_ids[row_id] for row_id in self._order])
+        self._alive, self._count = bytearray([1]) * len(live), len(live)
+        self._positions = array.array("l", [-1]) * len(live)
+        self._order_positions = array.array("l", [-1]) * len(live)
+        self._order_dirty_from = 0
+        self._refilter()
+
+
+    def _refilter(self):
+        if self._filter:
+            self._view = array.array("l", [row_id for row_id in self._order
+                                           if self._filter(ColumnarRow(self, row_id))])
+        else:
+            self._view = self._order
+
+        # rows that got filtered out keep their stale positions, lookups
+        # check them against the view
+        self._dirty_from = None
+        self._renumber_from(0)
+
+    def _add_to_view(self, row_id, view_pos, order_pos):
+        """puts the row in order and in the view if it passes the filter.
+        returns True if the row is in view"""
+        self._order.insert(order_pos, row_id)
+        self._order_positions[row_id] = order_pos
+        self._reorder_from(order_pos + 1)
+        if self._filter is None:
+            visible = True # the view is the order
+        elif self._filter(ColumnarRow(self, row_id)):
+            self._view.insert(view_pos, row_id)
+            visible = True
+        else:
+            return False
+
+        self._positions[row_id] = view_pos
+        self._renumber_from(view_pos + 1)
+        return visible
+
+    def _remove_at(self, pos):
+        row_id = self._view[pos]
+        del self._view[pos]
+        if self._filter is not None:
+            order_pos = self._order_index(row_id)
+            del self._order[order_pos]
+        else:
+            order_pos = pos # the view is the order
+        self._reorder_from(order_pos)
+        self._alive[row_id] = 0
+        self._positions[row_id] = -1
+        self._renumber_from(pos)
+
+    def _add(self, row):
+        row_id = self._count
+        for col in self._cols:
+            col.append(0 if isinstance(col, array.array) else None)
+        self._alive.append(1)
+        self._positions.append(-1)
+        self._order_positions.append(-1)
+        self._count += 1
+        self._store(row_id, row)
+        return row_id
+
+    def _store(self, row_id, row):
+        if isinstance(row, (list, tuple)) == False:
+            row = [row]
+        for col_idx, val in enumerate(row):
+            self._set_value(row_id, col_idx, val)
+
+    def _get_value(self, row_id, col_idx):
+        val = self._cols[col_idx][row_id]
+        if self.columns[col_idx] is str:
+            return self._strings[val] if val >= 0 else None
+        return val
+
+    def _set_value(self, row_id, col_idx, val):
+        if self.columns[col_idx] is str:
+            if val is None:
+                val = -1
+            else:
+                string_id = self._string_ids.get(val)
+                if string_id is None:
+                    string_id = self._string_ids[val] = len(self._strings)
+                    self._strings.append(val)
+                val = string_id
+        self._cols[col_idx][row_id] = val
+
+
+class ColumnarRow(TreeModelRow):
+    """view of a row in :class:`ColumnarTreeModel`. views of the same row
+    compare equal"""
+    __slots__ = ('_model', '_id')
+
+    def __init__(self, model, row_id):
+        self._model, self._id = model, row_id
+
+    @property
+    def _parent(self):
+        return self._model
+
+    @property
+    def _row(self):
+        return list(self)
+
+    def __setitem__(self, col, val):
+        self._model._set_value(self._id, col, val)
+        self._model._on_row_changed(self, col)
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [self._model._get_value(self._id, i) for i in range(len(self._model.columns))[col]]
+        if col < 0:
+            col += len(self._model.columns)
+        return self._model._get_value(self._id, col)
+
+    def __iter__(self):
+        for col in range(len(self._model.columns)):
+            yield self._model._get_value(self._id, col)
+
+    def __len__(self):
+        return len(self._model.columns)
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnarRow) and other._model is self._model and other._id == self._id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self._model), self._id))
+
+    def __repr__(self):
+        return "<ColumnarRow %d %s>" % (self._id, str(self._row))
@@ -8,10 +8,225 @@ from gi.repository import Gdk as gdk
 from gi.repository import GObject as gobject
 
 import re
+from bisect import bisect
 from lib import graphics
 
 from ui import Bin, Viewport, ScrollArea, Button, Table, Label, Widget
 from gi.repository import Pango as pango
+from gi.repository import PangoCairo as pangocairo
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class _Line(object):
+    """a laid out line. start and end are indexes in the whole text,
+    coordinates are in pixels relative to the label"""
+    __slots__ = ('start', 'end', 'x', 'y', 'width', 'height', 'number')
+
+    def __init__(self, start, end, x, y, width, height, number):
+        self.start, self.end = start, end
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.number = number
+
+
+class _Paragraph(object):
+    __slots__ = ('text', 'layout', 'start', 'x', 'y', 'width', 'height', 'lines')
+
+    def __init__(self, text, layout):
+        self.text, self.layout = text, layout
+        self.start, self.x, self.y = 0, 0, 0
+        self.width, self.height = layout.get_pixel_size()
+        self.lines = None # (start, length, x, y, width, height), relative to the paragraph
+
+    def get_lines(self):
+        if self.lines is None:
+            self.lines = []
+            iter = self.layout.get_iter()
+            while True:
+                line = iter.get_line_readonly()
+                ink, logical = iter.get_line_extents()
+                self.lines.append((line.start_index, line.length,
+                                   logical.x / pango.SCALE, logical.y / pango.SCALE,
+                                   logical.width / pango.SCALE, logical.height / pango.SCALE))
+                if not iter.next_line():
+                    break
+        return self.lines
+
+
+class _TextLayout(object):
+    """Layout of the entry text split in paragraphs, each with its own pango
+    layout. On text change only the paragraphs that have changed are laid
+    out again. Lines and cursor positions are cached until the next change.
+    Text with markup from a formatter is laid out as a single paragraph, as
+    the tags can span over lines."""
+    def __init__(self):
+        self.paragraphs = []
+        self.width, self.height = 0, 0
+        self._settings = None
+        self._markup = None
+        self._starts, self._ys = [], []
+        self._lines, self._line_starts = None, None
+        self._positions = {}
+
+    def set_text(self, text, markup = None, settings = None):
+        """lay out the text. settings is the tuple of font_desc, width, wrap,
+        ellipsize, alignment and single_paragraph that the paragraphs are
+        configured with - when it changes, everything is laid out again"""
+        font_desc, width, wrap, ellipsize, alignment, single_paragraph = settings
+        settings_key = (graphics._font_key(font_desc), width, wrap, ellipsize,
+                        alignment, single_paragraph)
+        if settings_key != self._settings or markup or self._markup:
+            self._settings, self.paragraphs = settings_key, []
+        self._markup = markup
+
+        if markup:
+            texts, markups = [text], [markup]
+        else:
+            texts = [text] if single_paragraph else text.split("\n")
+            markups = None
+
+        # keep the paragraphs that have not changed from either end
+        old = self.paragraphs
+        head = 0
+        while head < min(len(old), len(texts)) and old[head].text == texts[head]:
+            head += 1
+        tail = 0
+        while tail < min(len(old), len(texts)) - head and old[-tail-1].text == texts[-tail-1]:
+            tail += 1
+
+        paragraphs = old[:head]
+        for i in range(head, len(texts) - tail):
+            # the paragraphs hold on to their layouts, so these are not
+            # taken from the measuring pool
+            layout = pangocairo.create_layout(graphics.text_measure_cache._context)
+            graphics.text_measure_cache.configure_layout(layout, font_desc,
+                                                         markups[i] if markups else _escape(texts[i]),
+                                                         width, wrap, ellipsize,
+                                                         alignment, single_paragraph)
+            paragraphs.append(_Paragraph(texts[i], layout))
+        if tail:
+            paragraphs.extend(old[-tail:])
+
+        self.paragraphs = paragraphs
+        self._reposition(width, alignment)
+
+    def _reposition(self, width, alignment):
+        self.width = max(paragraph.width for paragraph in self.paragraphs)
+        align = 0
+        if width == -1 and alignment == pango.Alignment.CENTER:
+            align = 0.5
+        elif width == -1 and alignment == pango.Alignment.RIGHT:
+            align = 1
+
+        start, y = 0, 0
+        for paragraph in self.paragraphs:
+            # without the width pango aligns paragraphs within the widest one
+            paragraph.start, paragraph.x, paragraph.y = start, (self.width - paragraph.width) * align, y
+            start += len(paragraph.text) + 1
+            y += paragraph.height
+        self.height = y
+
+        self._starts = [paragraph.start for paragraph in self.paragraphs]
+        self._ys = [paragraph.y for paragraph in self.paragraphs]
+        self._lines, self._line_starts = None, None
+        self._positions = {}
+
+    def _paragraph_at(self, index):
+        return self.paragraphs[max(bisect(self._starts, index) - 1, 0)]
+
+    def index_to_pos(self, index):
+        """returns x, y, width, height of the character at the index"""
+        pos = self._positions.get(index)
+        if pos is None:
+            paragraph = self._paragraph_at(index)
+            ext = paragraph.layout.index_to_pos(index - paragraph.start)
+            pos = self._positions[index] = [ext.x / pango.SCALE + paragraph.x,
+                                            ext.y / pango.SCALE + paragraph.y,
+                                            ext.width / pango.SCALE,
+                                            ext.height / pango.SCALE]
+        return pos
+
+    def xy_to_index(self, x, y):
+        """returns index of the character closest to the given point"""
+        paragraph = self.paragraphs[max(bisect(self._ys, y) - 1, 0)]
+        inside, index, trailing = paragraph.layout.xy_to_index(int((x - paragraph.x) * pango.SCALE),
+                                                               int((y - paragraph.y) * pango.SCALE))
+        return paragraph.start + index + trailing
+
+    def get_lines(self):
+        """returns list of all the lines"""
+        if self._lines is None:
+            self._lines = []
+            for paragraph in self.paragraphs:
+                for start, length, x, y, width, height in paragraph.get_lines():
+                    self._lines.append(_Line(paragraph.start + start,
+                                             paragraph.start + start + length,
+                                             paragraph.x + x, paragraph.y + y,
+                                             width, height, len(self._lines)))
+            self._line_starts = [line.start for line in self._lines]
+        return self._lines
+
+    def get_line(self, index):
+        """returns the line the index is on"""
+        lines = self.get_lines()
+        return lines[max(bisect(self._line_starts, index) - 1, 0)]
+
+    def get_line_end(self, line):
+        """index before the whitespace that the line has been wrapped at, or
+        end of the paragraph"""
+        lines = self.get_lines()
+        if line.number + 1 < len(lines) and lines[line.number + 1].start == line.end \
+           and line.end > line.start:
+            return line.end - 1
+        return line.end
+
+    def get_selection_rects(self, start, end):
+        """returns x, y, width, height rectangles covering the selection,
+        one per line"""
+        rects = []
+        lines = self.get_lines()
+        for line in lines[self.get_line(start).number:self.get_line(end).number + 1]:
+            x1 = self.index_to_pos(start)[0] if start >= line.start else line.x
+            x2 = self.index_to_pos(end)[0] if end <= line.end else line.x + line.width
+            rects.append((min(x1, x2), line.y, abs(x2 - x1), line.height))
+        return rects
+
+
+class _EntryLabel(graphics.Label):
+    """label that lays out and draws its text paragraph by paragraph"""
+    def measure(self, text, escape = True, max_width = None):
+        if max_width is not None:
+            return graphics.Label.measure(self, text, escape, max_width)
+
+        text_layout = self.__dict__.get("text_layout")
+        if text_layout is None:
+            text_layout = self.__dict__["text_layout"] = _TextLayout()
+
+        settings = (self.font_desc, self._get_layout_width(), self.wrap,
+                    self.ellipsize, self.alignment, self.single_paragraph)
+        if escape:
+            text_layout.set_text(text, None, settings)
+        else:
+            text_layout.set_text(self.text, text, settings)
+        return text_layout.width, text_layout.height
+
+    def on_render(self, sprite):
+        if self.markup or self.max_width:
+            return graphics.Label.on_render(self, sprite)
+
+        self.graphics.set_color(self.color)
+        for paragraph in self.text_layout.paragraphs:
+            # the paragraphs have been shaped when measuring, draw those
+            self.graphics.move_to(paragraph.x, paragraph.y)
+            self.graphics.show_pango_layout(paragraph.layout)
+
+        rect_width = self.width
+        if self._bounds_width:
+            rect_width = self._bounds_width / pango.SCALE
+        self.graphics.rectangle(0, 0, rect_width, self.height)
+        self.graphics.clip()
 
 
 class Entry(Bin):
@@ -37,7 +252,7 @@ class Entry(Bin):
                  font_desc = None, **kwargs):
         Bin.__init__(self, **kwargs)
 
-        self.display_label = graphics.Label(color=self.color)
+        self.display_label = _EntryLabel(color=self.color)
 
         self.viewport = Viewport(self.display_label)
         self.viewport.connect("on-render", self.__on_viewport_render)
@@ -119,7 +334,7 @@ class Entry(Bin):
         if name == "text":
             val = val or ""
             if getattr(self, "text_formatter", None):
-                markup = self.text_formatter(val.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+                markup = self.text_formatter(_escape(val))
 
             if markup:
                 self.display_label.markup = markup
@@ -190,18 +405,13 @@ class Entry(Bin):
 
 
     def _index_to_pos(self, index):
-        """give coordinates for the position in text. maps to the
-        display_label's pango function"""
-        ext = self.display_label._test_layout.index_to_pos(index)
-        extents = [e / pango.SCALE for e in (ext.x, ext.y, ext.width, ext.height)]
-        return extents
+        """give coordinates for the position in text"""
+        return self.display_label.text_layout.index_to_pos(index)
 
     def _xy_to_index(self, x, y):
-        """from coordinates caluculate position in text. maps to the
-        display_label's pango function"""
+        """from coordinates caluculate position in text"""
         x = x - self.display_label.x - self.viewport.x
-        index = self.display_label._test_layout.xy_to_index(int(x*pango.SCALE), int(y*pango.SCALE))
-        return index[0] + index[1]
+        return self.display_label.text_layout.xy_to_index(x, y)
 
 
     def __on_focus(self, sprite):
@@ -262,12 +472,9 @@ class Entry(Bin):
             self.selection_start = self._selection_start_position
             self.selection_end = self.cursor_position
 
-    def _get_iter(self, index = 0):
-        """returns iterator that has been run till the specified index"""
-        iter = self.display_label._test_layout.get_iter()
-        for i in range(index):
-            iter.next_char()
-        return iter
+    def _get_line(self, index):
+        """returns the laid out line the index is on"""
+        return self.display_label.text_layout.get_line(index)
 
     def _do_key_press(self, event):
         """responding to key events"""
@@ -329,25 +536,12 @@ class Entry(Bin):
                 self.cursor_position = self.selection_end
 
         elif key == gdk.KEY_Up and self.single_paragraph == False:
-            iter = self._get_iter(self.cursor_position)
-
-            if str(iter.get_line_readonly()) != str(self.display_label._test_layout.get_line_readonly(0)):
-                char_pos = iter.get_char_extents().x
-                char_line = str(iter.get_line_readonly())
+            line = self._get_line(self.cursor_position)
 
-                # now we run again to run until previous line
-                prev_iter, iter = self._get_iter(), self._get_iter()
-                prev_line = None
-                while str(iter.get_line_readonly()) != char_line:
-                    if str(prev_line) != str(iter.get_line_readonly()):
-                        prev_iter = iter.copy()
-                        prev_line = iter.get_line_readonly()
-                    iter.next_char()
-
-                index = prev_iter.get_line_readonly().x_to_index(char_pos - prev_iter.get_char_extents().x)
-                index = index[1] + index[2]
-
-                self.cursor_position = index
+            if line.number > 0:
+                prev_line = self.display_label.text_layout.get_lines()[line.number - 1]
+                char_x = self._index_to_pos(self.cursor_position)[0]
+                self.cursor_position = self.display_label.text_layout.xy_to_index(char_x, prev_line.y + prev_line.height / 2.0)
 
                 if shift:
                     if self.cursor_position < self.selection_start:
@@ -359,13 +553,13 @@ class Entry(Bin):
 
 
         elif key == gdk.KEY_Down and self.single_paragraph == False:
-            iter = self._get_iter(self.cursor_position)
-            char_pos = iter.get_char_extents().x
+            line = self._get_line(self.cursor_position)
+            lines = self.display_label.text_layout.get_lines()
 
-            if iter.next_line():
-                index = iter.get_line_readonly().x_to_index(char_pos - iter.get_char_extents().x)
-                index = index[1] + index[2]
-                self.cursor_position = index
+            if line.number + 1 < len(lines):
+                next_line = lines[line.number + 1]
+                char_x = self._index_to_pos(self.cursor_position)[0]
+                self.cursor_position = self.display_label.text_layout.xy_to_index(char_x, next_line.y + next_line.height / 2.0)
 
                 if shift:
                     if self.cursor_position > self.selection_end:
@@ -383,19 +577,10 @@ class Entry(Bin):
                     self.selection_end = self.selection_start
                     self.selection_start = self.cursor_position
             else:
-                iter = self._get_iter(self.cursor_position)
-                line = str(iter.get_line_readonly())
-
-                # find the start of the line
-                iter = self._get_iter()
-                while str(iter.get_line_readonly()) != line:
-                    iter.next_char()
-                self.cursor_position = iter.get_index()
+                self.cursor_position = self._get_line(self.cursor_position).start
 
                 if shift:
-                    start_iter = self._get_iter(self.selection_start)
-                    end_iter = self._get_iter(self.selection_end)
-                    if str(start_iter.get_line_readonly()) == str(end_iter.get_line_readonly()):
+                    if self._get_line(self.selection_start) is self._get_line(self.selection_end):
                         self.selection_end = self.selection_start
                         self.selection_start = self.cursor_position
                     else:
@@ -411,25 +596,11 @@ class Entry(Bin):
                     self.selection_start = self.selection_end
                     self.selection_end = self.cursor_position
             else:
-                iter = self._get_iter(self.cursor_position)
-
-                #find the end of the line
-                line = str(iter.get_line_readonly())
-                prev_iter = None
-
-                while str(iter.get_line_readonly()) == line:
-                    prev_iter = iter.copy()
-                    moved = iter.next_char()
-                    if not moved:
-                        prev_iter = iter
-                        break
-
-                self.cursor_position = prev_iter.get_index()
+                line = self._get_line(self.cursor_position)
+                self.cursor_position = self.display_label.text_layout.get_line_end(line)
 
                 if shift:
-                    start_iter = self._get_iter(self.selection_start)
-                    end_iter = self._get_iter(self.selection_end)
-                    if str(start_iter.get_line_readonly()) == str(end_iter.get_line_readonly()):
+                    if self._get_line(self.selection_start) is self._get_line(self.selection_end):
                         self.selection_start = self.selection_end
                         self.selection_end = self.cursor_position
                     else:
@@ -559,37 +730,9 @@ class Entry(Bin):
             return # all done!
 
 
-        start_x, start_y, start_w, start_h = self._index_to_pos(self.selection_start)
-        end_x, end_y, end_w, end_h = self._index_to_pos(self.selection_end)
-
-
-        iter = self._get_iter(self.selection_start)
-
-        char_exts = iter.get_char_extents()
-        cur_x, cur_y = char_exts.x / pango.SCALE, char_exts.y / pango.SCALE + self.display_label.y
-
-        cur_line = None
-        for i in range(self.selection_end - self.selection_start):
-            prev_iter = pango.LayoutIter.copy(iter)
-            iter.next_char()
-
-            line = iter.get_line_readonly()
-            if str(cur_line) != str(line): # can't compare layout lines for some reason
-                exts = prev_iter.get_char_extents()
-                char_exts = [ext / pango.SCALE for ext in (exts.x, exts.y, exts.width, exts.height)]
-                viewport.graphics.rectangle(cur_x + self.display_label.x, cur_y,
-                                            char_exts[0] + char_exts[2] - cur_x, char_exts[3])
-
-                char_exts = iter.get_char_extents()
-                cur_x, cur_y = char_exts.x / pango.SCALE, char_exts.y / pango.SCALE + self.display_label.y
-
-            cur_line = line
-
-        exts = iter.get_char_extents()
-        char_exts = [ext / pango.SCALE for ext in  (exts.x, exts.y, exts.width, exts.height)]
-
-        viewport.graphics.rectangle(cur_x + self.display_label.x, cur_y,
-                                    char_exts[0] - cur_x, self.display_label.y + char_exts[1] - cur_y + char_exts[3])
+        text_layout = self.display_label.text_layout
+        for x, y, w, h in text_layout.get_selection_rects(self.selection_start, self.selection_end):
+            viewport.graphics.rectangle(x + self.display_label.x, y + self.display_label.y, w, h)
         viewport.graphics.fill(self.selection_color)
 
 
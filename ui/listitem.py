@@ -9,7 +9,6 @@ from gi.repository import GObject as gobject
 
 from ui import Widget, Label, TreeModel, TreeModelRow, Entry, VBox, HBox, Button, ScrollArea, Fixed
 from lib import graphics
-from bisect import bisect
 from gi.repository import Pango as pango
 
 class Renderer(Widget):
@@ -26,6 +25,11 @@ class Renderer(Widget):
     def get_min_size(self, row):
         return max(self.min_width or 0, 10), max(self.min_height or 0, 10)
 
+    def get_height_for_width(self, data, width):
+        """height the cell needs to show the data in given width. by default
+        the minimum height"""
+        return self.get_min_size(None)[1]
+
     def get_mouse_cursor(self):
         return False
 
@@ -58,6 +62,10 @@ class LabelRenderer(Renderer):
     padding = 5
     expand = True
 
+    #: what to do when the text does not fit. pango.EllipsizeMode to cut it,
+    #: or pango.WrapMode to wrap it, which makes the rows as tall as needed
+    overflow = pango.EllipsizeMode.END
+
     color = "#333" #: font color
     color_current = "#fff" #: font color when the row is selected
 
@@ -66,7 +74,7 @@ class LabelRenderer(Renderer):
 
     def __init__(self, **kwargs):
         Renderer.__init__(self, **kwargs)
-        self.label = Label(padding = self.padding, overflow = pango.EllipsizeMode.END)
+        self.label = Label(padding = self.padding, overflow = self.overflow)
         self.label.graphics = self.graphics
         self._prev_dict = {}
 
@@ -75,12 +83,23 @@ class LabelRenderer(Renderer):
 
     def __setattr__(self, name, val):
         Widget.__setattr__(self, name, val)
-        if name.startswith("padding") and hasattr(self, "label"):
+        if (name.startswith("padding") or name == "overflow") and hasattr(self, "label"):
             setattr(self.label, name, val)
 
     def get_min_size(self, row):
         return max(self.min_width or 0, 10), max(self.min_height or 0, self.label.vertical_padding + 15)
 
+    def get_height_for_width(self, data, width):
+        min_height = self.get_min_size(None)[1]
+        if not isinstance(self.overflow, pango.WrapMode):
+            return min_height
+
+        self.set_data(data)
+        self.label.alloc_w = width
+        height = self.label.get_height_for_width_size()[1]
+        self.restore_data()
+        return max(min_height, height)
+
     def get_mouse_cursor(self):
         if self.editable:
             return gdk.CursorType.XTERM
@@ -139,6 +158,89 @@ class LabelRenderer(Renderer):
 
 
 
+class _RowHeights(object):
+    """heights of the rows with a fenwick tree on top, so that positions of
+    rows and the row at a position are found in log(n) steps"""
+    def __init__(self, count, height):
+        self.heights = [height] * count
+        # node i holds the sum of the (i & -i) rows ending with row i - 1
+        self._tree = [0] + [(i & -i) * height for i in xrange(1, count + 1)]
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.heights)
+
+    def _rebuild(self):
+        tree = [0] + self.heights
+        count = len(tree)
+        for i in xrange(1, count):
+            parent = i + (i & -i)
+            if parent < count:
+                tree[parent] += tree[i]
+        self._tree, self._dirty = tree, False
+
+    def set(self, idx, height):
+        delta = height - self.heights[idx]
+        if not delta:
+            return
+        self.heights[idx] = height
+        if self._dirty:
+            return
+
+        tree, i = self._tree, idx + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def offset(self, idx):
+        """sum of the heights of the rows before the given one"""
+        if self._dirty:
+            self._rebuild()
+        tree, total = self._tree, 0
+        while idx > 0:
+            total += tree[idx]
+            idx -= idx & -idx
+        return total
+
+    def total(self):
+        return self.offset(len(self.heights))
+
+    def find(self, y):
+        """index of the row at y. rows past the end give len"""
+        if self._dirty:
+            self._rebuild()
+        tree, count = self._tree, len(self.heights)
+        pos, step = 0, 1
+        while step * 2 <= count:
+            step *= 2
+        while step:
+            if pos + step <= count and tree[pos + step] <= y:
+                pos += step
+                y -= tree[pos]
+            step //= 2
+        return pos
+
+    def insert(self, start, count, height):
+        if start < len(self.heights) or self._dirty:
+            self.heights[start:start] = [height] * count
+            self._dirty = True
+            return
+
+        # appending keeps the tree valid, just add the nodes
+        for i in xrange(count):
+            node = len(self._tree)
+            self.heights.append(height)
+            self._tree.append(height + self.offset(node - 1) - self.offset(node - (node & -node)))
+
+    def delete(self, start, count):
+        del self.heights[start:start + count]
+        if start + count >= len(self._tree) - 1 and not self._dirty:
+            # nodes depend only on rows before them so trimming is fine
+            del self._tree[len(self.heights) + 1:]
+        else:
+            self._dirty = True
+
+
 class ListView(Widget):
     """a widget for displaying selection lists"""
     __gsignals__ = {
@@ -177,10 +279,17 @@ class ListView(Widget):
         #: asking cell renderers. defaults to None.
         self.row_height = row_height
 
+        #: height assumed for the rows that have not been on screen yet, and
+        #: so have not been measured. defaults to the minimum row height
+        self.estimated_row_height = None
+
         self._search_string = ""
         self._search_timeout = None
 
-        self._row_pos = None # cache of row positions
+        self._heights = None # heights of the rows, measured or estimated
+        self._measured = None # which rows have been measured
+        self._measured_width = None
+        self._col_widths = None # ((width, renderer min widths), column widths)
 
         self._hover_row = None
 
@@ -222,16 +331,20 @@ class ListView(Widget):
         Widget.__setattr__(self, name, val)
 
         if new_rows:
-            self._on_row_deleted(self.rows)
+            self._on_rows_reset()
 
         if row_changed:
             self.emit("on-change", val if val else None)
 
         if name == "rows":
-            changed = self.rows.connect("row-changed", self._on_row_changed)
-            deleted = self.rows.connect("row-deleted", self._on_row_deleted)
-            inserted = self.rows.connect("row-inserted", self._on_row_inserted)
+            changed = self.rows.connect("rows-changed", self._on_rows_changed)
+            deleted = self.rows.connect("rows-deleted", self._on_rows_deleted)
+            inserted = self.rows.connect("rows-inserted", self._on_rows_inserted)
             self._data_change_listeners = [changed, deleted, inserted]
+            self._heights = self._measured = None
+        elif name in ("row_height", "estimated_row_height", "renderers"):
+            self._heights = self._measured = None
+            self._col_widths = None
         elif name == "padding":
             for renderer in self.renderers:
                 renderer.padding = val
@@ -255,7 +368,7 @@ class ListView(Widget):
             renderer_w, renderer_h = renderer.get_min_size(None)
             w += renderer_w
 
-        return w, self._get_row_pos()[-1] + self.get_row_height()
+        return w, self._get_heights().total()
 
     def get_col_at_x(self, x):
         col_x, mouse_cursor = 0, False
@@ -323,7 +436,7 @@ class ListView(Widget):
 
                 # somewhat a mad way to get the cell data for editor
                 cell = self.get_cell(col_x + 1,
-                                     row_num * self.get_row_height() + 1)
+                                     self._get_heights().offset(row_num) + 1)
 
                 self.renderers[col_num].show_editor(self, cell)
 
@@ -341,7 +454,7 @@ class ListView(Widget):
         row = self.get_row_at_y(y)
         col = self.renderers.index(target_renderer)
 
-        row_height = self.get_row_height()
+        heights = self._get_heights()
 
         return {
             'data': self.rows[row][col],
@@ -349,9 +462,9 @@ class ListView(Widget):
             'row': row,
             'col': col,
             'x': col_x,
-            'y': self.get_row_position(self.rows[row]),
+            'y': heights.offset(row),
             'width': width,
-            'height': row_height
+            'height': heights.heights[row]
         }
 
 
@@ -369,7 +482,13 @@ class ListView(Widget):
 
 
     def _get_col_widths(self):
-        """determine column widths and minimum row height"""
+        """determine column widths"""
+        # the widths depend on our width and the minimum widths of renderers
+        key = (self.width, [(renderer.get_min_size(None)[0], renderer.expand)
+                            for renderer in self.renderers])
+        if self._col_widths and self._col_widths[0] == key:
+            return self._col_widths[1]
+
         widths = []
 
         remaining_space = self.width
@@ -398,6 +517,7 @@ class ListView(Widget):
 
             widths.append(w)
 
+        self._col_widths = (key, widths)
         return widths
 
     def get_row_height(self):
@@ -408,31 +528,29 @@ class ListView(Widget):
         return row_height
 
     def get_visible_range(self):
-        """returns index of the first and last row visible"""
-        # suboptimal workaround for case when the list is packed in a vbox and then in a scrollbox
-        # TODO - generalize and sniff out the actual crop area
-        if self.parent and self.parent.parent and self.parent.parent and isinstance(self.parent.parent.parent, ScrollArea):
-            scrollbox = self.parent.parent
-            list_y = self.y + self.parent.y
-        else:
-            list_y = self.y
-            scrollbox = self.parent
+        """returns index of the first visible row and the one after the last"""
+        rect = self.get_visible_rect()
+        if not rect:
+            return 0, 0
 
-        row_height = self.get_row_height()
-        first_row = int(-list_y / row_height)
-        last_row = int((-list_y + scrollbox.height) / row_height)
+        x, y, w, h = rect
+        heights = self._get_heights()
+        first_row = heights.find(y)
+        last_row = heights.find(y + h)
 
-        return max(first_row, 0), min(last_row + 1, len(self.rows))
+        return min(first_row, len(self.rows)), min(last_row + 1, len(self.rows))
 
 
     def _draw(self, context, opacity=1, *args, **kwargs):
-
-        self.get_visible_range()
-
         col_widths = self._get_col_widths()
         width = self.width
 
-        row_height = self.get_row_height()
+        heights = self._get_heights()
+        if self._measured_width != width:
+            # wrapping depends on the width, measure again
+            self._measured = bytearray(len(heights))
+            self._measured_width = width
+        resized = False
 
         g = graphics.Graphics(context)
 
@@ -440,21 +558,30 @@ class ListView(Widget):
         Widget._draw(self, context, opacity, *args, **kwargs)
         editor = None
 
-        # suboptimal workaround for case when the list is packed in a vbox and then in a scrollbox
-        # TODO - generalize and sniff out the actual crop area
-        if self.parent and self.parent.parent and self.parent.parent and isinstance(self.parent.parent.parent, ScrollArea):
-            scrollbox = self.parent.parent
-            list_y = self.y + self.parent.y
-        else:
-            list_y = self.y
-            scrollbox = self.parent
+        rect = self.get_visible_rect()
+        if not rect:
+            return
 
-        g.rectangle(0, 0, scrollbox.width, scrollbox.height)
+        visible_x, visible_y, visible_w, visible_h = rect
+        g.rectangle(self.x + visible_x, self.y + visible_y, visible_w, visible_h)
         g.clip()
 
-        for row_idx in range(*self.get_visible_range()):
-            y = row_idx * row_height
+        first_row = min(heights.find(visible_y), len(self.rows))
+        y, bottom = heights.offset(first_row), visible_y + visible_h
+        for row_idx in xrange(first_row, len(self.rows)):
+            if y > bottom:
+                break
+
             row = self.rows[row_idx]
+            if not self._measured[row_idx]:
+                # rows below move as the row gets its height, so we go on
+                # until the screen is full instead of the estimated range
+                row_height = self._measure_row(row, col_widths)
+                if row_height != heights.heights[row_idx]:
+                    heights.set(row_idx, row_height)
+                    resized = True
+                self._measured[row_idx] = 1
+            row_height = heights.heights[row_idx]
 
 
             state = "normal"
@@ -464,7 +591,7 @@ class ListView(Widget):
                 state = "highlight"
 
             context.save()
-            context.translate(x, y + self.y)
+            context.translate(x + self.x, y + self.y)
             context.rectangle(0, 0, width, row_height)
 
             self.paint_row_background(g, row_idx, state, self.enabled)
@@ -485,12 +612,15 @@ class ListView(Widget):
                 col_x += col_width
 
             context.restore()
+            y += row_height
 
+        if resized and self.parent:
+            self.parent.queue_resize()
 
         if editor:
             # repaint editor as it is stepped all over
             context.save()
-            context.translate(0, self.y)
+            context.translate(self.x, self.y)
             editor._draw(context, parent_matrix = self.get_matrix())
             context.restore()
 
@@ -512,49 +642,72 @@ class ListView(Widget):
             graphics.fill_preserve(self.background_odd)
 
 
-    def _get_row_pos(self):
-        if self._row_pos:
-            return self._row_pos
-        row_height = self.get_row_height()
+    def _get_heights(self):
+        if self._heights is None:
+            self._heights = _RowHeights(len(self.rows), self._get_estimated_height())
+            self._measured = bytearray(len(self.rows))
+        return self._heights
 
-        w, h, pos = 0, 0, []
-        for row in self.rows:
-            pos.append(h)
-            h = h + row_height
+    def _get_estimated_height(self):
+        return self.row_height or self.estimated_row_height or self.get_row_height()
 
-        self._row_pos = pos
+    def _measure_row(self, row, col_widths):
+        if self.row_height:
+            return self.row_height
 
-        return pos
+        height = 0
+        for data, renderer, col_width in zip(row, self.renderers, col_widths):
+            height = max(height, renderer.get_height_for_width(data, col_width))
+        return height
 
     def get_row_at_y(self, y):
-        return bisect(self._get_row_pos(), y) - 1
+        if y < 0:
+            return -1
+        return min(self._get_heights().find(y), len(self.rows) - 1)
 
     def get_row_position(self, row):
         if row in self.rows:
-            return self._get_row_pos()[self.rows.index(row)]
+            return self._get_heights().offset(self.rows.index(row))
         return 0
 
     def on_doubleclick(self, sprite, event):
         if self.current_row:
             self.emit("on-select", self.current_row)
 
-    def _on_row_changed(self, model, row_idx):
-        self._row_pos = None
+    def _on_rows_changed(self, model, start, count):
+        if self._measured is not None:
+            # keep the heights as estimates until the rows are seen again
+            self._measured[start:start + count] = bytearray(count)
+        self.redraw()
+
+    def _on_rows_deleted(self, model, start, count):
+        if self.current_row and self.current_row not in self.rows:
+            self.current_row = None
+        if self._hover_row and self._hover_row not in self.rows:
+            self._hover_row = None
+
+        if self._heights is not None:
+            self._heights.delete(start, count)
+            del self._measured[start:start + count]
         if self.parent:
             self.parent.queue_resize()
 
-    def _on_row_deleted(self, model):
+    def _on_rows_inserted(self, model, start, count):
+        if self._heights is not None:
+            self._heights.insert(start, count, self._get_estimated_height())
+            self._measured[start:start] = bytearray(count)
+        if self.parent:
+            self.parent.queue_resize()
+
+    def _on_rows_reset(self):
         if self.current_row and self.current_row not in self.rows:
             self.current_row = None
         if self._hover_row and self._hover_row not in self.rows:
             self._hover_row = None
 
-        self._row_pos = None
-        self.parent.queue_resize()
-
-    def _on_row_inserted(self, row_idx):
-        self._row_pos = None
-        self.parent.queue_resize()
+        self._heights = self._measured = None
+        if self.parent:
+            self.parent.queue_resize()
 
     def __on_key_press(self, sprite, event):
         if self.current_row:
@@ -640,9 +793,8 @@ class ListView(Widget):
 
         # if parent has not been allocated height yet, there is something funky going on
         # TODO - demistify
-        if self.parent.height > 0:
-            for renderer in self.renderers:
-                label_h = max(label_h, renderer.get_min_size(label)[1])
+        if self.parent.height > 0 and label in self.rows:
+            label_h = self._get_heights().heights[self.rows.index(label)]
 
         y = 0 if hasattr(self.parent.parent, "vscroll") else self.y
         if label_y + self.y + self.parent.y < 0:
@@ -77,6 +77,11 @@ class Widget(graphics.Sprite):
     #: (x, y) offset from the calculated position of the tooltip to appear
     tooltip_offset = None
 
+    #: whether the widget clips its children to its bounds, like
+    #: :class:`~ui.containers.Viewport` does. taken into account by
+    #: :func:`get_visible_rect`
+    clips_children = False
+
 
     def __init__(self, width = None, height = None, expand = None, fill = None,
                  expand_vert = None, x_align = None, y_align = None,
@@ -275,6 +280,36 @@ class Widget(graphics.Sprite):
             parent.queue_resize()
 
 
+    def get_visible_rect(self):
+        """returns (x, y, width, height) of the part of the widget that is
+        not clipped away by the containers it is in nor falls off the scene,
+        in widget's coordinates. None if nothing of the widget is visible.
+        Large widgets can use it to draw and hit-test just what is on screen.
+
+        Only the x and y offsets of the widget and its containers are taken
+        into account, the rectangle is off for scaled or rotated ones"""
+        x, y, x2, y2 = 0, 0, self.width or 0, self.height or 0
+        offset_x, offset_y = 0, 0 # position of the ancestor in our coordinates
+
+        sprite = self
+        while isinstance(sprite.parent, graphics.Sprite):
+            offset_x, offset_y = offset_x - sprite.x, offset_y - sprite.y
+            sprite = sprite.parent
+            if sprite.clips_children if isinstance(sprite, Widget) else False:
+                x, y = max(x, offset_x), max(y, offset_y)
+                x2, y2 = min(x2, offset_x + sprite.width), min(y2, offset_y + sprite.height)
+
+        scene = sprite.parent
+        if isinstance(scene, graphics.Scene) and scene.width is not None:
+            offset_x, offset_y = offset_x - sprite.x, offset_y - sprite.y
+            x, y = max(x, offset_x), max(y, offset_y)
+            x2, y2 = min(x2, offset_x + scene.width), min(y2, offset_y + scene.height)
+
+        if x2 <= x or y2 <= y:
+            return None
+        return x, y, x2 - x, y2 - y
+
+
     def get_min_size(self):
         """returns size required by the widget"""
         if self.visible == False:
@@ -224,7 +224,7 @@ class Spinner(Container):
         self.active = active
 
         self._scene = None
-        self.expose_handler = None
+        self._tick_timeout = None
 
         #: number of beams in the progress indicator
         self.edges = 11
@@ -235,13 +235,17 @@ class Spinner(Container):
 
         #: motion speed. the higher the number the slower the redraw is performed
         self.speed = 2
-        self._frame = 0
 
         self._spinner = graphics.Sprite(cache_as_bitmap = False)
         self.connect_child(self._spinner, "on-render", self.on_spinner_render)
         self.add_child(self._spinner)
 
 
+    def __setattr__(self, name, val):
+        Container.__setattr__(self, name, val)
+        if name == "active" and val and getattr(self, "_scene", None):
+            self._start_ticking()
+
     def get_min_size(self):
         need = max(self.min_height or 20, self.min_width or 20)
         return need, need
@@ -253,19 +257,29 @@ class Spinner(Container):
         self._spinner.x, self._spinner.y = self.outer_radius / 2.0 + (self.width - self.outer_radius) * self.x_align, \
                                          self.outer_radius / 2.0 + (self.height - self.outer_radius) * self.y_align
 
-    def on_finish_frame(self, scene, context):
-        if self.active:
-            if self._frame % self.speed == 0:
-                self._spinner.rotation += math.pi * 2 / self.edges
+    def _start_ticking(self):
+        if self._tick_timeout is None:
+            # ticks every speed frames; follows the scene when it slows down
+            # while hidden. between the ticks the spinner does not ask for frames
+            interval = self.speed / float(self._scene.get_effective_framerate())
+            self._tick_timeout = self._scene.clock.timeout_add(interval, self._on_tick)
+
+    def _on_tick(self):
+        self._tick_timeout = None
+        self._scene = self.get_scene()
+        if not self.active or not self._scene:
+            return False
 
-            self._frame +=1
-            scene.redraw()
+        self._spinner.rotation += math.pi * 2 / self.edges
+        self._spinner.redraw() # repaints just the spinner in partial redraw mode
+        self._start_ticking()
+        return False
 
     def on_spinner_render(self, spinner):
         spinner.graphics.save_context()
-        if not self.expose_handler:
-            self._scene = self.get_scene()
-            self.expose_handler = self._scene.connect("on-finish-frame", self.on_finish_frame)
+        self._scene = self.get_scene()
+        if self.active and self._scene:
+            self._start_ticking()
 
         spinner.graphics.rectangle(-self.outer_radius, -self.outer_radius, self.outer_radius * 2, self.outer_radius * 2)
         spinner.graphics.new_path()